@@ -13,6 +13,7 @@ from models.movement import ProductMovement
 from models.request import ProductRequest
 from models.notification import BranchNotification
 from models.branch_inventory import BranchInventory
+from cache import cached, init_cache
 
 # Initialize extensions
 login_manager = LoginManager()
@@ -23,6 +24,11 @@ def create_app():
     app.config.from_object(Config)
 
     db.init_app(app)
+    init_cache(app)
+    # معالج أحداث outbox (تنبيهات المخزون المنخفض وتنظيف الأحداث) يبدأ مع أول طلب
+    if app.config['OUTBOX_DISPATCHER']:
+        from events import dispatcher
+        dispatcher.init_app(app)
     login_manager.init_app(app)
     # إعداد صفحة تسجيل الدخول الافتراضية
     login_manager.login_view = 'auth.login'
@@ -61,35 +67,44 @@ def create_app():
     app.register_blueprint(customers_bp)
     from routes.reports import reports_bp
     app.register_blueprint(reports_bp)
+    from routes.search import search_bp
+    app.register_blueprint(search_bp)
 
     # Dashboard route
     @app.route("/")
     @login_required
     def dashboard():
-        users_count = User.query.count()
-        products_count = Product.query.count()
-        categories_count = Category.query.count()
-        branches_count = Branch.query.count()
-        dealers_count = Dealer.query.count()
-        movements_count = ProductMovement.query.count()
+        def dashboard_counts():
+            # إشعارات المنتجات القليلة
+            low_stock_products = Product.query.filter(Product.quantity < 10).all()
+            return {
+                'users_count': User.query.count(),
+                'products_count': Product.query.count(),
+                'categories_count': Category.query.count(),
+                'branches_count': Branch.query.count(),
+                'dealers_count': Dealer.query.count(),
+                'movements_count': ProductMovement.query.count(),
+                'notifications': [f"المنتج '{p.name}' متبقي منه {p.quantity} فقط في المخزون!" for p in low_stock_products],
+            }
 
-        # إشعارات المنتجات القليلة
-        low_stock_products = Product.query.filter(Product.quantity < 10).all()
-        notifications = []
-        for p in low_stock_products:
-            notifications.append(f"المنتج '{p.name}' متبقي منه {p.quantity} فقط في المخزون!")
-
-        return render_template('dashboard.html',
-                             users_count=users_count,
-                             products_count=products_count,
-                             categories_count=categories_count,
-                             branches_count=branches_count,
-                             dealers_count=dealers_count,
-                             movements_count=movements_count,
-                             notifications=notifications)
+        return render_template('dashboard.html', **cached(
+            'dashboard', ('users', 'products', 'categories', 'branches', 'dealers', 'product_movements'), dashboard_counts
+        ))
 
     # TODO: Register other blueprints (admin, products, stats, shifts)
 
+    @app.context_processor
+    def inject_unread_notifications():
+        # عداد شارة الإشعارات: قراءة واحدة من notification_counters بدلاً من تحميل الإشعارات
+        from models.notification_counter import NotificationCounter
+        if not current_user.is_authenticated:
+            return {}
+        if current_user.is_branch_user():
+            return {'unread_notifications_count': NotificationCounter.unread_count(current_user.branch_id)}
+        if current_user.is_admin():
+            return {'unread_notifications_count': NotificationCounter.unread_count(None)}
+        return {}
+
     @app.template_filter('get_branch_name')
     def get_branch_name(branch_id):
         from models.branch import Branch
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Script لأرشفة حركات المنتجات القديمة في جداول شهرية (product_movements_YYYY_MM)
+يُبقي في product_movements حركات آخر MOVEMENT_ARCHIVE_MONTHS شهر فقط، ويُشغّل دورياً (مثلاً شهرياً عبر cron).
+يمكن تمرير تاريخ محدد: python archive_movements.py 2024-01-01 (أرشفة كل الأشهر قبل شهر هذا التاريخ)
+"""
+
+import sys
+from datetime import datetime
+from flask import current_app
+from app import create_app
+from models import db
+from models.movement_archive import MovementArchive, month_start
+
+def archive_movements(before=None):
+    """أرشفة الحركات الأقدم من بداية شهر before (افتراضياً قبل MOVEMENT_ARCHIVE_MONTHS شهر)"""
+    db.create_all()
+    if before is None:
+        today = datetime.utcnow().date()
+        months = today.year * 12 + today.month - 1 - current_app.config['MOVEMENT_ARCHIVE_MONTHS']
+        before = month_start(datetime(months // 12, months % 12 + 1, 1))
+    print(f"🔄 جاري أرشفة الحركات قبل {month_start(before)}...")
+    rows = MovementArchive.archive(before)
+    print(f"✅ تمت أرشفة {rows} حركة، اللقطة الافتتاحية بتاريخ {MovementArchive.opening_date()}")
+
+if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        before = datetime.strptime(sys.argv[1], '%Y-%m-%d').date() if len(sys.argv) > 1 else None
+        archive_movements(before)
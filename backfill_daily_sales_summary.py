@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Script لبناء جدول ملخص المبيعات اليومي (daily_sales_summaries) من جدول المبيعات
+يُستخدم لتعبئة الجدول لأول مرة أو لإصلاحه عند الشك في صحة الإجماليات
+"""
+
+from app import create_app
+from models import db
+from models.daily_sales_summary import DailySalesSummary
+
+def backfill_daily_sales_summary():
+    """إعادة حساب ملخص كل فرع/يوم/وردية من جدول sales"""
+    db.create_all()
+    print("🔄 جاري بناء ملخص المبيعات اليومي من جدول المبيعات...")
+    rows = DailySalesSummary.rebuild()
+    print(f"✅ تم بناء {rows} ملخص يومي بنجاح!")
+
+if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        backfill_daily_sales_summary()
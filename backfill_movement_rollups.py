@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Script لبناء جدول ملخص الحركات اليومي (daily_movement_rollups) من سجل الحركات
+يقرأ الجدول الحالي وجداول الأرشيف الشهرية، ويُستخدم لتعبئة الجدول لأول مرة أو لإصلاحه عند الشك في صحة الإجماليات
+"""
+
+from app import create_app
+from models import db
+from models.daily_movement_rollup import DailyMovementRollup
+
+def backfill_movement_rollups():
+    """إعادة حساب ملخص كل يوم/فرع/منتج/نوع/وردية من سجل الحركات"""
+    db.create_all()
+    print("🔄 جاري بناء ملخص الحركات اليومي من سجل الحركات...")
+    rows = DailyMovementRollup.rebuild()
+    print(f"✅ تم بناء {rows} صف ملخص بنجاح!")
+
+if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        backfill_movement_rollups()
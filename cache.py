@@ -0,0 +1,235 @@
+"""
+كاش نتائج القراءة المتكررة: كاش مسح الباركود في نقطة البيع، وكاش البيانات المجمعة للوحات والواجهات JSON
+
+التطبيق يعمل كعملية واحدة (python app.py)، لذلك يكفي تفريغ الكاش من أحداث الجلسة بعد commit.
+كاش البيانات المجمعة يمكن أن يكون مشتركاً بين عدة عمليات عبر ملف SQLite (RESPONSE_CACHE_PATH)،
+وعندها يتم التفريغ بزيادة أرقام إصدار الوسوم في نفس الملف فيراه كل العمال.
+"""
+
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import threading
+import time
+from sqlalchemy import event
+from models import db
+from models.cache_tags import CACHE_TAGS_KEY
+from models.catalog_version import CATALOG_CHANGES_KEY
+
+# أقصى عدد باركودات محفوظة في كاش المسح
+SCAN_CACHE_SIZE = 4096
+
+
+class LRUCache:
+    """كاش محدود الحجم يحذف العنصر الأقدم استخداماً عند الامتلاء (آمن مع الخيوط)"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # يزيد مع كل تفريغ، لمنع حفظ قيمة قُرئت من قاعدة البيانات قبل التفريغ
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        """حفظ قيمة؛ generation هي قيمة self.generation قبل قراءة القيمة من قاعدة البيانات
+        وإذا حدث تفريغ بعدها لا تُحفظ القيمة لأنها قد تكون قديمة"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def delete_where(self, predicate):
+        """حذف كل العناصر التي تحقق predicate(key, value)"""
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, value in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+
+class MemoryBackend:
+    """تخزين عناصر كاش البيانات في ذاكرة العملية (LRU) مع أرقام إصدار الوسوم"""
+
+    def __init__(self, maxsize=512):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def versions(self, tags):
+        with self._lock:
+            return {tag: self._versions.get(tag, 0) for tag in tags}
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, entry):
+        self._entries.set(key, entry)
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+        self._entries.clear()
+
+
+class SQLiteBackend:
+    """تخزين عناصر كاش البيانات في ملف SQLite مشترك بين عدة عمليات (اتصال لكل خيط)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, entry TEXT NOT NULL, expires_at REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS cache_tags (tag TEXT PRIMARY KEY, version INTEGER NOT NULL);
+            """)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def versions(self, tags):
+        tags = list(tags)
+        rows = self._connection().execute(
+            f"SELECT tag, version FROM cache_tags WHERE tag IN ({', '.join('?' * len(tags))})", tags
+        ) if tags else ()
+        return {**dict.fromkeys(tags, 0), **dict(rows)}
+
+    def get(self, key):
+        row = self._connection().execute('SELECT entry FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, entry):
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache_entries (key, entry, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(entry, ensure_ascii=False), entry['expires_at'])
+        )
+        connection.execute('DELETE FROM cache_entries WHERE expires_at < ?', (time.time(),))
+
+    def invalidate(self, tags):
+        self._connection().executemany("""
+            INSERT INTO cache_tags (tag, version) VALUES (?, 1)
+            ON CONFLICT (tag) DO UPDATE SET version = cache_tags.version + 1
+        """, [(tag,) for tag in sorted(tags)])
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM cache_entries')
+            connection.execute('DELETE FROM cache_tags')
+
+
+class TaggedCache:
+    """كاش نتائج مجمعة (قيم JSON) بمدة صلاحية ووسوم تحدد البيانات التي تعتمد عليها
+
+    كل عنصر يُحفظ مع أرقام إصدار وسومه لحظة بدء الحساب، وتفريغ وسم يزيد رقم إصداره فقط،
+    لذلك يُعتبر العنصر قديماً إذا تغير إصدار أي من وسومه ولو حُسب أثناء التفريغ
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get_or_set(self, key, tags, compute, ttl=None):
+        """القيمة المحفوظة لـ key إذا كانت صالحة، وإلا تُحسب بـ compute() وتُحفظ مع وسومها"""
+        tags = sorted(set(tags))
+        entry = self.backend.get(key)
+        if entry and entry['expires_at'] > time.time() and self.backend.versions(entry['versions']) == entry['versions']:
+            self.hits += 1
+            return entry['value']
+        self.misses += 1
+        versions = self.backend.versions(tags)
+        value = compute()
+        # تحويل القيمة إلى JSON ثم إعادتها حتى تكون النتيجة من الكاش ومن الحساب المباشر متطابقة
+        value = json.loads(json.dumps(value, ensure_ascii=False, default=str))
+        self.backend.set(key, {'value': value, 'versions': versions, 'expires_at': time.time() + (ttl or self.ttl)})
+        return value
+
+    def invalidate(self, tags):
+        if tags:
+            self.backend.invalidate(tags)
+
+    def clear(self):
+        self.backend.clear()
+
+
+# كاش مسح الباركود في نقطة البيع: (branch_id, barcode) -> بيانات المنتج وكميته في الفرع
+scan_cache = LRUCache(maxsize=SCAN_CACHE_SIZE)
+# كاش البيانات المجمعة للوحات الإحصائيات والواجهات JSON (انظر cached)
+response_cache = TaggedCache()
+
+
+def init_cache(app):
+    """إعداد كاش البيانات المجمعة من إعدادات التطبيق (ملف SQLite مشترك أو ذاكرة العملية)"""
+    path = app.config.get('RESPONSE_CACHE_PATH')
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        backend = SQLiteBackend(path)
+    else:
+        backend = MemoryBackend(app.config.get('RESPONSE_CACHE_SIZE', 512))
+    response_cache.configure(backend, app.config.get('RESPONSE_CACHE_TTL', 60))
+
+
+def cached(key, tags, compute, ttl=None):
+    """نتيجة compute() من كاش البيانات المجمعة؛ tags أسماء الجداول و 'branch:<id>' التي تعتمد عليها النتيجة"""
+    return response_cache.get_or_set(key, tags, compute, ttl)
+
+
+def invalidate_catalog(changes):
+    """تفريغ عناصر كاش المسح المتأثرة بتغييرات الكتالوج {(branch_id, product_id)}
+
+    branch_id = None يعني المنتج في كل الفروع، و product_id = None يعني كل منتجات الفرع
+    """
+    if (None, None) in changes:
+        scan_cache.clear()
+        return
+    scan_cache.delete_where(lambda key, item: (
+        (key[0], item['id']) in changes or (None, item['id']) in changes or (key[0], None) in changes
+    ))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    changes = session.info.pop(CATALOG_CHANGES_KEY, None)
+    if changes:
+        invalidate_catalog(changes)
+    response_cache.invalidate(session.info.pop(CACHE_TAGS_KEY, None))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+فحص القراءة عبر جداول أرشيف الحركات
+
+ينشئ قاعدة بيانات SQLite مؤقتة بحركات موزعة على أشهر السنة الماضية، ويقرأ قائمة الحركات
+(كل الصفحات) والأرصدة في تواريخ سابقة والملخص اليومي ونتائج البحث في الملاحظات، ثم يؤرشف
+الأشهر الأولى ويعيد نفس القراءات عبر اتحاد الجدول الحالي مع جداول الأرشيف ويعيد بناء الملخص
+وفهرس البحث. ينتهي السكربت برمز خطأ إذا اختلفت أي قراءة أو أمكن حذف منتج حركاته مؤرشفة فقط.
+"""
+
+import os
+import sys
+import tempfile
+from datetime import date, datetime
+
+
+def seed(db, year):
+    """حركات تحويل بين فرعين في كل شهر من السنة year، والمنتج الأخير حركاته في أول شهرين فقط"""
+    from models.user import User
+    from models.branch import Branch
+    from models.category import Category
+    from models.product import Product
+    from models.movement import ProductMovement
+
+    category = Category(name='فحص')
+    branches = [Branch(name='فرع 1'), Branch(name='فرع 2')]
+    db.session.add(category)
+    db.session.add_all(branches)
+    db.session.flush()
+    admin = User(username='archive_admin', role='admin', shift='morning')
+    admin.set_password('x')
+    db.session.add(admin)
+    products = [Product(name=f'منتج {i}', category_id=category.id, price=10, quantity=100, barcode=f'ARCH{i}')
+                for i in range(3)]
+    db.session.add_all(products)
+    db.session.flush()
+    first, second = (branch.id for branch in branches)
+    rows = []
+    for month in range(1, 13):
+        for i, day in enumerate(range(1, 29, 3)):
+            product = products[i % 2] if month > 2 else products[i % 3]
+            source, destination = (first, second) if day % 2 else (second, first)
+            rows.append({
+                'product_id': product.id, 'user_id': admin.id, 'shift': 'morning', 'type': 'transfer', 'quantity': day,
+                'timestamp': datetime(year, month, day, 10), 'source_type': 'branch', 'source_id': source,
+                'destination_type': 'branch', 'destination_id': destination, 'notes': f'شحنة شهر {month}'
+            })
+    ProductMovement.bulk_insert(rows)
+    db.session.commit()
+    return admin.id, first, products[-1].id
+
+
+def read_all(client, url):
+    """معرفات كل الحركات في كل صفحات قائمة الحركات"""
+    ids, cursor = [], None
+    while True:
+        response = client.get(url + (f'&before={cursor}' if cursor else ''))
+        data = response.get_json()
+        ids.extend(movement['id'] for movement in data['movements'])
+        cursor = data['next_cursor']
+        if not cursor:
+            return ids
+
+
+def reads(app, client, branch_id, year):
+    from models import db
+    from models.daily_movement_rollup import DailyMovementRollup
+    from models.search_index import SearchIndex
+    from models.stock_snapshot import StockSnapshot
+
+    result = {
+        'قائمة الحركات': read_all(client, f'/movements/?format=json&limit=25&date_from={year}-01-01'),
+        'حركات شهر مارس': read_all(client, f'/movements/?format=json&limit=5&date_from={year}-03-01&date_to={year}-03-31'),
+    }
+    with app.app_context():
+        for as_of in (date(year, 2, 15), date(year, 6, 30), date(year, 10, 1)):
+            result[f'الأرصدة في {as_of}'] = StockSnapshot.quantities_as_of('branch', branch_id, as_of)
+        result['الملخص اليومي'] = sorted(
+            (row.movement_date, row.branch_id, row.product_id, row.type, row.shift, row.movements_count, row.total_quantity)
+            for row in DailyMovementRollup.query
+        )
+        result['البحث في الملاحظات'] = sorted(SearchIndex.search('شحنه شهر 2'))
+        db.session.remove()
+    return result
+
+
+def check_archive_reads():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['OUTBOX_DISPATCHER'] = '0'
+
+    from app import create_app
+    from models import db
+    from models.daily_movement_rollup import DailyMovementRollup
+    from models.movement_archive import MovementArchive
+    from models.product import Product
+    from models.search_index import SearchIndex
+
+    app = create_app()
+    app.config['TESTING'] = True
+    year = date.today().year - 1
+
+    with app.app_context():
+        db.create_all()
+        admin_id, branch_id, archived_product_id = seed(db, year)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+
+    before = reads(app, client, branch_id, year)
+    with app.app_context():
+        archived = MovementArchive.archive(date(year, 9, 1))
+        db.session.commit()
+        print(f'تمت أرشفة {archived} حركة')
+    after = reads(app, client, branch_id, year)
+    with app.app_context():
+        DailyMovementRollup.rebuild()
+        SearchIndex.rebuild()
+    rebuilt = reads(app, client, branch_id, year)
+
+    failures = 0
+    for name, expected in before.items():
+        for stage, values in (('بعد الأرشفة', after), ('بعد إعادة البناء', rebuilt)):
+            same = values[name] == expected
+            failures += not same
+            print(f"{'✅' if same else '❌'} {name} {stage}")
+
+    client.post(f'/products/delete/{archived_product_id}')
+    with app.app_context():
+        kept = db.session.get(Product, archived_product_id) is not None
+    failures += not kept
+    print(f"{'✅' if kept else '❌'} رفض حذف منتج حركاته مؤرشفة فقط")
+
+    os.remove(path)
+    return failures == 0
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check_archive_reads() else 1)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+فحص عزل معالجات أحداث outbox
+
+يسجل على قاعدة بيانات SQLite مؤقتة معالجاً ناجحاً ومعالجاً يضيف إشعاراً ثم يفشل، ومعالجاً يفشل
+مرة واحدة بانشغال قاعدة البيانات، ثم يعالج الأحداث عدة دورات. ينتهي السكربت برمز خطأ إذا كُتب
+إشعار من معالج فاشل، أو لم تُسجل أحداث المعالج الناجح والأحداث بدون معالج كمعالجة، أو زادت
+محاولات الأحداث بسبب انشغال قاعدة البيانات.
+"""
+
+import os
+import sys
+import tempfile
+
+# عدد دورات المعالجة (كل دورة تعيد محاولة الأحداث الفاشلة مرة واحدة)
+CYCLES = 3
+
+
+def check_outbox_dispatch():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['OUTBOX_DISPATCHER'] = '0'
+
+    from app import create_app
+    from models import db
+    from models.notification import BranchNotification
+    from models.outbox import OutboxEvent
+    from sqlalchemy.exc import OperationalError
+    import events
+
+    busy_calls = []
+
+    @events.handler('check_ok')
+    def notify(payloads):
+        BranchNotification.queue(to_branch_id=None, notification_type='info', title='ناجح', message='معالج ناجح')
+
+    @events.handler('check_failing')
+    def notify_then_fail(payloads):
+        BranchNotification.queue(to_branch_id=None, notification_type='info', title='فاشل', message='معالج فاشل')
+        raise RuntimeError('معالج فاشل')
+
+    @events.handler('check_busy')
+    def busy_once(payloads):
+        busy_calls.append(True)
+        if len(busy_calls) == 1:
+            raise OperationalError('UPDATE', {}, Exception('database is locked'))
+
+    app = create_app()
+    app.config['TESTING'] = True
+    app.logger.disabled = True
+
+    with app.app_context():
+        db.create_all()
+        # انشغال قاعدة البيانات يلغي الدفعة كلها، فيُفحص في دفعة مستقلة قبل باقي الأحداث
+        for event_types in (('check_busy',), ('check_ok', 'check_failing', 'check_topic_only')):
+            connection = db.session.connection()
+            for event_type in event_types:
+                OutboxEvent.append(connection, event_type, {})
+            db.session.commit()
+            for _ in range(CYCLES):
+                try:
+                    after_id = 0
+                    while after_id := events.dispatch_pending(after_id=after_id):
+                        pass
+                except OperationalError:
+                    db.session.rollback()
+
+        state = {event.event_type: event for event in OutboxEvent.query}
+        titles = [notification.title for notification in BranchNotification.query]
+        checks = [
+            ('إشعار المعالج الناجح كُتب مرة واحدة', titles.count('ناجح') == 1),
+            ('إشعار المعالج الفاشل لم يُكتب', 'فاشل' not in titles),
+            ('أحداث المعالج الناجح والأحداث بدون معالج معالجة',
+             all(state[event_type].processed_at for event_type in ('check_ok', 'check_topic_only'))),
+            (f'محاولات الحدث الفاشل = {CYCLES}',
+             state['check_failing'].attempts == CYCLES and state['check_failing'].processed_at is None),
+            ('انشغال قاعدة البيانات لا يزيد المحاولات',
+             state['check_busy'].attempts == 0 and state['check_busy'].processed_at is not None),
+        ]
+
+    failures = 0
+    for name, passed in checks:
+        failures += not passed
+        print(f"{'✅' if passed else '❌'} {name}")
+
+    os.remove(path)
+    return failures == 0
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check_outbox_dispatch() else 1)
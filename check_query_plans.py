@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+فحص خطط تنفيذ الاستعلامات الأكثر استخداماً على جدول product_movements
+
+يشغّل صفحات الحركات والإحصائيات والفروع على قاعدة بيانات SQLite مؤقتة،
+ويلتقط كل استعلام يقرأ من جدول الحركات، ثم ينفذ عليه EXPLAIN QUERY PLAN.
+ينتهي السكربت برمز خطأ إذا كان أي استعلام يمسح الجدول بالكامل بدون فهرس.
+"""
+
+import os
+import re
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+FULL_SCAN = re.compile(r'\bSCAN product_movements\b(?! USING)')
+
+# الصفحات التي تحتوي على الاستعلامات الأكثر استخداماً
+ADMIN_URLS = [
+    '/movements/',
+    '/movements/?product_id=1',
+    '/movements/?branch_id=1',
+    '/movements/?dealer_id=1',
+    '/movements/?user_id=1',
+    '/movements/?shift=morning',
+    '/movements/?type=transfer',
+    '/movements/?date_from={week_ago}&date_to={today}',
+    '/movements/export/excel?branch_id=1',
+    '/stats/',
+    '/stats/api/branch/1',
+    '/branches/1',
+    '/branches/1/api/products',
+]
+BRANCH_URLS = [
+    '/branch/dashboard',
+    '/branch/inventory',
+    '/pos/api/products',
+]
+
+
+def seed(db):
+    from models.user import User
+    from models.branch import Branch
+    from models.category import Category
+    from models.product import Product
+    from models.movement import ProductMovement
+
+    category = Category(name='فحص')
+    branches = [Branch(name='فرع 1'), Branch(name='فرع 2')]
+    db.session.add(category)
+    db.session.add_all(branches)
+    db.session.flush()
+    admin = User(username='plan_admin', role='admin', shift='morning')
+    clerk = User(username='plan_clerk', role='branch_manager', shift='morning', branch_id=branches[0].id)
+    admin.set_password('x')
+    clerk.set_password('x')
+    db.session.add_all([admin, clerk])
+    products = [Product(name=f'منتج {i}', category_id=category.id, price=10, quantity=100, barcode=f'PLAN{i}')
+                for i in range(5)]
+    db.session.add_all(products)
+    db.session.flush()
+    now = datetime.utcnow()
+    for i, product in enumerate(products):
+        db.session.add(ProductMovement(
+            product_id=product.id, user_id=admin.id, shift='morning', type='in', quantity=50,
+            timestamp=now - timedelta(days=i), source_type='dealer', source_id=1,
+            destination_type='branch', destination_id=branches[0].id
+        ))
+        db.session.add(ProductMovement(
+            product_id=product.id, user_id=admin.id, shift='evening', type='transfer', quantity=5,
+            timestamp=now, source_type='branch', source_id=branches[0].id,
+            destination_type='branch', destination_id=branches[1].id
+        ))
+    db.session.commit()
+    return admin.id, clerk.id
+
+
+def explain(connection, statement, parameters):
+    if isinstance(parameters, dict) or not parameters:
+        parameters = parameters or ()
+    elif isinstance(parameters, list):
+        parameters = parameters[0]
+    parameters = tuple(
+        p.isoformat(' ') if isinstance(p, datetime) else p.isoformat() if isinstance(p, date) else p
+        for p in parameters
+    ) if not isinstance(parameters, dict) else parameters
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def check_query_plans():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    # معالج أحداث outbox يعمل في خيط آخر على نفس قاعدة البيانات أثناء التقاط الاستعلامات
+    os.environ['OUTBOX_DISPATCHER'] = '0'
+
+    from app import create_app
+    from models import db
+    from sqlalchemy import event
+
+    app = create_app()
+    app.config['TESTING'] = True
+    captured = []
+
+    with app.app_context():
+        db.create_all()
+        admin_id, clerk_id = seed(db)
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if 'product_movements' in statement and statement.lstrip().upper().startswith('SELECT'):
+                captured.append((statement, parameters))
+
+    today = date.today()
+    for user_id, urls in ((admin_id, ADMIN_URLS), (clerk_id, BRANCH_URLS)):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        for url in urls:
+            response = client.get(url.format(today=today, week_ago=today - timedelta(days=7)))
+            if response.status_code != 200:
+                print(f'⚠️  {url}: {response.status_code}')
+
+    failures = 0
+    seen = set()
+    with app.app_context():
+        event.remove(db.engine, 'before_cursor_execute', capture)
+        connection = db.session.connection()
+        for statement, parameters in captured:
+            if statement in seen:
+                continue
+            seen.add(statement)
+            plan = explain(connection, statement, parameters)
+            if any(FULL_SCAN.search(line) for line in plan):
+                failures += 1
+                print('❌ مسح كامل لجدول الحركات:')
+                print('   ' + ' '.join(statement.split()))
+                for line in plan:
+                    print('   -> ' + line)
+
+    os.remove(path)
+    print(f'تم فحص {len(seen)} استعلام، منها {failures} بدون فهرس')
+    return failures == 0
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check_query_plans() else 1)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+فحص عدد استعلامات صفحات الإحصائيات مع تغيّر حجم الكتالوج
+
+يشغّل صفحات الإحصائيات على قاعدة بيانات SQLite مؤقتة بكتالوج صغير ثم بعد إضافة منتجات كثيرة
+لكل فرع، ويعد الاستعلامات المنفذة في كل صفحة. ينتهي السكربت برمز خطأ إذا زاد عدد الاستعلامات
+مع حجم الكتالوج أو تجاوز MAX_QUERIES.
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+URLS = [
+    '/stats/',
+    '/stats/api/branch/1',
+]
+# أقصى عدد استعلامات مسموح لكل صفحة
+MAX_QUERIES = 30
+# عدد المنتجات في الكتالوج الصغير ثم الكبير
+CATALOG_SIZES = (5, 300)
+
+
+def seed(db):
+    from models.user import User
+    from models.branch import Branch
+    from models.category import Category
+
+    category = Category(name='فحص')
+    branches = [Branch(name='فرع 1'), Branch(name='فرع 2'), Branch(name='فرع 3')]
+    db.session.add(category)
+    db.session.add_all(branches)
+    db.session.flush()
+    admin = User(username='stats_admin', role='admin', shift='morning')
+    admin.set_password('x')
+    db.session.add(admin)
+    db.session.commit()
+    return admin.id, category.id, [branch.id for branch in branches]
+
+
+def add_products(db, count, admin_id, category_id, branch_ids):
+    """إضافة count منتج مع حركة إدخال لكل فرع"""
+    from models.product import Product
+    from models.movement import ProductMovement
+
+    start = db.session.query(Product).count()
+    products = [Product(name=f'منتج {i}', category_id=category_id, price=10, quantity=100, barcode=f'STATS{i}')
+                for i in range(start, start + count)]
+    db.session.add_all(products)
+    db.session.flush()
+    now = datetime.utcnow()
+    ProductMovement.bulk_insert([{
+        'product_id': product.id, 'user_id': admin_id, 'shift': 'morning', 'type': 'in', 'quantity': 5,
+        'timestamp': now, 'source_type': 'dealer', 'source_id': 1,
+        'destination_type': 'branch', 'destination_id': branch_id, 'notes': None
+    } for product in products for branch_id in branch_ids])
+    db.session.commit()
+
+
+def check_stats_queries():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    # استعلامات معالج أحداث outbox تعمل في خيط آخر على نفس المحرك وتُفسد العد
+    os.environ['OUTBOX_DISPATCHER'] = '0'
+
+    from app import create_app
+    from models import db
+    from sqlalchemy import event
+
+    app = create_app()
+    app.config['TESTING'] = True
+    counts = {}
+
+    with app.app_context():
+        db.create_all()
+        admin_id, category_id, branch_ids = seed(db)
+        engine = db.engine
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    previous = 0
+    for size in CATALOG_SIZES:
+        with app.app_context():
+            add_products(db, size - previous, admin_id, category_id, branch_ids)
+        previous = size
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin_id)
+        event.listen(engine, 'before_cursor_execute', capture)
+        for url in URLS:
+            statements.clear()
+            response = client.get(url)
+            if response.status_code != 200:
+                print(f'⚠️  {url}: {response.status_code}')
+            counts.setdefault(url, []).append(len(statements))
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    failures = 0
+    for url, url_counts in counts.items():
+        bounded = len(set(url_counts)) == 1 and url_counts[0] <= MAX_QUERIES
+        failures += not bounded
+        sizes = '، '.join(f'{size} منتج: {count}' for size, count in zip(CATALOG_SIZES, url_counts))
+        print(f"{'✅' if bounded else '❌'} {url} ({sizes} استعلام)")
+
+    os.remove(path)
+    return failures == 0
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check_stats_queries() else 1)
@@ -4,4 +4,15 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your_secret_key_here'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///warehouse.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    BABEL_DEFAULT_LOCALE = 'ar'
\ No newline at end of file
+    BABEL_DEFAULT_LOCALE = 'ar'
+    # عدد الأشهر التي تبقى حركاتها في جدول product_movements قبل أرشفتها (انظر archive_movements.py)
+    MOVEMENT_ARCHIVE_MONTHS = int(os.environ.get('MOVEMENT_ARCHIVE_MONTHS', 12))
+    # عمر الإشعارات (بالأيام) الذي تُحذف بعده المقروءة منها وتُدمج تنبيهات المخزون المكررة (انظر purge_notifications.py)
+    NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+    # تشغيل معالج أحداث outbox في عملية الخادم (انظر events.py)؛ يُعطّل فقط إذا كانت عملية أخرى تعالج الأحداث
+    OUTBOX_DISPATCHER = os.environ.get('OUTBOX_DISPATCHER', '1') == '1'
+    # كاش البيانات المجمعة للوحات والواجهات JSON (انظر cache.py): مدة الصلاحية بالثواني وعدد العناصر في الذاكرة،
+    # و RESPONSE_CACHE_PATH ملف SQLite لمشاركة الكاش بين عدة عمليات (بدونه يكون الكاش في ذاكرة العملية)
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH')
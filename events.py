@@ -0,0 +1,166 @@
+"""
+معالج أحداث صندوق الأحداث (outbox) داخل العملية
+
+عمليات الكتابة تضيف أحداثها إلى outbox_events في نفس المعاملة (انظر models/outbox.py)، وخيط في الخلفية
+يقرأ الأحداث على دفعات ويمررها للدوال المسجلة بـ @handler ثم يسجلها كمعالجة في نفس معاملة التحديث.
+التطبيق يعمل كعملية واحدة (python app.py) فيكفي خيط واحد يوقظه commit أي معاملة أضافت أحداثاً.
+"""
+
+import threading
+from flask import current_app
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from models import db, is_busy_error
+from models.outbox import OutboxEvent, OUTBOX_PENDING_KEY, OUTBOX_TOPICS_KEY
+
+# عدد الأحداث التي تُعالج في كل دفعة
+DISPATCH_BATCH_SIZE = 200
+# أقصى انتظار بين دورتين عندما لا تصل أحداث جديدة (بالثواني)
+DISPATCH_INTERVAL = 5
+# مدة الاحتفاظ بالأحداث بعد معالجتها
+OUTBOX_RETENTION = timedelta(days=1)
+
+_handlers = {}
+
+
+def handler(event_type):
+    """تسجيل دالة تعالج دفعة من أحداث نوع معين: fn(payloads)
+
+    الدالة تعمل داخل معاملة المعالج ويجب ألا تنفذ commit بنفسها، وقد تُستدعى لنفس الحدث
+    أكثر من مرة إذا فشلت الدفعة، لذلك يجب أن تكون نتيجتها قابلة للتكرار
+    """
+    def register(fn):
+        _handlers.setdefault(event_type, []).append(fn)
+        return fn
+    return register
+
+
+def dispatch_pending(batch_size=DISPATCH_BATCH_SIZE, after_id=0):
+    """معالجة دفعة واحدة من الأحداث المعلقة بعد after_id (داخل app context)
+
+    كل نوع أحداث يُعالج داخل savepoint مستقل: الأنواع الناجحة (ومنها الأنواع بدون معالج) تُسجل
+    كمعالجة، ويُلغى أثر النوع الفاشل وتزيد محاولات أحداثه فقط. يعيد معرف آخر حدث في الدفعة أو 0
+    """
+    events = OutboxEvent.pending(batch_size, after_id)
+    if not events:
+        return 0
+    groups = {}
+    for outbox_event in events:
+        groups.setdefault(outbox_event.event_type, []).append(outbox_event)
+    processed, failed = [], {}
+    for event_type, group in groups.items():
+        try:
+            with db.session.begin_nested():
+                for fn in _handlers.get(event_type, ()):
+                    fn([outbox_event.data for outbox_event in group])
+            processed.extend(outbox_event.id for outbox_event in group)
+        except OperationalError as e:
+            # انشغال قاعدة البيانات ليس فشلاً للمعالج: تُلغى الدفعة كلها بدون زيادة المحاولات وتُعاد لاحقاً
+            if is_busy_error(e):
+                raise
+            current_app.logger.exception('فشلت معالجة أحداث outbox من نوع %s', event_type)
+            failed.setdefault(repr(e), []).extend(outbox_event.id for outbox_event in group)
+        except Exception as e:
+            current_app.logger.exception('فشلت معالجة أحداث outbox من نوع %s', event_type)
+            failed.setdefault(repr(e), []).extend(outbox_event.id for outbox_event in group)
+    if processed:
+        db.session.execute(
+            db.update(OutboxEvent).where(OutboxEvent.id.in_(processed)).values(processed_at=datetime.utcnow())
+        )
+    for error, ids in failed.items():
+        db.session.execute(
+            db.update(OutboxEvent).where(OutboxEvent.id.in_(ids))
+            .values(attempts=OutboxEvent.attempts + 1, last_error=error)
+        )
+    db.session.commit()
+    return events[-1].id
+
+
+class Dispatcher:
+    """خيط خلفي يعالج الأحداث فور إيقاظه بعد commit أو كل DISPATCH_INTERVAL ثانية"""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, app, interval=DISPATCH_INTERVAL):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, args=(app, interval), name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+        # معالجة الأحداث المتبقية من تشغيل سابق
+        self.wake()
+
+    def init_app(self, app):
+        """تشغيل المعالج مع أول طلب يستقبله التطبيق (python app.py أو flask run أو عميل الاختبار)
+
+        التشغيل عند أول طلب وليس عند إنشاء التطبيق حتى لا يعمل في عملية المراقبة التي يشغلها
+        وضع debug لإعادة التحميل ولا في السكربتات التي لا تستقبل طلبات
+        """
+        @app.before_request
+        def _start_dispatcher():
+            if not (self._thread and self._thread.is_alive()):
+                self.start(app)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self, app, interval):
+        purged_at = None
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    # الأحداث الفاشلة تبقى معلقة وتُعاد في الدورة التالية وليس في نفس الدورة
+                    after_id = 0
+                    while after_id := dispatch_pending(after_id=after_id):
+                        pass
+                    if purged_at is None or datetime.utcnow() - purged_at > timedelta(hours=1):
+                        OutboxEvent.purge(datetime.utcnow() - OUTBOX_RETENTION)
+                        purged_at = datetime.utcnow()
+                except OperationalError as e:
+                    db.session.rollback()
+                    # انشغال قاعدة البيانات متوقع مع الكتابة المتزامنة، وتُعاد الدفعة في الدورة التالية
+                    if is_busy_error(e):
+                        app.logger.warning('قاعدة البيانات مشغولة، تأجيل معالجة أحداث outbox: %s', e.orig)
+                    else:
+                        app.logger.exception('فشلت معالجة دفعة من أحداث outbox')
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('فشلت معالجة دفعة من أحداث outbox')
+
+
+class Broadcast:
+    """إشعار كل الخيوط المنتظرة (اتصالات SSE) بوصول أحداث جديدة عبر رقم إصدار يزيد مع كل إشعار"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.version = 0
+
+    def notify(self):
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def wait(self, version, timeout):
+        """انتظار حتى يتغير الإصدار عن version أو انتهاء المهلة، يعيد الإصدار الحالي"""
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+dispatcher = Dispatcher()
+# يوقظ بث SSE بعد commit أي معاملة أضافت أحداثاً موجهة (topic)
+streams = Broadcast()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_dispatcher(session):
+    if session.info.pop(OUTBOX_PENDING_KEY, False):
+        dispatcher.wake()
+    if session.info.pop(OUTBOX_TOPICS_KEY, False):
+        streams.notify()
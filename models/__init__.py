@@ -2,6 +2,12 @@ from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
+
+def is_busy_error(error):
+    """هل الخطأ انشغال مؤقت لقاعدة البيانات (database is locked / busy) تنجح إعادة المحاولة بعده"""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
 from .user import User
 from .product import Product
 from .category import Category
@@ -12,4 +18,7 @@ from .request import ProductRequest
 from .notification import BranchNotification
 from .branch_inventory import BranchInventory
 from .sale import Sale, SaleItem
-from .customer import Customer
\ No newline at end of file
+from .customer import Customer
+from .catalog_version import CatalogVersion
+from .stock_balance import StockBalance
+from .stock_snapshot import StockSnapshot
\ No newline at end of file
@@ -12,57 +12,144 @@ class Branch(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
 
+    # حد المخزون المنخفض
+    LOW_STOCK_THRESHOLD = 10
+
     def __repr__(self):
         return f'<Branch {self.name}>'
 
     def get_product_quantity(self, product_id):
         """الحصول على كمية منتج معين في هذا الفرع"""
-        from models.movement import ProductMovement
+        from models.stock_balance import StockBalance
 
-        # حساب الكمية من حركات المنتج
-        incoming = db.session.query(db.func.sum(ProductMovement.quantity)).filter(
-            ProductMovement.destination_id == self.id,
-            ProductMovement.destination_type == 'branch',
-            ProductMovement.product_id == product_id
-        ).scalar() or 0
+        # القراءة من جدول الأرصدة بدلاً من جمع كل حركات المنتج
+        return StockBalance.get_quantity('branch', self.id, product_id)
 
-        outgoing = db.session.query(db.func.sum(ProductMovement.quantity)).filter(
-            ProductMovement.source_id == self.id,
-            ProductMovement.source_type == 'branch',
-            ProductMovement.product_id == product_id
-        ).scalar() or 0
+    def products_quantities_query(self, search=None, category_id=None, status=None):
+        """استعلام واحد يعيد (المنتج، الكمية) في هذا الفرع مع تطبيق الفلاتر داخل قاعدة البيانات"""
+        from models.product import Product
+        from models.search_index import SearchIndex
+        from models.stock_balance import StockBalance
+
+        quantity = db.func.coalesce(StockBalance.quantity, 0)
+        query = db.session.query(Product, quantity.label('quantity')).outerjoin(
+            StockBalance,
+            db.and_(
+                StockBalance.product_id == Product.id,
+                StockBalance.location_type == 'branch',
+                StockBalance.location_id == self.id
+            )
+        )
 
-        return incoming - outgoing
+        # فلترة حسب البحث
+        if search:
+            query = query.filter(SearchIndex.matching(Product.id, 'product', search, Product.name, Product.barcode))
 
-    def get_all_products_with_quantities(self):
-        """الحصول على جميع المنتجات مع كمياتها في هذا الفرع"""
-        from models.product import Product
+        # فلترة حسب الفئة
+        if category_id:
+            query = query.filter(Product.category_id == category_id)
+
+        # فلترة حسب الحالة
+        if status == 'out_of_stock':
+            query = query.filter(quantity <= 0)
+        else:
+            query = query.filter(quantity > 0)  # عرض المنتجات التي لها كمية فقط
+            if status == 'low_stock':
+                query = query.filter(quantity <= self.LOW_STOCK_THRESHOLD)
 
-        products = Product.query.all()
-        branch_products = []
+        return query.order_by(Product.id)
+
+    def get_all_products_with_quantities(self, search=None, category_id=None, status=None):
+        """الحصول على جميع المنتجات مع كمياتها في هذا الفرع"""
+        return [
+            {'product': product, 'quantity': quantity}
+            for product, quantity in self.products_quantities_query(search, category_id, status)
+        ]
 
-        for product in products:
-            quantity = self.get_product_quantity(product.id)
-            if quantity > 0:  # عرض المنتجات التي لها كمية فقط
-                branch_products.append({
-                    'product': product,
-                    'quantity': quantity
-                })
+    def get_products_count(self):
+        """عدد المنتجات المتوفرة في الفرع"""
+        from models.stock_balance import StockBalance
 
-        return branch_products
+        return db.session.query(db.func.count()).select_from(StockBalance).filter(
+            StockBalance.location_type == 'branch',
+            StockBalance.location_id == self.id,
+            StockBalance.quantity > 0
+        ).scalar()
 
     def get_total_stock_value(self):
         """حساب إجمالي قيمة المخزون في الفرع"""
-        branch_products = self.get_all_products_with_quantities()
-        total_value = sum(item['product'].price * item['quantity'] for item in branch_products)
-        return total_value
+        from models.product import Product
+        from models.stock_balance import StockBalance
+
+        total_value = db.session.query(db.func.sum(Product.price * StockBalance.quantity)).join(
+            StockBalance, StockBalance.product_id == Product.id
+        ).filter(
+            StockBalance.location_type == 'branch',
+            StockBalance.location_id == self.id,
+            StockBalance.quantity > 0
+        ).scalar()
+        return total_value or 0
+
+    def get_products_as_of(self, as_of_date):
+        """المنتجات وكمياتها في الفرع في نهاية يوم سابق (من أقرب لقطة + الحركات بعدها)"""
+        from models.product import Product
+        from models.stock_snapshot import StockSnapshot
+
+        quantities = StockSnapshot.quantities_as_of('branch', self.id, as_of_date)
+        product_ids = [product_id for product_id, quantity in quantities.items() if quantity > 0]
+        if not product_ids:
+            return []
+        products = Product.query.filter(Product.id.in_(product_ids)).order_by(Product.id).all()
+        return [{'product': product, 'quantity': quantities[product.id]} for product in products]
+
+    @classmethod
+    def get_stock_totals(cls, branch_ids=None):
+        """عدد المنتجات المتوفرة وقيمة المخزون لكل الفروع في استعلام واحد {branch_id: {'products_count', 'stock_value'}}"""
+        from models.product import Product
+        from models.stock_balance import StockBalance
+
+        query = db.session.query(
+            StockBalance.location_id,
+            db.func.count(StockBalance.product_id),
+            db.func.coalesce(db.func.sum(Product.price * StockBalance.quantity), 0)
+        ).join(Product, Product.id == StockBalance.product_id).filter(
+            StockBalance.location_type == 'branch',
+            StockBalance.quantity > 0
+        )
+        if branch_ids is not None:
+            query = query.filter(StockBalance.location_id.in_(branch_ids))
+        return {
+            branch_id: {'products_count': products_count, 'stock_value': stock_value}
+            for branch_id, products_count, stock_value in query.group_by(StockBalance.location_id)
+        }
+
+    @classmethod
+    def get_products_matrix(cls, branch_ids=None):
+        """مصفوفة المنتجات × الفروع في استعلام واحد: [{'product', 'quantities': {branch_id: qty}}]"""
+        from models.product import Product
+        from models.stock_balance import StockBalance
+
+        query = db.session.query(Product, StockBalance.location_id, StockBalance.quantity).join(
+            StockBalance, StockBalance.product_id == Product.id
+        ).filter(
+            StockBalance.location_type == 'branch',
+            StockBalance.quantity > 0
+        )
+        if branch_ids is not None:
+            query = query.filter(StockBalance.location_id.in_(branch_ids))
+
+        matrix = {}
+        for product, branch_id, quantity in query.order_by(Product.id):
+            row = matrix.setdefault(product.id, {'product': product, 'quantities': {}})
+            row['quantities'][branch_id] = quantity
+        return list(matrix.values())
 
     def get_movements_stats(self):
         """إحصائيات حركات المنتجات للفرع"""
         from datetime import datetime, timedelta
         from models.movement import ProductMovement
 
-        today = datetime.now().date()
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
         week_ago = today - timedelta(days=7)
         month_ago = today - timedelta(days=30)
 
@@ -70,7 +157,8 @@ class Branch(db.Model):
         today_movements = db.session.query(ProductMovement).filter(
             ProductMovement.destination_id == self.id,
             ProductMovement.destination_type == 'branch',
-            db.func.date(ProductMovement.timestamp) == today
+            ProductMovement.timestamp >= today,
+            ProductMovement.timestamp < today + timedelta(days=1)
         ).count()
 
         # حركات الأسبوع
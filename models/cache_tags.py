@@ -0,0 +1,51 @@
+from models import db
+from itertools import chain
+from sqlalchemy import event
+
+# مفتاح session.info الذي تُجمع فيه وسوم الكاش المتأثرة بالمعاملة الحالية حتى commit (انظر cache.py)
+# الوسوم هي أسماء الجداول المتغيرة و 'branch:<id>' لكل فرع تغيرت بياناته
+CACHE_TAGS_KEY = 'cache_tags'
+
+
+def branch_tag(branch_id):
+    return f'branch:{branch_id}'
+
+
+def note_cache_tags(tags, session=None):
+    """تسجيل وسوم الكاش المتأثرة في المعاملة الحالية لتفريغها بعد commit"""
+    session = session or db.session
+    session.info.setdefault(CACHE_TAGS_KEY, set()).update(tags)
+
+
+def movement_tags(movements):
+    """وسوم مجموعة حركات: جدولا الحركات والأرصدة وكل فرع يكون مصدراً أو وجهة"""
+    tags = {'product_movements', 'stock_balances'}
+    for movement in movements:
+        if movement.source_type == 'branch' and movement.source_id:
+            tags.add(branch_tag(movement.source_id))
+        if movement.destination_type == 'branch' and movement.destination_id:
+            tags.add(branch_tag(movement.destination_id))
+    return tags
+
+
+@event.listens_for(db.session, 'after_flush')
+def _note_changed_tables(session, flush_context):
+    from models.movement import ProductMovement
+
+    tags = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        tags.add(obj.__tablename__)
+        if isinstance(obj, ProductMovement):
+            tags |= movement_tags([obj])
+        branch_id = getattr(obj, 'branch_id', None)
+        if branch_id:
+            tags.add(branch_tag(branch_id))
+    if tags:
+        note_cache_tags(tags, session)
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _discard_cache_tags(session, transaction):
+    # بعد rollback للمعاملة الرئيسية لا يتغير شيء (بعد commit تكون الوسوم قد أُزيلت وفُرّغت)
+    if transaction.parent is None:
+        session.info.pop(CACHE_TAGS_KEY, None)
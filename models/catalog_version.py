@@ -0,0 +1,79 @@
+from models import db
+from sqlalchemy import event, text
+
+# مفتاح session.info الذي تُجمع فيه تغييرات الكتالوج حتى commit (انظر cache.py)
+CATALOG_CHANGES_KEY = 'catalog_changes'
+
+# نموذج رقم إصدار كتالوج نقطة البيع لكل فرع
+# يزيد الرقم مع كل تغيير في أرصدة الفرع أو في سعر/اسم/باركود منتج موجود فيه،
+# ويُسجل الإصدار الجديد على صفوف stock_balances المتغيرة ليتمكن الكاشير من جلب التغييرات فقط
+class CatalogVersion(db.Model):
+    __tablename__ = 'catalog_versions'
+
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    # الحقول التي تظهر في كتالوج نقطة البيع
+    PRODUCT_FIELDS = ('name', 'price', 'barcode')
+
+    def __repr__(self):
+        return f'<CatalogVersion branch={self.branch_id} v{self.version}>'
+
+    @classmethod
+    def current(cls, branch_id):
+        """رقم الإصدار الحالي لكتالوج الفرع (0 إذا لم يتغير شيء بعد)"""
+        version = db.session.query(cls.version).filter(cls.branch_id == branch_id).scalar()
+        return version or 0
+
+    @staticmethod
+    def bump(connection, branch_ids):
+        """زيادة رقم إصدار مجموعة فروع داخل المعاملة الحالية"""
+        branch_ids = sorted(set(branch_ids))
+        if not branch_ids:
+            return
+        connection.execute(text("""
+            INSERT INTO catalog_versions (branch_id, version) VALUES (:branch_id, 1)
+            ON CONFLICT (branch_id) DO UPDATE SET version = catalog_versions.version + 1
+        """), [{'branch_id': branch_id} for branch_id in branch_ids])
+
+    @staticmethod
+    def version_of(branch_id):
+        """تعبير SQL يعيد الإصدار الحالي لكتالوج الفرع"""
+        return db.select(CatalogVersion.version).where(CatalogVersion.branch_id == branch_id).scalar_subquery()
+
+
+def note_catalog_changes(changes, session=None):
+    """تسجيل أزواج (branch_id, product_id) المتغيرة في المعاملة الحالية لتفريغ الكاش بعد commit
+
+    branch_id = None يعني المنتج في كل الفروع، و product_id = None يعني كل منتجات الفرع
+    """
+    session = session or db.session
+    session.info.setdefault(CATALOG_CHANGES_KEY, set()).update(changes)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _bump_catalog_on_product_change(session, flush_context):
+    from models.product import Product
+
+    deleted_ids = [obj.id for obj in session.deleted if isinstance(obj, Product)]
+    product_ids = [
+        obj.id for obj in session.dirty
+        if isinstance(obj, Product) and any(
+            db.inspect(obj).attrs[field].history.has_changes() for field in CatalogVersion.PRODUCT_FIELDS
+        )
+    ]
+    note_catalog_changes({(None, product_id) for product_id in product_ids + deleted_ids}, session)
+    if not product_ids:
+        return
+    connection = session.connection()
+    params = {'product_ids': product_ids}
+    branch_ids = connection.execute(text("""
+        SELECT DISTINCT location_id FROM stock_balances
+        WHERE location_type = 'branch' AND product_id IN :product_ids
+    """).bindparams(db.bindparam('product_ids', expanding=True)), params).scalars().all()
+    CatalogVersion.bump(connection, branch_ids)
+    connection.execute(text("""
+        UPDATE stock_balances
+        SET version = (SELECT version FROM catalog_versions WHERE branch_id = stock_balances.location_id)
+        WHERE location_type = 'branch' AND product_id IN :product_ids
+    """).bindparams(db.bindparam('product_ids', expanding=True)), params)
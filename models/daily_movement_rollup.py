@@ -0,0 +1,107 @@
+from models import db
+from datetime import datetime
+from sqlalchemy import event, text
+
+# نموذج ملخص الحركات اليومي لكل (يوم، فرع، منتج، نوع، وردية): عدد الحركات ومجموع الكميات
+# branch_id = 0 هو النطاق العام (كل حركة مرة واحدة)، وكل فرع له صفوف بالحركات التي يكون مصدرها أو وجهتها
+# يتم تحديثه في نفس المعاملة مع كل إضافة أو حذف لحركة، ويبقى صحيحاً بعد أرشفة الحركات القديمة
+class DailyMovementRollup(db.Model):
+    __tablename__ = 'daily_movement_rollups'
+
+    movement_date = db.Column(db.Date, primary_key=True)
+    branch_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True, autoincrement=False)
+    type = db.Column(db.String(10), primary_key=True)
+    shift = db.Column(db.String(10), primary_key=True)
+    movements_count = db.Column(db.Integer, nullable=False, default=0)
+    total_quantity = db.Column(db.Integer, nullable=False, default=0)
+
+    # النطاق العام لكل الحركات
+    ALL_BRANCHES = 0
+
+    __table_args__ = (
+        db.Index('ix_daily_movement_rollups_branch', 'branch_id', 'movement_date'),
+    )
+
+    def __repr__(self):
+        return f'<DailyMovementRollup {self.movement_date} branch={self.branch_id} product={self.product_id} {self.type}/{self.shift}>'
+
+    @classmethod
+    def scope(cls, branch_id=None):
+        """شرط صفوف نطاق فرع معين، أو النطاق العام إذا كان branch_id = None"""
+        return cls.branch_id == (branch_id or cls.ALL_BRANCHES)
+
+    @classmethod
+    def rebuild(cls):
+        """إعادة بناء الملخص بالكامل من سجل الحركات (الجدول الحالي وجداول الأرشيف)"""
+        from models.movement_archive import MovementArchive
+
+        db.session.execute(db.delete(cls))
+        Movement = MovementArchive.source(datetime.min, None)
+        movement_date = db.func.date(Movement.timestamp)
+        columns = (Movement.product_id, Movement.type, Movement.shift, Movement.quantity)
+        scoped = db.union_all(
+            db.select(movement_date.label('movement_date'), db.literal(cls.ALL_BRANCHES).label('branch_id'), *columns),
+            db.select(movement_date, Movement.source_id, *columns).where(
+                Movement.source_type == 'branch', Movement.source_id.isnot(None)
+            ),
+            db.select(movement_date, Movement.destination_id, *columns).where(
+                Movement.destination_type == 'branch', Movement.destination_id.isnot(None),
+                ~((Movement.source_type == 'branch') & (Movement.source_id == Movement.destination_id))
+            ),
+        ).subquery('scoped')
+        keys = (scoped.c.movement_date, scoped.c.branch_id, scoped.c.product_id, scoped.c.type, scoped.c.shift)
+        db.session.execute(db.insert(cls).from_select(
+            ['movement_date', 'branch_id', 'product_id', 'type', 'shift', 'movements_count', 'total_quantity'],
+            db.select(*keys, db.func.count(), db.func.sum(scoped.c.quantity)).group_by(*keys)
+        ))
+        db.session.commit()
+        return db.session.query(cls).count()
+
+
+def movement_rollup_deltas(movements, sign=1):
+    """تغييرات الملخص لمجموعة حركات {(date, branch_id, product_id, type, shift): (count, quantity)}"""
+    deltas = {}
+    for movement in movements:
+        timestamp = getattr(movement, 'timestamp', None) or datetime.utcnow()
+        branch_ids = {DailyMovementRollup.ALL_BRANCHES}
+        if movement.source_type == 'branch' and movement.source_id:
+            branch_ids.add(movement.source_id)
+        if movement.destination_type == 'branch' and movement.destination_id:
+            branch_ids.add(movement.destination_id)
+        for branch_id in branch_ids:
+            key = (timestamp.date(), branch_id, movement.product_id, movement.type, movement.shift)
+            count, quantity = deltas.get(key, (0, 0))
+            deltas[key] = (count + sign, quantity + sign * movement.quantity)
+    return deltas
+
+
+def apply_movement_rollups(connection, deltas):
+    """تطبيق التغييرات على جدول الملخص باستخدام upsert داخل المعاملة الحالية"""
+    if not deltas:
+        return
+    connection.execute(text("""
+        INSERT INTO daily_movement_rollups
+            (movement_date, branch_id, product_id, type, shift, movements_count, total_quantity)
+        VALUES (:movement_date, :branch_id, :product_id, :type, :shift, :movements_count, :total_quantity)
+        ON CONFLICT (movement_date, branch_id, product_id, type, shift) DO UPDATE SET
+            movements_count = daily_movement_rollups.movements_count + excluded.movements_count,
+            total_quantity = daily_movement_rollups.total_quantity + excluded.total_quantity
+    """).bindparams(db.bindparam('movement_date', type_=db.Date)), [
+        {'movement_date': movement_date, 'branch_id': branch_id, 'product_id': product_id, 'type': movement_type,
+         'shift': shift, 'movements_count': count, 'total_quantity': quantity}
+        for (movement_date, branch_id, product_id, movement_type, shift), (count, quantity) in deltas.items()
+    ])
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_daily_movement_rollups(session, flush_context):
+    from models.movement import ProductMovement
+
+    deltas = movement_rollup_deltas(obj for obj in session.new if isinstance(obj, ProductMovement))
+    for key, (count, quantity) in movement_rollup_deltas(
+        (obj for obj in session.deleted if isinstance(obj, ProductMovement)), sign=-1
+    ).items():
+        added_count, added_quantity = deltas.get(key, (0, 0))
+        deltas[key] = (added_count + count, added_quantity + quantity)
+    apply_movement_rollups(session.connection(), deltas)
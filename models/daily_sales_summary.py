@@ -0,0 +1,87 @@
+from models import db
+from sqlalchemy import event, text
+
+# نموذج ملخص المبيعات اليومي لكل فرع ويوم ووردية
+# يتم تحديثه في نفس المعاملة مع كل عملية بيع جديدة
+class DailySalesSummary(db.Model):
+    __tablename__ = 'daily_sales_summaries'
+
+    branch_id = db.Column(db.Integer, db.ForeignKey('branches.id'), primary_key=True, autoincrement=False)
+    sale_date = db.Column(db.Date, primary_key=True)
+    shift = db.Column(db.String(10), primary_key=True)  # وردية الكاشير (morning أو evening)
+    sales_count = db.Column(db.Integer, nullable=False, default=0)
+    total_sales = db.Column(db.Float, nullable=False, default=0)
+    total_paid = db.Column(db.Float, nullable=False, default=0)
+    total_discount = db.Column(db.Float, nullable=False, default=0)
+
+    # الوردية المستخدمة عندما لا تكون وردية الكاشير محددة
+    DEFAULT_SHIFT = 'morning'
+
+    def __repr__(self):
+        return f'<DailySalesSummary branch={self.branch_id} {self.sale_date} {self.shift}>'
+
+    @classmethod
+    def for_day(cls, branch_id, day):
+        """إجماليات يوم لفرع (مجموع الورديات) {sales_count, total_sales, total_paid, total_discount}"""
+        row = db.session.query(
+            db.func.coalesce(db.func.sum(cls.sales_count), 0),
+            db.func.coalesce(db.func.sum(cls.total_sales), 0),
+            db.func.coalesce(db.func.sum(cls.total_paid), 0),
+            db.func.coalesce(db.func.sum(cls.total_discount), 0)
+        ).filter(cls.branch_id == branch_id, cls.sale_date == day).one()
+        return dict(zip(('sales_count', 'total_sales', 'total_paid', 'total_discount'), row))
+
+    @classmethod
+    def rebuild(cls):
+        """إعادة بناء الملخص بالكامل من جدول المبيعات"""
+        from models.sale import Sale
+        from models.user import User
+
+        db.session.execute(db.delete(cls))
+        shift = db.func.coalesce(User.shift, cls.DEFAULT_SHIFT)
+        sale_date = db.func.date(Sale.created_at)
+        summary = db.select(
+            Sale.branch_id,
+            sale_date,
+            shift,
+            db.func.count(Sale.id),
+            db.func.sum(Sale.total_amount),
+            db.func.sum(Sale.paid_amount),
+            db.func.sum(db.func.coalesce(Sale.discount, 0))
+        ).join(User, User.id == Sale.user_id).group_by(Sale.branch_id, sale_date, shift)
+        db.session.execute(db.insert(cls).from_select(
+            ['branch_id', 'sale_date', 'shift', 'sales_count', 'total_sales', 'total_paid', 'total_discount'],
+            summary
+        ))
+        db.session.commit()
+        return db.session.query(cls).count()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_daily_sales_summary(session, flush_context):
+    from models.sale import Sale
+    from models.user import User
+
+    totals = {}
+    for sale in session.new:
+        if not isinstance(sale, Sale):
+            continue
+        user = session.get(User, sale.user_id)
+        key = (sale.branch_id, sale.created_at.date(), (user.shift if user else None) or DailySalesSummary.DEFAULT_SHIFT)
+        count, total, paid, discount = totals.get(key, (0, 0, 0, 0))
+        totals[key] = (count + 1, total + sale.total_amount, paid + sale.paid_amount, discount + (sale.discount or 0))
+    if not totals:
+        return
+    session.connection().execute(text("""
+        INSERT INTO daily_sales_summaries (branch_id, sale_date, shift, sales_count, total_sales, total_paid, total_discount)
+        VALUES (:branch_id, :sale_date, :shift, :sales_count, :total_sales, :total_paid, :total_discount)
+        ON CONFLICT (branch_id, sale_date, shift) DO UPDATE SET
+            sales_count = daily_sales_summaries.sales_count + excluded.sales_count,
+            total_sales = daily_sales_summaries.total_sales + excluded.total_sales,
+            total_paid = daily_sales_summaries.total_paid + excluded.total_paid,
+            total_discount = daily_sales_summaries.total_discount + excluded.total_discount
+    """).bindparams(db.bindparam('sale_date', type_=db.Date)), [
+        {'branch_id': branch_id, 'sale_date': sale_date, 'shift': shift, 'sales_count': count,
+         'total_sales': total, 'total_paid': paid, 'total_discount': discount}
+        for (branch_id, sale_date, shift), (count, total, paid, discount) in totals.items()
+    ])
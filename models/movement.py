@@ -1,5 +1,6 @@
 from models import db
 from datetime import datetime
+from types import SimpleNamespace
 
 # نموذج حركة المنتج المتقدم
 class ProductMovement(db.Model):
@@ -19,4 +20,60 @@ class ProductMovement(db.Model):
     destination_id = db.Column(db.Integer, nullable=True)
 
     product = db.relationship('Product', backref='movements')
-    user = db.relationship('User', backref='movements')
\ No newline at end of file
+    user = db.relationship('User', backref='movements')
+
+    # فهارس الاستعلامات الأكثر استخداماً (انظر check_query_plans.py)
+    __table_args__ = (
+        db.Index('ix_product_movements_source', 'source_type', 'source_id', 'product_id'),
+        db.Index('ix_product_movements_destination', 'destination_type', 'destination_id', 'product_id'),
+        db.Index('ix_product_movements_timestamp', 'timestamp'),
+        db.Index('ix_product_movements_product_timestamp', 'product_id', 'timestamp'),
+        db.Index('ix_product_movements_user_id', 'user_id'),
+        db.Index('ix_product_movements_shift', 'shift'),
+        db.Index('ix_product_movements_type', 'type'),
+    )
+
+    @classmethod
+    def bulk_insert(cls, rows, source_reserved=False):
+        """إدراج مجموعة حركات (قواميس) في INSERT مجمّع واحد مع تحديث الأرصدة والملخص اليومي وفهرس البحث في نفس المعاملة
+
+        source_reserved=True إذا كانت كميات المصدر قد خُصمت مسبقاً عبر StockBalance.reserve
+        """
+        from models.cache_tags import movement_tags, note_cache_tags
+        from models.daily_movement_rollup import apply_movement_rollups, movement_rollup_deltas
+        from models.search_index import SearchIndex
+        from models.stock_balance import apply_stock_deltas, movement_deltas, product_quantity_decreases
+        from models.stock_snapshot import StockSnapshot
+
+        if not rows:
+            return
+        if any(row.get('notes') for row in rows):
+            # الملاحظات تُضاف لفهرس البحث بمعرفات الحركات الجديدة
+            ids = db.session.execute(db.insert(cls).returning(cls.id, sort_by_parameter_order=True), rows).scalars()
+            SearchIndex.add(db.session.connection(), {
+                ('movement', movement_id): row.get('notes') for movement_id, row in zip(ids, rows)
+            })
+        else:
+            db.session.execute(db.insert(cls), rows)
+        movements = [SimpleNamespace(**row) for row in rows]
+        deltas = movement_deltas(movements, include_source=not source_reserved)
+        apply_stock_deltas(db.session.connection(), deltas, product_quantity_decreases(movements))
+        apply_movement_rollups(db.session.connection(), movement_rollup_deltas(movements))
+        StockSnapshot.invalidate(db.session.connection(), movements)
+        note_cache_tags(movement_tags(movements))
+
+    @classmethod
+    def eager_options(cls):
+        """تحميل المنتج وصنفه والمستخدم لمجموعة حركات باستعلامات IN بدلاً من استعلام لكل حركة"""
+        from models.product import Product
+
+        return (
+            db.selectinload(cls.product).selectinload(Product.category),
+            db.selectinload(cls.user),
+        )
+
+    @classmethod
+    def involving(cls, location_type, location_id):
+        """شرط الحركات التي يكون الموقع مصدرها أو وجهتها"""
+        return ((cls.source_type == location_type) & (cls.source_id == location_id)) | \
+               ((cls.destination_type == location_type) & (cls.destination_id == location_id))
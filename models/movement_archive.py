@@ -0,0 +1,143 @@
+from models import db
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+
+# جداول الأرشيف الشهرية لها metadata منفصلة حتى لا يُنشئها db.create_all
+archive_metadata = db.MetaData()
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(value):
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+# سجل أرشيف الحركات القديمة
+# حركات كل شهر مؤرشف تُنقل من product_movements إلى جدول product_movements_YYYY_MM،
+# وقبل النقل تُحفظ أرصدة نهاية آخر يوم مؤرشف كلقطة افتتاحية في stock_snapshots (opening_date)
+# فتبقى stock_balances وإعادة بنائها صحيحة بدون الحركات المؤرشفة
+class MovementArchive(db.Model):
+    __tablename__ = 'movement_archives'
+
+    month = db.Column(db.Date, primary_key=True)  # أول يوم في الشهر
+    table_name = db.Column(db.String(64), nullable=False)
+    rows_count = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<MovementArchive {self.month:%Y-%m} rows={self.rows_count}>'
+
+    @staticmethod
+    def archive_table(month):
+        """جدول أرشيف شهر معين بنفس أعمدة product_movements"""
+        from models.movement import ProductMovement
+
+        name = f'product_movements_{month:%Y_%m}'
+        if name not in archive_metadata.tables:
+            db.Table(
+                name, archive_metadata,
+                *[db.Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+                  for column in ProductMovement.__table__.columns],
+                db.Index(f'ix_{name}_timestamp', 'timestamp')
+            )
+        return archive_metadata.tables[name]
+
+    @classmethod
+    def horizon(cls):
+        """أول يوم غير مؤرشف (الحركات قبله في جداول الأرشيف) أو None"""
+        last = db.session.query(db.func.max(cls.month)).scalar()
+        return next_month(last) if last else None
+
+    @classmethod
+    def opening_date(cls):
+        """تاريخ اللقطة الافتتاحية (آخر يوم مؤرشف) أو None"""
+        horizon = cls.horizon()
+        return horizon - timedelta(days=1) if horizon else None
+
+    @classmethod
+    def archived_count(cls):
+        return db.session.query(db.func.coalesce(db.func.sum(cls.rows_count), 0)).scalar()
+
+    @classmethod
+    def source(cls, date_from=None, date_to=None):
+        """الكيان الذي تُقرأ منه الحركات لفترة معينة
+
+        بدون فترة أو لفترة بعد حد الأرشفة يعيد ProductMovement (الجدول الحالي فقط)، وإلا يعيد
+        ProductMovement مرتبطاً باتحاد الجدول الحالي مع جداول أشهر الأرشيف التي تقع في الفترة
+        """
+        from models.movement import ProductMovement
+
+        if date_from is None and date_to is None:
+            return ProductMovement
+        date_from, date_to = (value.date() if isinstance(value, datetime) else value for value in (date_from, date_to))
+        horizon = cls.horizon()
+        if horizon is None or (date_from and date_from >= horizon):
+            return ProductMovement
+        query = db.session.query(cls.month).filter(cls.rows_count > 0)
+        if date_from:
+            query = query.filter(cls.month >= month_start(date_from))
+        if date_to:
+            query = query.filter(cls.month <= date_to)
+        months = [month for month, in query.order_by(cls.month)]
+        if not months:
+            return ProductMovement
+        movements = db.union_all(
+            db.select(ProductMovement.__table__),
+            *[db.select(cls.archive_table(month)) for month in months]
+        ).subquery('product_movements')
+        return db.aliased(ProductMovement, movements)
+
+    @classmethod
+    def archive(cls, before):
+        """أرشفة كل الحركات قبل بداية شهر التاريخ before في معاملة واحدة
+
+        يعيد عدد الحركات المؤرشفة
+        """
+        from models.movement import ProductMovement
+        from models.stock_snapshot import StockSnapshot
+
+        cutoff = month_start(before)
+        horizon = cls.horizon()
+        if horizon and cutoff <= horizon:
+            return 0
+        first = db.session.query(db.func.min(ProductMovement.timestamp)).filter(
+            ProductMovement.timestamp < datetime.combine(cutoff, datetime.min.time())
+        ).scalar()
+        if first is None and horizon is None:
+            return 0
+
+        # أرصدة نهاية آخر يوم مؤرشف تُحسب قبل نقل الحركات
+        StockSnapshot.take_from_balances(cutoff - timedelta(days=1))
+
+        connection = db.session.connection()
+        period = (db.bindparam('start', type_=db.DateTime), db.bindparam('end', type_=db.DateTime))
+        month = min(month_start(first), horizon) if first and horizon else (horizon or month_start(first))
+        archived = 0
+        while month < cutoff:
+            params = {'start': datetime.combine(month, datetime.min.time()),
+                      'end': datetime.combine(next_month(month), datetime.min.time())}
+            table = cls.archive_table(month)
+            moved = 0
+            if db.session.query(ProductMovement.id).filter(
+                ProductMovement.timestamp >= params['start'], ProductMovement.timestamp < params['end']
+            ).first():
+                table.create(connection, checkfirst=True)
+                columns = ', '.join(column.name for column in table.columns)
+                moved = connection.execute(text(f"""
+                    INSERT INTO {table.name} ({columns})
+                    SELECT {columns} FROM product_movements WHERE timestamp >= :start AND timestamp < :end
+                """).bindparams(*period), params).rowcount
+                # DELETE مباشر بدون أحداث الجلسة: الأرصدة لا تتغير لأن الحركات محسوبة في اللقطة الافتتاحية
+                connection.execute(text(
+                    'DELETE FROM product_movements WHERE timestamp >= :start AND timestamp < :end'
+                ).bindparams(*period), params)
+            entry = db.session.get(cls, month) or cls(month=month, table_name=table.name, rows_count=0)
+            entry.rows_count += moved
+            entry.archived_at = datetime.utcnow()
+            db.session.add(entry)
+            archived += moved
+            month = next_month(month)
+        db.session.commit()
+        return archived
@@ -1,5 +1,19 @@
 from models import db
-from datetime import datetime
+import weakref
+from datetime import datetime, timedelta
+from collections import Counter
+from sqlalchemy import event
+from models.notification_counter import NotificationCounter
+from models.outbox import OutboxEvent
+
+# نوع حدث الإشعار الجديد في صندوق الأحداث (انظر OutboxEvent.publish)
+NOTIFICATION_CREATED = 'notification_created'
+# مفتاح session.info الذي تُجمع فيه الإشعارات حتى commit
+PENDING_NOTIFICATIONS_KEY = 'pending_notifications'
+# عدد الإشعارات في كل صفحة من صندوق الإشعارات
+INBOX_PAGE_SIZE = 50
+# الإشعارات المؤجلة عند بداية كل savepoint لاستعادتها إذا أُلغي (انظر _restore_pending_notifications)
+_savepoint_notifications = weakref.WeakKeyDictionary()
 
 # نموذج إشعارات الفروع
 class BranchNotification(db.Model):
@@ -33,11 +47,139 @@ class BranchNotification(db.Model):
     product = db.relationship('Product', backref='notifications')
     creator = db.relationship('User', backref='created_notifications')
 
+    # لا يتكرر إشعار بنفس (الفرع، المنتج، النوع) خلال هذه المدة
+    DEDUP_WINDOW = timedelta(hours=12)
+
+    __table_args__ = (
+        db.Index('ix_branch_notifications_dedup', 'product_id', 'notification_type', 'created_at'),
+        db.Index('ix_branch_notifications_inbox', 'to_branch_id', 'is_read', 'created_at'),
+    )
+
+    @staticmethod
+    def dedup_key(fields):
+        return fields.get('to_branch_id'), fields.get('product_id'), fields['notification_type']
+
+    @classmethod
+    def queue(cls, dedupe=False, session=None, **fields):
+        """تأجيل إنشاء إشعار حتى commit المعاملة الحالية
+
+        جميع الإشعارات المؤجلة تُكتب بـ INSERT واحد قبل commit في نفس المعاملة وتُلغى مع rollback.
+        dedupe=True يدمج الإشعارات بنفس (الفرع، المنتج، النوع) في إشعار واحد (الأحدث)
+        ويتجاهله إذا وُجد إشعار مماثل خلال DEDUP_WINDOW.
+        """
+        session = session or db.session
+        pending = session.info.setdefault(PENDING_NOTIFICATIONS_KEY, {})
+        fields.setdefault('is_read', False)
+        fields.setdefault('is_urgent', False)
+        fields['created_at'] = datetime.utcnow()
+        key = cls.dedup_key(fields) if dedupe else len(pending)
+        pending.pop(key, None)
+        pending[key] = (dedupe, fields)
+
+    @classmethod
+    def inbox(cls, to_branch_id, notif_type='all', status='all'):
+        """استعلام صندوق إشعارات فرع (أو المدير إذا كان to_branch_id = None) مع فلاتر النوع والحالة"""
+        recipient = cls.to_branch_id.is_(None) if to_branch_id is None else cls.to_branch_id == to_branch_id
+        query = cls.query.filter(recipient)
+        if notif_type != 'all':
+            query = query.filter(cls.notification_type == notif_type)
+        if status == 'unread':
+            query = query.filter(cls.is_read == False)
+        elif status == 'read':
+            query = query.filter(cls.is_read == True)
+        return query
+
+    @classmethod
+    def page(cls, query, before=None, limit=INBOX_PAGE_SIZE):
+        """صفحة من الإشعارات مرتبة من الأحدث بترقيم keyset على (created_at, id)
+
+        before مؤشر آخر إشعار معروض بصيغة <created_at>_<id>، ويعيد (الإشعارات، مؤشر الصفحة التالية أو None)
+        """
+        try:
+            created_at, notification_id = before.rsplit('_', 1)
+            query = query.filter(db.tuple_(cls.created_at, cls.id) < (datetime.fromisoformat(created_at), int(notification_id)))
+        except (AttributeError, ValueError):
+            pass
+        notifications = query.order_by(cls.created_at.desc(), cls.id.desc()).limit(limit + 1).all()
+        if len(notifications) <= limit:
+            return notifications, None
+        notifications = notifications[:limit]
+        last = notifications[-1]
+        return notifications, f'{last.created_at.isoformat()}_{last.id}'
+
+    @classmethod
+    def purge(cls, before, batch_size=5000):
+        """تنظيف الإشعارات الأقدم من before على دفعات (كل دفعة في معاملة مستقلة)
+
+        تُحذف الإشعارات المقروءة، وتُدمج تنبيهات المخزون المنخفض غير المقروءة: يُحذف القديم منها
+        إذا وُجد إشعار أحدث لنفس (الفرع، المنتج، النوع). يعيد (عدد المحذوف، عدد المدمج)
+        """
+        newer = db.aliased(cls)
+        superseded = db.select(newer.id).where(
+            newer.to_branch_id.is_not_distinct_from(cls.to_branch_id),
+            newer.product_id == cls.product_id,
+            newer.notification_type == cls.notification_type,
+            newer.created_at > cls.created_at
+        ).exists()
+        conditions = (
+            (cls.created_at < before, cls.is_read == True),
+            (cls.created_at < before, cls.is_read == False, cls.notification_type == 'low_stock', superseded),
+        )
+        counts = []
+        for condition in conditions:
+            total = 0
+            while True:
+                ids = db.select(cls.id).where(*condition).limit(batch_size).scalar_subquery()
+                deleted = db.session.execute(
+                    db.delete(cls).where(cls.id.in_(ids)).returning(cls.to_branch_id, cls.is_read)
+                ).all()
+                # الإشعارات غير المقروءة المحذوفة تُنقص عداد فرعها
+                NotificationCounter.add(db.session.connection(), {
+                    to_branch_id: -count for to_branch_id, count in
+                    Counter(to_branch_id for to_branch_id, is_read in deleted if not is_read).items()
+                })
+                db.session.commit()
+                total += len(deleted)
+                if len(deleted) < batch_size:
+                    break
+            counts.append(total)
+        return tuple(counts)
+
     def mark_as_read(self):
         if not self.is_read:
             self.is_read = True
             self.read_at = datetime.utcnow()
 
+    @classmethod
+    def mark_all_read(cls, to_branch_id):
+        """تأشير كل إشعارات فرع (أو المدير إذا كان to_branch_id = None) كمقروءة بـ UPDATE واحد
+
+        يُنقص عداد غير المقروء بعدد الصفوف المعدلة في نفس المعاملة، ويعيد هذا العدد
+        """
+        recipient = cls.to_branch_id.is_(None) if to_branch_id is None else cls.to_branch_id == to_branch_id
+        result = db.session.execute(
+            db.update(cls).where(recipient, cls.is_read == False)
+            .values(is_read=True, read_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        NotificationCounter.add(db.session.connection(), {to_branch_id: -result.rowcount})
+        return result.rowcount
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'to_branch_id': self.to_branch_id,
+            'from_branch_id': self.from_branch_id,
+            'product_id': self.product_id,
+            'notification_type': self.notification_type,
+            'title': self.title,
+            'message': self.message,
+            'is_urgent': bool(self.is_urgent),
+            'icon': self.get_notification_icon(),
+            'css_class': self.get_notification_class(),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
     def get_notification_icon(self):
         icon_map = {
             'low_stock': 'bi-exclamation-triangle',
@@ -56,4 +198,85 @@ class BranchNotification(db.Model):
             'urgent': 'danger',
             'info': 'primary'
         }
-        return class_map.get(self.notification_type, 'secondary')
\ No newline at end of file
+        return class_map.get(self.notification_type, 'secondary')
+
+
+def _recent_notification_keys(session, keys, since):
+    """مفاتيح (الفرع، المنتج، النوع) الموجودة مسبقاً منذ since في استعلام واحد"""
+    product_ids = {product_id for to_branch_id, product_id, notification_type in keys}
+    types = {notification_type for to_branch_id, product_id, notification_type in keys}
+    rows = session.execute(
+        db.select(BranchNotification.to_branch_id, BranchNotification.product_id, BranchNotification.notification_type)
+        .where(
+            BranchNotification.product_id.in_(product_ids),
+            BranchNotification.notification_type.in_(types),
+            BranchNotification.created_at >= since
+        )
+    )
+    return {tuple(row) for row in rows} & set(keys)
+
+
+@event.listens_for(db.session, 'before_commit')
+def _write_pending_notifications(session):
+    pending = session.info.pop(PENDING_NOTIFICATIONS_KEY, None)
+    if not pending:
+        return
+    dedupe_keys = [key for key, (dedupe, fields) in pending.items() if dedupe]
+    existing = set()
+    if dedupe_keys:
+        existing = _recent_notification_keys(session, dedupe_keys, datetime.utcnow() - BranchNotification.DEDUP_WINDOW)
+    rows = [fields for key, (dedupe, fields) in pending.items() if not (dedupe and key in existing)]
+    if not rows:
+        return
+    ids = session.execute(
+        db.insert(BranchNotification).returning(BranchNotification.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    NotificationCounter.add(session.connection(), Counter(fields['to_branch_id'] for fields in rows if not fields['is_read']))
+    # نشر الإشعارات الجديدة لبث SSE الخاص بالفرع المستلم (أو المدير) في نفس المعاملة
+    OutboxEvent.publish(session.connection(), NOTIFICATION_CREATED, [
+        (OutboxEvent.branch_topic(fields['to_branch_id']), BranchNotification(id=notification_id, **fields).to_dict())
+        for notification_id, fields in zip(ids, rows)
+    ], session)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_notification_counters(session, flush_context):
+    # الإشعارات المعدلة أو المحذوفة عبر ORM (الإضافة تتم بـ INSERT مجمّع يحدّث العدادات بنفسه)
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, BranchNotification) and not obj.is_read:
+            deltas[obj.to_branch_id] += 1
+    for obj in session.dirty:
+        if isinstance(obj, BranchNotification):
+            history = db.inspect(obj).attrs.is_read.history
+            if history.has_changes() and bool(history.deleted and history.deleted[0]) != bool(obj.is_read):
+                deltas[obj.to_branch_id] += -1 if obj.is_read else 1
+    for obj in session.deleted:
+        if isinstance(obj, BranchNotification) and not obj.is_read:
+            deltas[obj.to_branch_id] -= 1
+    NotificationCounter.add(session.connection(), deltas)
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _discard_pending_notifications(session, transaction):
+    # rollback للمعاملة الرئيسية يلغي الإشعارات المؤجلة (بعد commit تكون قد كُتبت وأُزيلت)
+    if transaction.parent is None:
+        session.info.pop(PENDING_NOTIFICATIONS_KEY, None)
+
+
+@event.listens_for(db.session, 'after_transaction_create')
+def _save_pending_notifications(session, transaction):
+    if transaction.nested:
+        _savepoint_notifications[transaction] = dict(session.info.get(PENDING_NOTIFICATIONS_KEY, {}))
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _restore_pending_notifications(session, previous_transaction):
+    # rollback لـ savepoint (مثل معالج أحداث فاشل) يلغي الإشعارات التي أُضيفت داخله فقط
+    saved = _savepoint_notifications.pop(previous_transaction, None)
+    if saved is None:
+        return
+    if saved:
+        session.info[PENDING_NOTIFICATIONS_KEY] = saved
+    else:
+        session.info.pop(PENDING_NOTIFICATIONS_KEY, None)
@@ -0,0 +1,44 @@
+from models import db
+from sqlalchemy import text
+
+# نموذج عدد الإشعارات غير المقروءة لكل مستلم (عداد شارة الإشعارات)
+# branch_id = 0 يعني إشعارات المدير (to_branch_id = None)
+# يُحدّث في نفس معاملة إضافة الإشعارات أو تأشيرها كمقروءة أو حذفها (انظر models/notification.py)
+class NotificationCounter(db.Model):
+    __tablename__ = 'notification_counters'
+
+    branch_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<NotificationCounter branch={self.branch_id} unread={self.unread}>'
+
+    @classmethod
+    def unread_count(cls, branch_id):
+        """عدد الإشعارات غير المقروءة لفرع (أو للمدير إذا كان branch_id = None) بقراءة واحدة بالمفتاح"""
+        unread = db.session.query(cls.unread).filter(cls.branch_id == (branch_id or 0)).scalar()
+        return unread or 0
+
+    @staticmethod
+    def add(connection, deltas):
+        """تطبيق تغييرات {branch_id: delta} على العدادات داخل المعاملة الحالية"""
+        rows = [{'branch_id': branch_id or 0, 'delta': delta} for branch_id, delta in deltas.items() if delta]
+        if not rows:
+            return
+        connection.execute(text("""
+            INSERT INTO notification_counters (branch_id, unread) VALUES (:branch_id, MAX(:delta, 0))
+            ON CONFLICT (branch_id) DO UPDATE SET unread = MAX(notification_counters.unread + :delta, 0)
+        """), rows)
+
+    @classmethod
+    def rebuild(cls):
+        """إعادة حساب كل العدادات من جدول الإشعارات"""
+        db.session.execute(text('DELETE FROM notification_counters'))
+        db.session.execute(text("""
+            INSERT INTO notification_counters (branch_id, unread)
+            SELECT COALESCE(to_branch_id, 0), COUNT(*)
+            FROM branch_notifications
+            WHERE is_read = 0
+            GROUP BY COALESCE(to_branch_id, 0)
+        """))
+        db.session.commit()
@@ -0,0 +1,96 @@
+from models import db
+from datetime import datetime
+import json
+
+# مفتاح session.info الذي يشير إلى إضافة أحداث في المعاملة الحالية (لإيقاظ المعالج بعد commit، انظر events.py)
+OUTBOX_PENDING_KEY = 'outbox_pending'
+# مفتاح session.info الذي يشير إلى إضافة أحداث لها topic (لإيقاظ بث SSE بعد commit)
+OUTBOX_TOPICS_KEY = 'outbox_topics'
+
+# نموذج صندوق الأحداث الصادرة (transactional outbox)
+# عمليات الكتابة تضيف أحداثها في نفس معاملة الحركة، ومعالج الأحداث في الخلفية يقرؤها على دفعات
+# ويحدّث البيانات المشتقة (الإشعارات...) ثم يسجل processed_at في نفس معاملة التحديث
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    # الجهة التي تستقبل الحدث عبر بث SSE ('branch:<id>' أو 'admin')، و None للأحداث الداخلية
+    topic = db.Column(db.String(32), nullable=True)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    # عدد محاولات المعالجة الفاشلة وآخر خطأ
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+
+    # الحدث الذي يفشل هذا العدد من المرات يتوقف المعالج عن محاولته
+    MAX_ATTEMPTS = 5
+
+    __table_args__ = (
+        db.Index('ix_outbox_events_pending', 'processed_at', 'id'),
+        db.Index('ix_outbox_events_topic', 'topic', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<OutboxEvent {self.id} {self.event_type}>'
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+    @staticmethod
+    def append(connection, event_type, payload, session=None):
+        """إضافة حدث داخل المعاملة الحالية (يُلغى مع rollback ويُعالج بعد commit)"""
+        connection.execute(db.insert(OutboxEvent), {
+            'event_type': event_type,
+            'payload': json.dumps(payload, ensure_ascii=False),
+            'created_at': datetime.utcnow(),
+            'attempts': 0,
+        })
+        (session or db.session).info[OUTBOX_PENDING_KEY] = True
+
+    @staticmethod
+    def branch_topic(branch_id):
+        """topic فرع معين، و branch_id = None يعني المدير"""
+        return f'branch:{branch_id}' if branch_id else 'admin'
+
+    @staticmethod
+    def publish(connection, event_type, messages, session=None):
+        """إضافة أحداث موجهة [(topic, payload)] بـ INSERT مجمّع داخل المعاملة الحالية"""
+        if not messages:
+            return
+        now = datetime.utcnow()
+        connection.execute(db.insert(OutboxEvent), [{
+            'event_type': event_type,
+            'topic': topic,
+            'payload': json.dumps(payload, ensure_ascii=False),
+            'created_at': now,
+            'attempts': 0,
+        } for topic, payload in messages])
+        info = (session or db.session).info
+        info[OUTBOX_PENDING_KEY] = True
+        info[OUTBOX_TOPICS_KEY] = True
+
+    @classmethod
+    def for_topics(cls, topics, after_id, limit):
+        """أحداث مجموعة topics بعد معرف معين مرتبة حسب المعرف"""
+        return cls.query.filter(cls.topic.in_(topics), cls.id > after_id).order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def last_id(cls):
+        return db.session.query(db.func.coalesce(db.func.max(cls.id), 0)).scalar()
+
+    @classmethod
+    def pending(cls, limit, after_id=0):
+        """أقدم الأحداث غير المعالجة بعد معرف معين"""
+        return cls.query.filter(
+            cls.processed_at.is_(None), cls.attempts < cls.MAX_ATTEMPTS, cls.id > after_id
+        ).order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def purge(cls, before):
+        """حذف الأحداث المعالجة قبل تاريخ معين"""
+        result = db.session.execute(db.delete(cls).where(cls.processed_at < before))
+        db.session.commit()
+        return result.rowcount
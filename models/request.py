@@ -1,5 +1,10 @@
 from models import db
 from datetime import datetime
+from sqlalchemy import event
+from models.outbox import OutboxEvent
+
+# نوع حدث إنشاء طلب أو تغيير حالته في صندوق الأحداث
+REQUEST_UPDATED = 'request_updated'
 
 # نموذج طلبات المنتجات بين الفروع
 class ProductRequest(db.Model):
@@ -58,4 +63,39 @@ class ProductRequest(db.Model):
         return self.status == 'pending'
 
     def can_be_responded(self):
-        return self.status == 'pending'
\ No newline at end of file
+        return self.status == 'pending'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'requesting_branch_id': self.requesting_branch_id,
+            'product_id': self.product_id,
+            'quantity': self.quantity,
+            'source_type': self.source_type,
+            'source_id': self.source_id,
+            'status': self.status,
+            'status_display': self.get_status_display(),
+            'status_class': self.get_status_badge_class(),
+            'requested_at': self.requested_at.isoformat() if self.requested_at else None,
+            'responded_at': self.responded_at.isoformat() if self.responded_at else None,
+        }
+
+    def topics(self):
+        """الجهات المعنية بالطلب: الفرع الطالب والفرع المصدر والمدير"""
+        topics = {OutboxEvent.branch_topic(self.requesting_branch_id), OutboxEvent.branch_topic(None)}
+        if self.source_type == 'branch' and self.source_id:
+            topics.add(OutboxEvent.branch_topic(self.source_id))
+        return sorted(topics)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _publish_request_updates(session, flush_context):
+    changed = [obj for obj in session.new if isinstance(obj, ProductRequest)] + [
+        obj for obj in session.dirty
+        if isinstance(obj, ProductRequest) and db.inspect(obj).attrs.status.history.has_changes()
+    ]
+    if not changed:
+        return
+    OutboxEvent.publish(session.connection(), REQUEST_UPDATED, [
+        (topic, request_obj.to_dict()) for request_obj in changed for topic in request_obj.topics()
+    ], session)
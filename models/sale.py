@@ -14,6 +14,7 @@ class Sale(db.Model):
     sale_type = db.Column(db.String(16), nullable=False, default='cash')  # نقدي أو آجل
     note = db.Column(db.String(255), nullable=True)  # ملاحظة
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=True)
+    idempotency_key = db.Column(db.String(64), unique=True, index=True, nullable=True)  # مفتاح من جهاز نقطة البيع لمنع تكرار البيع
     # علاقات
     branch = db.relationship('Branch', backref='sales')
     user = db.relationship('User', backref='sales')
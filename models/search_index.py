@@ -0,0 +1,186 @@
+from models import db
+import re
+import weakref
+from datetime import datetime
+from sqlalchemy import DDL, event, text
+
+# فهرس البحث النصي الكامل (SQLite FTS5) لأسماء وباركودات المنتجات وملاحظات الحركات وأسماء وهواتف العملاء
+#
+# جدول واحد لكل الأنواع: rowid = معرف الكيان * ENTITY_SLOTS + رمز النوع، لذلك يتم التحديث والحذف بالمفتاح مباشرة.
+# النص يُخزن بعد توحيد الحروف العربية (انظر normalize_arabic) ويُوحد نص البحث بنفس الطريقة.
+# يُحدّث الفهرس من أحداث الجلسة (after_flush) ومن ProductMovement.bulk_insert، وعلى قواعد البيانات
+# غير SQLite (أو قبل إنشاء الجدول) يرجع البحث إلى LIKE.
+
+ENTITY_SLOTS = 8
+ENTITY_CODES = {'product': 1, 'movement': 2, 'customer': 3}
+
+# أقصى عدد نتائج يعيدها البحث
+SEARCH_LIMIT = 50
+
+search_index = db.table('search_index', db.column('rowid', db.Integer), db.column('body'), db.column('rank'))
+
+event.listen(db.metadata, 'after_create', DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(body, tokenize = 'unicode61 remove_diacritics 2')"
+).execute_if(dialect='sqlite'))
+
+_ARABIC_NORMALIZATION = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ی': 'ي',
+    'ة': 'ه',
+    'ـ': None,
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+})
+_ARABIC_DIACRITICS = re.compile('[\u064B-\u065F\u0670]')
+_WORD = re.compile(r'\w+')
+
+
+def normalize_arabic(value):
+    """توحيد أشكال الألف والياء والتاء المربوطة وحذف التشكيل والتطويل وتحويل الأرقام العربية"""
+    if not value:
+        return ''
+    return _ARABIC_DIACRITICS.sub('', str(value)).translate(_ARABIC_NORMALIZATION).casefold()
+
+
+def match_expression(q):
+    """تحويل نص البحث إلى تعبير FTS5: كل كلمة بادئة مطلوبة ("كلمة"*)"""
+    return ' '.join(f'"{word}"*' for word in _WORD.findall(normalize_arabic(q)))
+
+
+def product_document(name, barcode):
+    return f'{name or ""} {barcode or ""}'
+
+
+def customer_document(name, phone):
+    # رقم الهاتف بدون فواصل أيضاً ليطابق البحث بالأرقام المتصلة، مع كل نهاياته لأن البحث بالبادئة فقط
+    # (البحث بآخر أرقام الهاتف أو بجزء من وسطه يطابق بداية إحدى النهايات)
+    digits = re.sub(r'\D', '', normalize_arabic(phone))
+    suffixes = ' '.join(digits[i:] for i in range(1, len(digits)))
+    return f'{name or ""} {phone or ""} {digits} {suffixes}'
+
+
+class SearchIndex:
+    """واجهة فهرس البحث: الإضافة والحذف والاستعلام وإعادة البناء"""
+
+    # المحركات التي تم التأكد من وجود جدول الفهرس فيها
+    _engines = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def available(cls, connection=None):
+        """هل يمكن استخدام الفهرس (SQLite مع وجود جدول search_index)"""
+        engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            return False
+        if not cls._engines.get(engine):
+            connection = connection or db.session.connection()
+            cls._engines[engine] = connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+            )).first() is not None
+        return cls._engines[engine]
+
+    @staticmethod
+    def rowid(entity, entity_id):
+        return entity_id * ENTITY_SLOTS + ENTITY_CODES[entity]
+
+    @classmethod
+    def add(cls, connection, documents):
+        """إضافة كيانات جديدة للفهرس {(entity, entity_id): text} داخل المعاملة الحالية"""
+        rows = [
+            {'rowid': cls.rowid(*key), 'body': normalize_arabic(body)}
+            for key, body in documents.items() if body and body.strip()
+        ]
+        if rows and cls.available(connection):
+            connection.execute(text('INSERT INTO search_index (rowid, body) VALUES (:rowid, :body)'), rows)
+
+    @classmethod
+    def update(cls, connection, documents=None, removed=()):
+        """استبدال نصوص كيانات موجودة {(entity, entity_id): text} وحذف الكيانات removed [(entity, entity_id)]"""
+        documents = documents or {}
+        if not (documents or removed) or not cls.available(connection):
+            return
+        connection.execute(
+            text('DELETE FROM search_index WHERE rowid IN :rowids').bindparams(db.bindparam('rowids', expanding=True)),
+            {'rowids': [cls.rowid(*key) for key in list(documents) + list(removed)]}
+        )
+        cls.add(connection, documents)
+
+    @classmethod
+    def match_ids(cls, entity, q):
+        """استعلام فرعي بمعرفات كيانات النوع المطابقة لنص البحث (لاستخدامه داخل IN)"""
+        return db.select(search_index.c.rowid // ENTITY_SLOTS).where(
+            search_index.c.body.match(match_expression(q)),
+            search_index.c.rowid % ENTITY_SLOTS == ENTITY_CODES[entity]
+        )
+
+    @classmethod
+    def matching(cls, id_column, entity, q, *like_columns):
+        """شرط فلترة للاستعلامات: id_column ضمن نتائج الفهرس، أو LIKE على like_columns إذا لم يتوفر الفهرس"""
+        if match_expression(q) and cls.available():
+            return id_column.in_(cls.match_ids(entity, q))
+        return db.or_(*[column.ilike(f'%{q}%') for column in like_columns])
+
+    @classmethod
+    def search(cls, q, entities=None, limit=SEARCH_LIMIT):
+        """أفضل النتائج المطابقة مرتبة حسب الصلة (bm25): [(entity, entity_id)]"""
+        expression = match_expression(q)
+        if not expression:
+            return []
+        codes = {ENTITY_CODES[entity]: entity for entity in (entities or ENTITY_CODES)}
+        rows = db.session.execute(
+            db.select(search_index.c.rowid).where(
+                search_index.c.body.match(expression),
+                (search_index.c.rowid % ENTITY_SLOTS).in_(list(codes))
+            ).order_by(search_index.c.rank).limit(limit)
+        ).scalars()
+        return [(codes[rowid % ENTITY_SLOTS], rowid // ENTITY_SLOTS) for rowid in rows]
+
+    @classmethod
+    def rebuild(cls, chunk_size=1000):
+        """إعادة بناء الفهرس بالكامل من جداول المنتجات والعملاء والحركات (الجدول الحالي وجداول الأرشيف)"""
+        from models.customer import Customer
+        from models.movement_archive import MovementArchive
+        from models.product import Product
+
+        ProductMovement = MovementArchive.source(datetime.min, None)
+        connection = db.session.connection()
+        connection.execute(text('DELETE FROM search_index'))
+        sources = (
+            ('product', db.select(Product.id, Product.name, Product.barcode), product_document),
+            ('customer', db.select(Customer.id, Customer.name, Customer.phone), customer_document),
+            ('movement', db.select(ProductMovement.id, ProductMovement.notes).where(
+                ProductMovement.notes.isnot(None), ProductMovement.notes != ''
+            ), lambda notes: notes),
+        )
+        count = 0
+        for entity, query, document in sources:
+            for chunk in db.session.execute(query.execution_options(yield_per=chunk_size)).partitions():
+                cls.add(connection, {(entity, row[0]): document(*row[1:]) for row in chunk})
+                count += len(chunk)
+        db.session.commit()
+        return count
+
+
+@event.listens_for(db.session, 'after_flush')
+def _update_search_index(session, flush_context):
+    from models.customer import Customer
+    from models.movement import ProductMovement
+    from models.product import Product
+
+    fields = {
+        Product: ('product', ('name', 'barcode'), lambda obj: product_document(obj.name, obj.barcode)),
+        Customer: ('customer', ('name', 'phone'), lambda obj: customer_document(obj.name, obj.phone)),
+        ProductMovement: ('movement', ('notes',), lambda obj: obj.notes or ''),
+    }
+    added, documents = {}, {}
+    for obj in session.new:
+        if type(obj) in fields:
+            entity, columns, document = fields[type(obj)]
+            added[(entity, obj.id)] = document(obj)
+    for obj in session.dirty:
+        if type(obj) in fields:
+            entity, columns, document = fields[type(obj)]
+            if any(db.inspect(obj).attrs[column].history.has_changes() for column in columns):
+                documents[(entity, obj.id)] = document(obj)
+    removed = [(fields[type(obj)][0], obj.id) for obj in session.deleted if type(obj) in fields]
+    SearchIndex.add(session.connection(), added)
+    SearchIndex.update(session.connection(), documents, removed)
@@ -0,0 +1,217 @@
+from models import db
+from datetime import datetime
+from sqlalchemy import event, text
+from models.cache_tags import branch_tag, note_cache_tags
+from models.catalog_version import CatalogVersion, note_catalog_changes
+from models.outbox import OutboxEvent
+from models.stock_snapshot import StockSnapshot
+
+# نوع حدث تغيّر الأرصدة في صندوق الأحداث: {'changes': [[نوع الموقع, المعرف, المنتج, الفرق], ...],
+# 'product_quantity_decreased': [المنتجات التي نقصت كميتها العامة Product.quantity]}
+STOCK_CHANGED = 'stock_changed'
+
+class InsufficientStockError(ValueError):
+    """الكمية المتوفرة غير كافية لمنتج أو أكثر"""
+    def __init__(self, product_ids):
+        self.product_ids = list(product_ids)
+        super().__init__(f"الكمية غير متوفرة للمنتجات: {', '.join(map(str, self.product_ids))}")
+
+# نموذج أرصدة المخزون المحسوبة مسبقاً لكل موقع ومنتج
+# يتم تحديثه في نفس المعاملة مع كل إضافة أو حذف لحركة منتج
+class StockBalance(db.Model):
+    __tablename__ = 'stock_balances'
+
+    # المفتاح: نوع الموقع (warehouse/branch/dealer/customer) + معرفه + المنتج
+    # المواقع بدون معرف (المخزن الرئيسي مثلاً) تُخزن بالمعرف 0
+    location_type = db.Column(db.String(20), primary_key=True)
+    location_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True, autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # إصدار كتالوج الفرع عند آخر تغيير لهذا الصف (انظر CatalogVersion)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    product = db.relationship('Product')
+
+    def __repr__(self):
+        return f'<StockBalance {self.location_type}:{self.location_id} product={self.product_id} qty={self.quantity}>'
+
+    @staticmethod
+    def location_key(location_type, location_id):
+        return location_type, location_id or 0
+
+    @classmethod
+    def get_quantity(cls, location_type, location_id, product_id):
+        """رصيد منتج في موقع معين (قراءة واحدة بالمفتاح الأساسي)"""
+        location_type, location_id = cls.location_key(location_type, location_id)
+        quantity = db.session.query(cls.quantity).filter(
+            cls.location_type == location_type,
+            cls.location_id == location_id,
+            cls.product_id == product_id
+        ).scalar()
+        return quantity or 0
+
+    @classmethod
+    def get_quantities(cls, location_type, location_id, product_ids):
+        """أرصدة مجموعة منتجات في موقع معين في استعلام واحد {product_id: qty}"""
+        location_type, location_id = cls.location_key(location_type, location_id)
+        quantities = dict.fromkeys(product_ids, 0)
+        if not quantities:
+            return quantities
+        rows = db.session.query(cls.product_id, cls.quantity).filter(
+            cls.location_type == location_type,
+            cls.location_id == location_id,
+            cls.product_id.in_(list(quantities))
+        )
+        quantities.update(rows)
+        return quantities
+
+    @classmethod
+    def reserve(cls, location_type, location_id, quantities):
+        """خصم ذري مشروط للكميات {product_id: qty} من رصيد الموقع
+
+        جميع البنود تُخصم بـ UPDATE واحد لا يعدّل إلا الصفوف التي يكفي رصيدها، لذلك لا يمكن
+        لعمليتين متزامنتين أن تخصما نفس الكمية. يعيد قائمة المنتجات التي فشل خصمها،
+        وعلى المستدعي إلغاء المعاملة (rollback) إذا لم تكن القائمة فارغة.
+        """
+        location_type, location_id = cls.location_key(location_type, location_id)
+        if not quantities:
+            return []
+        needed = db.case(quantities, value=cls.product_id)
+        values = {'quantity': cls.quantity - needed, 'updated_at': datetime.utcnow()}
+        if location_type == 'branch':
+            CatalogVersion.bump(db.session.connection(), [location_id])
+            values['version'] = CatalogVersion.version_of(location_id)
+            note_catalog_changes({(location_id, product_id) for product_id in quantities})
+        # المنتجات التي خُصمت فعلاً تعود من نفس UPDATE
+        reserved = set(db.session.execute(
+            db.update(cls).where(
+                cls.location_type == location_type,
+                cls.location_id == location_id,
+                cls.product_id.in_(list(quantities)),
+                cls.quantity >= needed
+            ).values(**values).returning(cls.product_id).execution_options(synchronize_session=False)
+        ).scalars())
+        if len(reserved) == len(quantities):
+            note_cache_tags({'stock_balances'} | ({branch_tag(location_id)} if location_type == 'branch' else set()))
+            OutboxEvent.append(db.session.connection(), STOCK_CHANGED, {'changes': [
+                [location_type, location_id, product_id, -quantity] for product_id, quantity in quantities.items()
+            ]})
+            return []
+        return sorted(product_id for product_id in quantities if product_id not in reserved)
+
+    @classmethod
+    def rebuild(cls):
+        """إعادة بناء جدول الأرصدة بالكامل من سجل الحركات
+
+        إذا كانت هناك حركات مؤرشفة يبدأ الحساب من اللقطة الافتتاحية (انظر MovementArchive)
+        """
+        from models.movement_archive import MovementArchive
+
+        db.session.execute(text('DELETE FROM stock_balances'))
+        db.session.execute(text("""
+            INSERT INTO stock_balances (location_type, location_id, product_id, quantity, updated_at)
+            SELECT location_type, location_id, product_id, SUM(delta), :now
+            FROM (
+                SELECT location_type, location_id, product_id, quantity AS delta
+                FROM stock_snapshots
+                WHERE snapshot_date = :opening
+                UNION ALL
+                SELECT destination_type AS location_type, COALESCE(destination_id, 0) AS location_id,
+                       product_id, quantity AS delta
+                FROM product_movements
+                UNION ALL
+                SELECT source_type, COALESCE(source_id, 0), product_id, -quantity
+                FROM product_movements
+            ) AS ledger
+            GROUP BY location_type, location_id, product_id
+        """).bindparams(db.bindparam('opening', type_=db.Date)), {'now': datetime.utcnow(), 'opening': MovementArchive.opening_date()})
+        # الأرصدة أعيد حسابها بالكامل فيجب أن تعيد نقاط البيع تحميل كتالوج كل فرع
+        branch_ids = db.session.execute(text(
+            "SELECT DISTINCT location_id FROM stock_balances WHERE location_type = 'branch'"
+        )).scalars().all()
+        CatalogVersion.bump(db.session.connection(), branch_ids)
+        note_catalog_changes({(None, None)})
+        db.session.execute(text("""
+            UPDATE stock_balances
+            SET version = (SELECT version FROM catalog_versions WHERE branch_id = stock_balances.location_id)
+            WHERE location_type = 'branch'
+        """))
+        db.session.commit()
+        return db.session.query(cls).count()
+
+
+def movement_deltas(movements, sign=1, include_source=True):
+    """تحويل مجموعة حركات إلى تغييرات في الأرصدة {(نوع الموقع, المعرف, المنتج): الفرق}
+
+    include_source=False يتجاهل جهة المصدر عندما تكون قد خُصمت مسبقاً عبر StockBalance.reserve
+    """
+    deltas = {}
+    for movement in movements:
+        destination = StockBalance.location_key(movement.destination_type, movement.destination_id)
+        destination_key = destination + (movement.product_id,)
+        deltas[destination_key] = deltas.get(destination_key, 0) + sign * movement.quantity
+        if include_source:
+            source = StockBalance.location_key(movement.source_type, movement.source_id)
+            source_key = source + (movement.product_id,)
+            deltas[source_key] = deltas.get(source_key, 0) - sign * movement.quantity
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def product_quantity_decreases(movements, sign=1):
+    """المنتجات التي تنقص كميتها العامة (Product.quantity) بإضافة الحركات (sign=1) أو حذفها (sign=-1)
+
+    حركة الخروج تخصم من الكمية العامة وحركة الدخول تضيف إليها، والتحويل لا يغيرها
+    """
+    decreasing = 'out' if sign > 0 else 'in'
+    return {movement.product_id for movement in movements if movement.type == decreasing}
+
+def apply_stock_deltas(connection, deltas, product_quantity_decreased=()):
+    """تطبيق التغييرات على جدول الأرصدة باستخدام upsert داخل المعاملة الحالية
+
+    أي تغيير في رصيد فرع يزيد إصدار كتالوج الفرع ويُسجل الإصدار الجديد على الصف،
+    وتُضاف التغييرات كحدث stock_changed لمعالج الأحداث (الإشعارات وغيرها) مع المنتجات
+    التي نقصت كميتها العامة product_quantity_decreased
+    """
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    branch_changes = {
+        (location_id, product_id) for location_type, location_id, product_id in deltas if location_type == 'branch'
+    }
+    CatalogVersion.bump(connection, [location_id for location_id, product_id in branch_changes])
+    note_catalog_changes(branch_changes)
+    note_cache_tags({'stock_balances'} | {branch_tag(location_id) for location_id, product_id in branch_changes})
+    connection.execute(text("""
+        INSERT INTO stock_balances (location_type, location_id, product_id, quantity, updated_at, version)
+        VALUES (:location_type, :location_id, :product_id, :delta, :now, COALESCE(
+            (SELECT version FROM catalog_versions WHERE :location_type = 'branch' AND branch_id = :location_id), 0
+        ))
+        ON CONFLICT (location_type, location_id, product_id)
+        DO UPDATE SET quantity = stock_balances.quantity + excluded.quantity, updated_at = excluded.updated_at,
+                      version = excluded.version
+    """), [
+        {'location_type': location_type, 'location_id': location_id, 'product_id': product_id,
+         'delta': delta, 'now': now}
+        for (location_type, location_id, product_id), delta in deltas.items()
+    ])
+    OutboxEvent.append(connection, STOCK_CHANGED, {'changes': [
+        [location_type, location_id, product_id, delta] for (location_type, location_id, product_id), delta in deltas.items()
+    ], 'product_quantity_decreased': sorted(product_quantity_decreased)})
+
+@event.listens_for(db.session, 'after_flush')
+def _update_stock_balances(session, flush_context):
+    from models.movement import ProductMovement
+
+    deltas = {}
+    added = [obj for obj in session.new if isinstance(obj, ProductMovement)]
+    removed = [obj for obj in session.deleted if isinstance(obj, ProductMovement)]
+    for key, delta in movement_deltas(added).items():
+        deltas[key] = deltas.get(key, 0) + delta
+    for key, delta in movement_deltas(removed, sign=-1).items():
+        deltas[key] = deltas.get(key, 0) + delta
+    apply_stock_deltas(
+        session.connection(), {key: delta for key, delta in deltas.items() if delta},
+        product_quantity_decreases(added) | product_quantity_decreases(removed, sign=-1)
+    )
+    StockSnapshot.invalidate(session.connection(), added + removed)
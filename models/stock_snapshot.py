@@ -0,0 +1,163 @@
+from models import db
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+# نموذج لقطات الأرصدة اليومية
+# كل لقطة تحفظ رصيد كل موقع/منتج في نهاية يوم snapshot_date (الحركات قبل بداية اليوم التالي)
+class StockSnapshot(db.Model):
+    __tablename__ = 'stock_snapshots'
+
+    snapshot_date = db.Column(db.Date, primary_key=True)
+    location_type = db.Column(db.String(20), primary_key=True)
+    location_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True, autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StockSnapshot {self.snapshot_date} {self.location_type}:{self.location_id} product={self.product_id}>'
+
+    @staticmethod
+    def day_end(day):
+        return datetime.combine(day + timedelta(days=1), datetime.min.time())
+
+    @classmethod
+    def latest_date(cls, on_or_before=None):
+        """تاريخ أحدث لقطة (اختيارياً قبل أو في تاريخ معين)"""
+        query = db.session.query(db.func.max(cls.snapshot_date))
+        if on_or_before:
+            query = query.filter(cls.snapshot_date <= on_or_before)
+        return query.scalar()
+
+    @classmethod
+    def take(cls, snapshot_date):
+        """أخذ لقطة ليوم معين من أحدث لقطة سابقة + حركات الأيام التالية لها فقط"""
+        from models.movement_archive import MovementArchive
+
+        opening_date = MovementArchive.opening_date()
+        if opening_date and snapshot_date <= opening_date:
+            raise ValueError(f'لا يمكن إعادة أخذ لقطة قبل حد الأرشفة ({opening_date})')
+        previous = cls.latest_date(snapshot_date - timedelta(days=1))
+        params = {
+            'snapshot_date': snapshot_date,
+            'previous': previous,
+            # بدون لقطة سابقة تتم إعادة تشغيل السجل بالكامل
+            'start': cls.day_end(previous) if previous else datetime(1970, 1, 1),
+            'end': cls.day_end(snapshot_date),
+        }
+
+        db.session.execute(text('DELETE FROM stock_snapshots WHERE snapshot_date = :snapshot_date').bindparams(
+            db.bindparam('snapshot_date', type_=db.Date)
+        ), params)
+        db.session.execute(text("""
+            INSERT INTO stock_snapshots (snapshot_date, location_type, location_id, product_id, quantity)
+            SELECT :snapshot_date, location_type, location_id, product_id, SUM(delta)
+            FROM (
+                SELECT location_type, location_id, product_id, quantity AS delta
+                FROM stock_snapshots
+                WHERE snapshot_date = :previous
+                UNION ALL
+                SELECT destination_type, COALESCE(destination_id, 0), product_id, quantity
+                FROM product_movements
+                WHERE timestamp >= :start AND timestamp < :end
+                UNION ALL
+                SELECT source_type, COALESCE(source_id, 0), product_id, -quantity
+                FROM product_movements
+                WHERE timestamp >= :start AND timestamp < :end
+            ) AS ledger
+            GROUP BY location_type, location_id, product_id
+        """).bindparams(
+            db.bindparam('snapshot_date', type_=db.Date),
+            db.bindparam('previous', type_=db.Date),
+            db.bindparam('start', type_=db.DateTime),
+            db.bindparam('end', type_=db.DateTime),
+        ), params)
+        db.session.commit()
+        return db.session.query(cls).filter_by(snapshot_date=snapshot_date).count()
+
+    @classmethod
+    def take_from_balances(cls, snapshot_date):
+        """لقطة نهاية يوم معين من الأرصدة الحالية مطروحاً منها الحركات بعد ذلك اليوم (بدون commit)
+
+        تُستخدم قبل أرشفة الحركات لأنها لا تعتمد على الحركات القديمة ولا على اللقطات السابقة
+        """
+        params = {'snapshot_date': snapshot_date, 'end': cls.day_end(snapshot_date)}
+        db.session.execute(text('DELETE FROM stock_snapshots WHERE snapshot_date = :snapshot_date').bindparams(
+            db.bindparam('snapshot_date', type_=db.Date)
+        ), params)
+        db.session.execute(text("""
+            INSERT INTO stock_snapshots (snapshot_date, location_type, location_id, product_id, quantity)
+            SELECT :snapshot_date, location_type, location_id, product_id, SUM(delta)
+            FROM (
+                SELECT location_type, location_id, product_id, quantity AS delta
+                FROM stock_balances
+                UNION ALL
+                SELECT destination_type, COALESCE(destination_id, 0), product_id, -quantity
+                FROM product_movements
+                WHERE timestamp >= :end
+                UNION ALL
+                SELECT source_type, COALESCE(source_id, 0), product_id, quantity
+                FROM product_movements
+                WHERE timestamp >= :end
+            ) AS ledger
+            GROUP BY location_type, location_id, product_id
+        """).bindparams(
+            db.bindparam('snapshot_date', type_=db.Date),
+            db.bindparam('end', type_=db.DateTime),
+        ), params)
+
+    @classmethod
+    def invalidate(cls, connection, movements):
+        """حذف اللقطات التي تغيرت حركاتها (إضافة أو حذف حركة بتاريخ يوم اللقطة أو قبله)
+
+        take() يبني كل لقطة من السابقة لها، لذلك تُحذف كل اللقطات من يوم أقدم حركة متغيرة فما بعد
+        ويعيد take_stock_snapshots.py أخذها. اللقطة الافتتاحية لحد الأرشفة لا تُحذف لأن حركاتها في الأرشيف
+        """
+        from models.movement_archive import MovementArchive, next_month
+
+        dates = [movement.timestamp.date() for movement in movements if getattr(movement, 'timestamp', None)]
+        if not dates:
+            return
+        since = min(dates)
+        latest = connection.execute(db.select(db.func.max(cls.snapshot_date))).scalar()
+        if latest is None or since > latest:
+            return
+        last_archived = connection.execute(db.select(db.func.max(MovementArchive.month))).scalar()
+        if last_archived:
+            since = max(since, next_month(last_archived))
+        connection.execute(db.delete(cls).where(cls.snapshot_date >= since))
+
+    @classmethod
+    def quantities_as_of(cls, location_type, location_id, as_of_date):
+        """أرصدة موقع في نهاية يوم معين: أقرب لقطة + الحركات بعدها فقط {product_id: qty}"""
+        from models.movement_archive import MovementArchive
+
+        snapshot_date = cls.latest_date(as_of_date)
+        quantities = {}
+        if snapshot_date:
+            rows = db.session.query(cls.product_id, cls.quantity).filter(
+                cls.snapshot_date == snapshot_date,
+                cls.location_type == location_type,
+                cls.location_id == (location_id or 0)
+            )
+            quantities.update(rows)
+
+        end = cls.day_end(as_of_date)
+        start = cls.day_end(snapshot_date) if snapshot_date else None
+        # الحركات بين اللقطة والتاريخ قد تكون في جداول الأرشيف
+        ProductMovement = MovementArchive.source(start.date() if start else None, as_of_date)
+        for column_type, column_id, sign in (
+            (ProductMovement.destination_type, ProductMovement.destination_id, 1),
+            (ProductMovement.source_type, ProductMovement.source_id, -1),
+        ):
+            query = db.session.query(
+                ProductMovement.product_id, db.func.sum(ProductMovement.quantity)
+            ).filter(
+                column_type == location_type,
+                column_id == location_id if location_id else column_id.is_(None),
+                ProductMovement.timestamp < end
+            )
+            if start:
+                query = query.filter(ProductMovement.timestamp >= start)
+            for product_id, quantity in query.group_by(ProductMovement.product_id):
+                quantities[product_id] = quantities.get(product_id, 0) + sign * quantity
+        return quantities
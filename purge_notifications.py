@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Script لتنظيف جدول إشعارات الفروع من الإشعارات القديمة
+يحذف الإشعارات المقروءة الأقدم من NOTIFICATION_RETENTION_DAYS يوماً، ويدمج تنبيهات المخزون المنخفض
+غير المقروءة القديمة التي يوجد إشعار أحدث منها لنفس المنتج. يُشغّل دورياً (مثلاً يومياً عبر cron).
+يمكن تمرير عدد الأيام: python purge_notifications.py 30
+"""
+
+import sys
+from datetime import datetime, timedelta
+from flask import current_app
+from app import create_app
+from models.notification import BranchNotification
+
+def purge_notifications(days=None):
+    """تنظيف الإشعارات الأقدم من days يوماً (افتراضياً NOTIFICATION_RETENTION_DAYS)"""
+    if days is None:
+        days = current_app.config['NOTIFICATION_RETENTION_DAYS']
+    before = datetime.utcnow() - timedelta(days=days)
+    print(f"🔄 جاري تنظيف الإشعارات الأقدم من {before:%Y-%m-%d}...")
+    deleted, compacted = BranchNotification.purge(before)
+    print(f"✅ تم حذف {deleted} إشعار مقروء ودمج {compacted} تنبيه مخزون مكرر")
+
+if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        purge_notifications(int(sys.argv[1]) if len(sys.argv) > 1 else None)
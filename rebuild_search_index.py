@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Script لبناء فهرس البحث النصي (search_index) من جداول المنتجات والعملاء والحركات
+يُستخدم لتعبئة الفهرس لأول مرة أو لإصلاحه بعد تعديل البيانات خارج التطبيق
+"""
+
+from app import create_app
+from models import db
+from models.search_index import SearchIndex
+
+def rebuild_search_index():
+    """إنشاء جدول الفهرس (FTS5) إذا لم يكن موجوداً ثم إعادة فهرسة كل السجلات"""
+    db.create_all()
+    if not SearchIndex.available():
+        print("⚠️ فهرس البحث غير متاح (يتطلب SQLite مع FTS5)، سيُستخدم البحث بـ LIKE")
+        return
+    print("🔄 جاري بناء فهرس البحث...")
+    rows = SearchIndex.rebuild()
+    print(f"✅ تمت فهرسة {rows} سجل بنجاح!")
+
+if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        rebuild_search_index()
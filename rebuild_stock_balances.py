@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Script لإعادة بناء جدول أرصدة المخزون (stock_balances) من سجل الحركات
+يُستخدم لتعبئة الجدول لأول مرة أو لإصلاحه عند الشك في صحة الأرصدة
+"""
+
+from app import create_app
+from models import db
+from models.stock_balance import StockBalance
+
+def rebuild_stock_balances():
+    """إعادة حساب جميع الأرصدة من جدول product_movements"""
+    db.create_all()
+    print("🔄 جاري إعادة بناء أرصدة المخزون من سجل الحركات...")
+    rows = StockBalance.rebuild()
+    print(f"✅ تم بناء {rows} رصيد بنجاح!")
+
+if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        rebuild_stock_balances()
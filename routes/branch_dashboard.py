@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, Response, stream_with_context
 from flask_login import login_required, current_user
 from models import db
 from models.user import User
@@ -8,13 +8,23 @@ from models.category import Category
 from models.movement import ProductMovement
 from models.request import ProductRequest
 from models.notification import BranchNotification
+from models.outbox import OutboxEvent
 from models.branch_inventory import BranchInventory
+from models.stock_balance import StockBalance, STOCK_CHANGED
 from datetime import datetime, timedelta
 import json
+import time
 from routes.auth import admin_required
+import events
 
 branch_dashboard_bp = Blueprint('branch_dashboard', __name__, url_prefix='/branch')
 
+# مدة اتصال بث SSE قبل إغلاقه، ويعيد المتصفح الاتصال تلقائياً من آخر حدث (Last-Event-ID)
+STREAM_MAX_SECONDS = 300
+# رسالة keep-alive عندما لا تصل أحداث خلال هذه المدة
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_BATCH_SIZE = 100
+
 @branch_dashboard_bp.before_request
 def check_branch_access():
     """التحقق من أن المستخدم مرتبط بفرع"""
@@ -68,7 +78,7 @@ def inventory():
 
     # البحث والفلترة
     search = request.args.get('search', '')
-    category_id = request.args.get('category_id', '')
+    category_id = request.args.get('category_id', type=int)
     status = request.args.get('status', '')
 
     # الحصول على المنتجات
@@ -172,7 +182,7 @@ def get_branch_stats(branch):
     month_ago = today - timedelta(days=30)
 
     # عدد المنتجات في الفرع
-    products_count = len(branch.get_all_products_with_quantities())
+    products_count = branch.get_products_count()
 
     # الطلبات الصادرة
     outgoing_requests = ProductRequest.query.filter_by(
@@ -186,9 +196,11 @@ def get_branch_stats(branch):
     ).count()
 
     # حركات اليوم
+    today_start = datetime.combine(today, datetime.min.time())
     today_movements = ProductMovement.query.filter(
-        (ProductMovement.source_id == branch.id) | (ProductMovement.destination_id == branch.id),
-        db.func.date(ProductMovement.timestamp) == today
+        ProductMovement.involving('branch', branch.id),
+        ProductMovement.timestamp >= today_start,
+        ProductMovement.timestamp < today_start + timedelta(days=1)
     ).count()
 
     return {
@@ -217,30 +229,11 @@ def get_unread_notifications(branch):
 
 def get_low_stock_products(branch):
     """المنتجات منخفضة المخزون"""
-    branch_products = branch.get_all_products_with_quantities()
-    return [item for item in branch_products if item['quantity'] <= 10]
+    return branch.get_all_products_with_quantities(status='low_stock')
 
 def get_filtered_products(branch, search, category_id, status):
     """المنتجات المفلترة"""
-    branch_products = branch.get_all_products_with_quantities()
-
-    # فلترة حسب البحث
-    if search:
-        branch_products = [item for item in branch_products
-                          if search.lower() in item['product'].name.lower()]
-
-    # فلترة حسب الفئة
-    if category_id:
-        branch_products = [item for item in branch_products
-                          if str(item['product'].category_id) == category_id]
-
-    # فلترة حسب الحالة
-    if status == 'low_stock':
-        branch_products = [item for item in branch_products if item['quantity'] <= 10]
-    elif status == 'out_of_stock':
-        branch_products = [item for item in branch_products if item['quantity'] == 0]
-
-    return branch_products
+    return branch.get_all_products_with_quantities(search=search, category_id=category_id, status=status)
 
 def get_filtered_requests(branch, request_type, status):
     query = ProductRequest.query
@@ -311,8 +304,9 @@ def handle_new_request(branch):
         )
 
         db.session.add(request_obj)
-        db.session.commit()
+        db.session.flush()
         notify_new_request(request_obj)
+        db.session.commit()
 
         flash('تم إرسال الطلب بنجاح', 'success')
         return redirect(url_for('branch_dashboard.requests'))
@@ -322,9 +316,10 @@ def handle_new_request(branch):
         flash(f'حدث خطأ أثناء إرسال الطلب: {str(e)}', 'danger')
         return redirect(url_for('branch_dashboard.new_request'))
 
-def create_notification(to_branch_id, title, message, notification_type, product_id=None, from_branch_id=None, is_urgent=False, created_by=None):
-    from models.notification import BranchNotification
-    notif = BranchNotification(
+def create_notification(to_branch_id, title, message, notification_type, product_id=None, from_branch_id=None, is_urgent=False, created_by=None, dedupe=False):
+    """تسجيل إشعار يُكتب مع commit العملية الحالية (انظر BranchNotification.queue)"""
+    BranchNotification.queue(
+        dedupe=dedupe,
         to_branch_id=to_branch_id,
         from_branch_id=from_branch_id,
         product_id=product_id,
@@ -334,26 +329,59 @@ def create_notification(to_branch_id, title, message, notification_type, product
         is_urgent=is_urgent,
         created_by=created_by
     )
-    db.session.add(notif)
-    db.session.commit()
-    return notif
 
-# إشعار عند انخفاض الكمية في الفرع
+# إشعار عند انخفاض الكمية في الفرع (branch = None يعني المخزن الرئيسي ويُرسل للمدير)
+# تنبيهات نفس المنتج في نفس العملية تُدمج في تنبيه واحد
 
 def notify_low_stock(branch, product, quantity, threshold=10):
     if quantity <= threshold:
+        location_name = branch.name if branch else 'المخزن الرئيسي'
+        branch_id = branch.id if branch else None
         title = f"تنبيه: مخزون منخفض - {product.name}"
-        message = f"الكمية المتبقية من المنتج '{product.name}' في {branch.name}: {quantity}. يرجى إعادة الطلب أو التوريد."
+        message = f"الكمية المتبقية من المنتج '{product.name}' في {location_name}: {quantity}. يرجى إعادة الطلب أو التوريد."
         create_notification(
-            to_branch_id=branch.id,
+            to_branch_id=branch_id,
             title=title,
             message=message,
             notification_type='low_stock',
             product_id=product.id,
-            from_branch_id=branch.id,
-            is_urgent=True
+            from_branch_id=branch_id,
+            is_urgent=True,
+            dedupe=True
         )
 
+# تنبيهات المخزون المنخفض تُنشأ من أحداث تغيّر الأرصدة في معالج الأحداث (events.py) وليس داخل عملية الكتابة
+
+@events.handler(STOCK_CHANGED)
+def notify_low_stock_changes(payloads):
+    """تنبيه لكل فرع (أو المخزن الرئيسي) نقص فيه رصيد منتج إلى حد المخزون المنخفض
+
+    رصيد الفروع من جدول الأرصدة، أما المخزن الرئيسي فرصيده Product.quantity (يُدخل من صفحة المنتجات
+    بدون حركات) لذلك يُنبّه عليه فقط للمنتجات التي نقصت كميتها العامة (حركة خروج أو حذف حركة دخول)
+    """
+    branch_products, warehouse_products = {}, set()
+    for payload in payloads:
+        for location_type, location_id, product_id, delta in payload['changes']:
+            if delta < 0 and location_type == 'branch':
+                branch_products.setdefault(location_id, set()).add(product_id)
+        warehouse_products.update(payload.get('product_quantity_decreased', ()))
+    if not (branch_products or warehouse_products):
+        return
+    product_ids = warehouse_products.union(*branch_products.values())
+    products = {product.id: product for product in Product.query.filter(Product.id.in_(product_ids))}
+    branches = {branch.id: branch for branch in Branch.query.filter(Branch.id.in_(list(branch_products)))} if branch_products else {}
+    for branch_id, location_products in sorted(branch_products.items()):
+        branch = branches.get(branch_id)
+        if branch is None:
+            continue
+        quantities = StockBalance.get_quantities('branch', branch_id, sorted(location_products))
+        for product_id, quantity in quantities.items():
+            if product_id in products:
+                notify_low_stock(branch, products[product_id], quantity)
+    for product_id in sorted(warehouse_products):
+        if product_id in products:
+            notify_low_stock(None, products[product_id], products[product_id].quantity)
+
 # إشعار عند وصول طلب جديد
 
 def notify_new_request(request_obj):
@@ -415,6 +443,52 @@ def notify_request_status(request_obj, status):
             is_urgent=(status == 'rejected')
         )
 
+def event_stream(topics):
+    """بث SSE لأحداث outbox الموجهة إلى topics (إشعارات جديدة وتحديثات الطلبات)
+
+    معرف كل رسالة هو معرف الحدث، فيستأنف المتصفح من Last-Event-ID بعد انقطاع الاتصال،
+    وبدونه يبدأ البث من الأحداث التالية للحظة الاتصال
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('last_event_id', type=int)
+    if last_id is None:
+        last_id = OutboxEvent.last_id()
+
+    def generate(last_id):
+        yield 'retry: 3000\n\n'
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            version = events.streams.version
+            batch = [(e.id, e.event_type, e.payload) for e in OutboxEvent.for_topics(topics, last_id, STREAM_BATCH_SIZE)]
+            # لا تبقى معاملة قراءة مفتوحة أثناء الانتظار حتى لا تمنع الكتابة في SQLite
+            db.session.close()
+            for event_id, event_type, payload in batch:
+                last_id = event_id
+                yield f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'
+            if len(batch) == STREAM_BATCH_SIZE:
+                continue
+            if events.streams.wait(version, STREAM_HEARTBEAT_SECONDS) == version:
+                yield ': ping\n\n'
+
+    return Response(stream_with_context(generate(last_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@branch_dashboard_bp.route('/notifications/stream')
+@login_required
+def notifications_stream():
+    """بث مباشر لإشعارات فرع المستخدم وتحديثات طلباته"""
+    if not current_user.is_branch_user():
+        return jsonify({'error': 'غير مصرح'}), 403
+    return event_stream([OutboxEvent.branch_topic(current_user.branch_id)])
+
+@branch_dashboard_bp.route('/admin-notifications/stream')
+@login_required
+@admin_required
+def admin_notifications_stream():
+    """بث مباشر لإشعارات المدير وتحديثات كل الطلبات"""
+    return event_stream([OutboxEvent.branch_topic(None)])
+
 @branch_dashboard_bp.route('/notifications', methods=['GET'])
 @login_required
 def notifications():
@@ -424,15 +498,12 @@ def notifications():
     branch = current_user.branch
     notif_type = request.args.get('type', 'all')
     status = request.args.get('status', 'all')
-    query = BranchNotification.query.filter_by(to_branch_id=branch.id)
-    if notif_type != 'all':
-        query = query.filter_by(notification_type=notif_type)
-    if status == 'unread':
-        query = query.filter_by(is_read=False)
-    elif status == 'read':
-        query = query.filter_by(is_read=True)
-    notifications = query.order_by(BranchNotification.created_at.desc()).all()
-    return render_template('branch_dashboard/notifications.html', branch=branch, notifications=notifications, notif_type=notif_type, status=status)
+    # صفحة واحدة فقط (before = مؤشر آخر إشعار معروض)
+    notifications, next_cursor = BranchNotification.page(
+        BranchNotification.inbox(branch.id, notif_type, status), request.args.get('before')
+    )
+    return render_template('branch_dashboard/notifications.html', branch=branch, notifications=notifications,
+                           notif_type=notif_type, status=status, next_cursor=next_cursor)
 
 @branch_dashboard_bp.route('/notifications/mark_read/<int:notif_id>', methods=['POST'])
 @login_required
@@ -449,10 +520,7 @@ def mark_read(notif_id):
 @branch_dashboard_bp.route('/notifications/mark_all_read', methods=['POST'])
 @login_required
 def mark_all_read():
-    branch = current_user.branch
-    notifs = BranchNotification.query.filter_by(to_branch_id=branch.id, is_read=False).all()
-    for notif in notifs:
-        notif.mark_as_read()
+    BranchNotification.mark_all_read(current_user.branch_id)
     db.session.commit()
     flash('تم تأشير جميع الإشعارات كمقروءة', 'success')
     return redirect(url_for('branch_dashboard.notifications', type=request.args.get('type', 'all'), status=request.args.get('status', 'all')))
@@ -502,8 +570,8 @@ def approve_request(request_id):
         # تحديث الكميات يدويًا (إضافة للفرع الطالب)
         # لا حاجة لتعديل الكمية في المخزن لأن get_product_quantity تعتمد على الحركات
         # لكن يمكن إضافة منطق branch_inventory إذا كان مستخدمًا
-    db.session.commit()
     notify_request_status(req, 'accepted')
+    db.session.commit()
     flash('تمت الموافقة على الطلب بنجاح وتم نقل الكمية بين الفروع.', 'success')
     return redirect(url_for('branch_dashboard.requests'))
 
@@ -521,8 +589,8 @@ def reject_request(request_id):
     req.status = 'rejected'
     req.responded_by = current_user.id
     req.responded_at = datetime.utcnow()
-    db.session.commit()
     notify_request_status(req, 'rejected')
+    db.session.commit()
     flash('تم رفض الطلب', 'info')
     return redirect(url_for('branch_dashboard.requests'))
 
@@ -540,8 +608,8 @@ def deliver_request(request_id):
     req.status = 'delivered'
     req.responded_by = current_user.id
     req.responded_at = datetime.utcnow()
-    db.session.commit()
     notify_request_status(req, 'delivered')
+    db.session.commit()
     flash('تم تأكيد توصيل الطلب', 'success')
     return redirect(url_for('branch_dashboard.requests'))
 
@@ -568,15 +636,11 @@ def cancel_request(request_id):
 def admin_notifications():
     notif_type = request.args.get('type', 'all')
     status = request.args.get('status', 'all')
-    query = BranchNotification.query.filter_by(to_branch_id=None)
-    if notif_type != 'all':
-        query = query.filter_by(notification_type=notif_type)
-    if status == 'unread':
-        query = query.filter_by(is_read=False)
-    elif status == 'read':
-        query = query.filter_by(is_read=True)
-    notifications = query.order_by(BranchNotification.created_at.desc()).all()
-    return render_template('admin/admin_notifications.html', notifications=notifications, notif_type=notif_type, status=status)
+    notifications, next_cursor = BranchNotification.page(
+        BranchNotification.inbox(None, notif_type, status), request.args.get('before')
+    )
+    return render_template('admin/admin_notifications.html', notifications=notifications,
+                           notif_type=notif_type, status=status, next_cursor=next_cursor)
 
 @branch_dashboard_bp.route('/admin-notifications/mark_read/<int:notif_id>', methods=['POST'])
 @login_required
@@ -595,9 +659,7 @@ def admin_mark_read(notif_id):
 @login_required
 @admin_required
 def admin_mark_all_read():
-    notifs = BranchNotification.query.filter_by(to_branch_id=None, is_read=False).all()
-    for notif in notifs:
-        notif.mark_as_read()
+    BranchNotification.mark_all_read(None)
     db.session.commit()
     flash('تم تأشير جميع الإشعارات كمقروءة', 'success')
     return redirect(url_for('branch_dashboard.admin_notifications', type=request.args.get('type', 'all'), status=request.args.get('status', 'all')))
\ No newline at end of file
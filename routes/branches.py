@@ -6,10 +6,19 @@ from models.product import Product
 from models.movement import ProductMovement
 from forms.branch_forms import BranchForm
 from routes.auth import admin_required
+from cache import cached
+from models.cache_tags import branch_tag
 from datetime import datetime, timedelta
 
 branches_bp = Blueprint('branches', __name__)
 
+def parse_as_of(value):
+    """تحويل تاريخ الاستعلام التاريخي (YYYY-MM-DD) إلى date"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
 @branches_bp.route('/branches')
 @login_required
 def list_branches():
@@ -50,9 +59,8 @@ def delete_branch(branch_id):
 
     # التحقق من وجود حركات مرتبطة بالفرع
     has_movements = db.session.query(ProductMovement).filter(
-        ((ProductMovement.source_id == branch.id) & (ProductMovement.source_type == 'branch')) |
-        ((ProductMovement.destination_id == branch.id) & (ProductMovement.destination_type == 'branch'))
-    ).count() > 0
+        ProductMovement.involving('branch', branch.id)
+    ).first() is not None
 
     if has_movements:
         flash('لا يمكن حذف الفرع لوجود حركات مرتبطة به!', 'danger')
@@ -68,34 +76,44 @@ def delete_branch(branch_id):
 def branch_details(branch_id):
     branch = Branch.query.get_or_404(branch_id)
 
-    # الحصول على المنتجات في الفرع
-    branch_products = branch.get_all_products_with_quantities()
+    # الحصول على المنتجات في الفرع (حالياً أو في تاريخ سابق)
+    as_of = parse_as_of(request.args.get('as_of'))
+    if as_of:
+        branch_products = branch.get_products_as_of(as_of)
+        total_stock_value = sum(item['product'].price * item['quantity'] for item in branch_products)
+    else:
+        branch_products = branch.get_all_products_with_quantities()
+        total_stock_value = cached(
+            f'branch:{branch.id}:stock_value', (branch_tag(branch.id), 'products'), branch.get_total_stock_value
+        )
 
     # إحصائيات الفرع
-    total_stock_value = branch.get_total_stock_value()
-    movements_stats = branch.get_movements_stats()
+    movements_stats = cached(
+        f'branch:{branch.id}:movements_stats:{datetime.now().date()}', (branch_tag(branch.id),), branch.get_movements_stats
+    )
 
     # حركات الفرع الأخيرة
     recent_movements = ProductMovement.query.filter(
-        (ProductMovement.source_id == branch.id) |
-        (ProductMovement.destination_id == branch.id)
+        ProductMovement.involving('branch', branch.id)
     ).order_by(ProductMovement.timestamp.desc()).limit(10).all()
 
     # إحصائيات المنتجات الأكثر حركة
     from sqlalchemy import func
-    top_products = db.session.query(
-        Product.name,
-        func.sum(ProductMovement.quantity).label('total_moved')
-    ).join(ProductMovement, Product.id == ProductMovement.product_id).filter(
-        (ProductMovement.source_id == branch.id) |
-        (ProductMovement.destination_id == branch.id)
-    ).group_by(Product.id, Product.name).order_by(
-        func.sum(ProductMovement.quantity).desc()
-    ).limit(5).all()
+    top_products = cached(f'branch:{branch.id}:top_products', (branch_tag(branch.id), 'products'), lambda: [
+        row._asdict() for row in db.session.query(
+            Product.name,
+            func.sum(ProductMovement.quantity).label('total_moved')
+        ).join(ProductMovement, Product.id == ProductMovement.product_id).filter(
+            ProductMovement.involving('branch', branch.id)
+        ).group_by(Product.id, Product.name).order_by(
+            func.sum(ProductMovement.quantity).desc()
+        ).limit(5)
+    ])
 
     return render_template('branches/details.html',
                          branch=branch,
                          branch_products=branch_products,
+                         as_of=as_of,
                          total_stock_value=total_stock_value,
                          movements_stats=movements_stats,
                          recent_movements=recent_movements,
@@ -125,6 +143,51 @@ def branch_products_api(branch_id):
         'total_value': branch.get_total_stock_value()
     })
 
+@branches_bp.route('/branches/<int:branch_id>/api/products/as_of')
+@login_required
+def branch_products_as_of_api(branch_id):
+    branch = Branch.query.get_or_404(branch_id)
+    as_of = parse_as_of(request.args.get('date'))
+    if not as_of:
+        return jsonify({'success': False, 'message': 'يرجى إدخال تاريخ صحيح بصيغة YYYY-MM-DD'}), 400
+    branch_products = branch.get_products_as_of(as_of)
+
+    products_data = []
+    for item in branch_products:
+        products_data.append({
+            'id': item['product'].id,
+            'name': item['product'].name,
+            'category': item['product'].category.name if item['product'].category else 'غير محدد',
+            'price': item['product'].price,
+            'quantity': item['quantity'],
+            'total_value': item['product'].price * item['quantity']
+        })
+
+    return jsonify({
+        'branch_name': branch.name,
+        'as_of': as_of.strftime('%Y-%m-%d'),
+        'products': products_data,
+        'total_products': len(products_data),
+        'total_value': sum(p['total_value'] for p in products_data)
+    })
+
+@branches_bp.route('/branches/api/stock_matrix')
+@login_required
+def api_stock_matrix():
+    """مصفوفة كميات المنتجات في جميع الفروع"""
+    branches = Branch.query.order_by(Branch.name).all()
+    matrix = Branch.get_products_matrix([b.id for b in branches])
+
+    return jsonify({
+        'branches': [{'id': b.id, 'name': b.name} for b in branches],
+        'products': [{
+            'id': row['product'].id,
+            'name': row['product'].name,
+            'price': row['product'].price,
+            'quantities': {str(branch_id): qty for branch_id, qty in row['quantities'].items()}
+        } for row in matrix]
+    })
+
 @branches_bp.route('/branches/api/list')
 @login_required
 def api_list_branches():
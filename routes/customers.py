@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request
 from flask_login import login_required, current_user
 from models.customer import Customer
+from models.search_index import SearchIndex
 import pandas as pd
 from flask import send_file
 from models import db
@@ -16,7 +17,7 @@ def list_customers():
     sort = request.args.get('sort', 'created_at')
     customers = Customer.query
     if q:
-        customers = customers.filter((Customer.name.contains(q)) | (Customer.phone.contains(q)))
+        customers = customers.filter(SearchIndex.matching(Customer.id, 'customer', q, Customer.name, Customer.phone))
     if sort == 'name':
         customers = customers.order_by(Customer.name)
     elif sort == 'phone':
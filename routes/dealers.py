@@ -54,8 +54,7 @@ def delete_dealer(dealer_id):
     # التحقق من وجود حركات مرتبطة بالتاجر
     from models.movement import ProductMovement
     has_movements = ProductMovement.query.filter(
-        ((ProductMovement.source_type == 'dealer') & (ProductMovement.source_id == dealer_id)) |
-        ((ProductMovement.destination_type == 'dealer') & (ProductMovement.destination_id == dealer_id))
+        ProductMovement.involving('dealer', dealer_id)
     ).count() > 0
 
     if has_movements:
@@ -1,22 +1,42 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, Response, stream_with_context
 from flask_login import login_required, current_user
-from models import db
+from models import db, is_busy_error
 from models.product import Product
 from models.category import Category
 from models.branch import Branch
 from models.dealer import Dealer
 from models.movement import ProductMovement
+from models.movement_archive import MovementArchive
+from models.search_index import SearchIndex
+from models.stock_balance import StockBalance
 from models.user import User
 from forms.movement_forms import MovementForm
 from routes.auth import admin_required
 from datetime import datetime, timedelta
+from sqlalchemy.exc import OperationalError
+from itertools import islice
+from urllib.parse import quote
 import pandas as pd
+import xlsxwriter
+import tempfile
+import csv
 import io
 import os
-from routes.branch_dashboard import notify_low_stock
+from routes.pos import begin_write_transaction, commit_with_retry
 
 movements_bp = Blueprint('movements', __name__, url_prefix='/movements')
 
+# عدد الحركات في كل صفحة من قائمة الحركات
+MOVEMENTS_PAGE_SIZE = 50
+MAX_MOVEMENTS_PAGE_SIZE = 500
+
+# مكان المخزون في رسالة نقص الكمية حسب مصدر حركة الخروج
+OUT_SOURCE_LABELS = {
+    'warehouse': 'في المخزن الرئيسي',
+    'branch': 'في الفرع',
+    'dealer': 'لدى التاجر',
+}
+
 # Helper to get display name for source/destination
 ENTITY_LABELS = {
     'warehouse': 'المخزن الرئيسي',
@@ -24,22 +44,157 @@ ENTITY_LABELS = {
     'dealer': 'تاجر',
 }
 
-def get_entity_name(entity_type, entity_id):
-    if entity_type == 'warehouse':
-        return 'المخزن الرئيسي'
-    elif entity_type == 'branch':
-        branch = Branch.query.get(entity_id)
-        return branch.name if branch else 'فرع غير معروف'
-    elif entity_type == 'dealer':
-        # يمكن لاحقاً ربط جدول تجار
-        return f'تاجر رقم {entity_id}'
-    return '-'
+class EntityNames:
+    """حل أسماء المصادر والوجهات لمجموعة حركات باستعلام IN واحد لكل نوع كيان
+
+    يُستدعى في القوالب كـ get_entity_name(entity_type, entity_id)
+    """
+    def __init__(self, movements):
+        ids = {'branch': set(), 'dealer': set()}
+        for movement in movements:
+            for entity_type, entity_id in ((movement.source_type, movement.source_id),
+                                           (movement.destination_type, movement.destination_id)):
+                if entity_id and entity_type in ids:
+                    ids[entity_type].add(entity_id)
+        self.names = {
+            'branch': self._load(Branch, ids['branch']),
+            'dealer': self._load(Dealer, ids['dealer']),
+        }
+
+    @staticmethod
+    def _load(model, ids):
+        if not ids:
+            return {}
+        return dict(db.session.query(model.id, model.name).filter(model.id.in_(ids)))
+
+    def __call__(self, entity_type, entity_id):
+        if entity_type == 'warehouse':
+            return 'المخزن الرئيسي'
+        elif entity_type == 'branch':
+            return self.names['branch'].get(entity_id, 'فرع غير معروف')
+        elif entity_type == 'dealer':
+            return self.names['dealer'].get(entity_id, f'تاجر رقم {entity_id}')
+        return '-'
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+def build_movements_query(args):
+    """بناء استعلام الحركات من معاملات الفلترة (مشترك بين القائمة والتصدير)"""
+    product_id = args.get('product_id', type=int)
+    type_ = args.get('type')
+    date_from = parse_date(args.get('date_from'))
+    date_to = parse_date(args.get('date_to'))
+    branch_id = args.get('branch_id', type=int)
+    dealer_id = args.get('dealer_id', type=int)
+    user_id = args.get('user_id', type=int)
+    shift = args.get('shift')
+    quantity_less = args.get('quantity_less', type=int)
+    notes = args.get('q', '').strip()
+
+    # الفترات التي تسبق حد الأرشفة تُقرأ من جداول الأرشيف أيضاً
+    Movement = MovementArchive.source(date_from, date_to)
+    query = db.session.query(Movement)
 
+    # تطبيق الفلاتر
+    if product_id:
+        query = query.filter(Movement.product_id == product_id)
+    if type_:
+        query = query.filter(Movement.type == type_)
+    if date_from:
+        query = query.filter(Movement.timestamp >= date_from)
+    if date_to:
+        query = query.filter(Movement.timestamp < date_to + timedelta(days=1))
+    if branch_id:
+        query = query.filter(Movement.involving('branch', branch_id))
+    if dealer_id:
+        query = query.filter(Movement.involving('dealer', dealer_id))
+    if user_id:
+        query = query.filter(Movement.user_id == user_id)
+    if shift:
+        query = query.filter(Movement.shift == shift)
+    if quantity_less:
+        query = query.filter(Movement.quantity < quantity_less)
+    if notes:
+        query = query.filter(SearchIndex.matching(Movement.id, 'movement', notes, Movement.notes))
+    return query
+
+def parse_cursor(value):
+    """فك مؤشر الصفحة بصيغة <timestamp>_<id> إلى (timestamp, id)، والتاريخ None لحركة قديمة بدون تاريخ"""
+    try:
+        timestamp, movement_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp) if timestamp else None, int(movement_id)
+    except (AttributeError, ValueError):
+        return None
+
+def movements_page(query, cursor=None, limit=MOVEMENTS_PAGE_SIZE):
+    """صفحة من الحركات مرتبة من الأحدث بترقيم keyset على (timestamp, id)
+
+    الحركات القديمة بدون تاريخ (timestamp = NULL) تأتي بعد كل الحركات المؤرخة مرتبة بالمعرف،
+    وكل جزء يُقرأ باستعلام يستخدم الفهرس. يعيد (الحركات، مؤشر الصفحة التالية أو None)
+    """
+    Movement = query.column_descriptions[0]['entity']
+    query = query.options(*Movement.eager_options())
+    movements = []
+    if cursor is None or cursor[0] is not None:
+        dated = query.filter(Movement.timestamp.isnot(None))
+        if cursor:
+            dated = dated.filter(db.tuple_(Movement.timestamp, Movement.id) < cursor)
+        movements = dated.order_by(Movement.timestamp.desc(), Movement.id.desc()).limit(limit + 1).all()
+    if len(movements) <= limit:
+        undated = query.filter(Movement.timestamp.is_(None))
+        if cursor and cursor[0] is None:
+            undated = undated.filter(Movement.id < cursor[1])
+        movements += undated.order_by(Movement.id.desc()).limit(limit + 1 - len(movements)).all()
+    if len(movements) <= limit:
+        return movements, None
+    movements = movements[:limit]
+    last = movements[-1]
+    return movements, f"{last.timestamp.isoformat() if last.timestamp else ''}_{last.id}"
+
+def movement_to_dict(movement):
+    return {
+        'id': movement.id,
+        'product_id': movement.product_id,
+        'product_name': movement.product.name if movement.product else None,
+        'type': movement.type,
+        'quantity': movement.quantity,
+        'source_type': movement.source_type,
+        'source_id': movement.source_id,
+        'destination_type': movement.destination_type,
+        'destination_id': movement.destination_id,
+        'user': movement.user.username if movement.user else None,
+        'shift': movement.shift,
+        'notes': movement.notes,
+        'timestamp': movement.timestamp.isoformat() if movement.timestamp else None
+    }
 
 @movements_bp.route('/')
 @login_required
 def list_movements():
+    # بناء الاستعلام وجلب صفحة واحدة فقط (before = مؤشر آخر حركة معروضة)
+    query = build_movements_query(request.args)
+    limit = min(request.args.get('limit', MOVEMENTS_PAGE_SIZE, type=int), MAX_MOVEMENTS_PAGE_SIZE)
+    movements, next_cursor = movements_page(query, parse_cursor(request.args.get('before')), max(limit, 1))
+
+    # نسخة JSON لتحميل المزيد من الصفحة بدون إعادة عرضها
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'movements': [movement_to_dict(movement) for movement in movements],
+            'html': render_template('movements/_rows.html', movements=movements,
+                                    get_entity_name=EntityNames(movements), ENTITY_LABELS=ENTITY_LABELS),
+            'next_cursor': next_cursor
+        })
+
     # جلب خيارات الفلترة
     products = Product.query.order_by(Product.name).all()
     branches = Branch.query.order_by(Branch.name).all()
@@ -48,47 +203,18 @@ def list_movements():
 
     # معاملات الفلترة
     product_id = request.args.get('product_id', type=int)
-    type_ = request.args.get('type')
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
     branch_id = request.args.get('branch_id', type=int)
     dealer_id = request.args.get('dealer_id', type=int)
-    user_id = request.args.get('user_id', type=int)
-    shift = request.args.get('shift')
-    quantity_less = request.args.get('quantity_less', type=int)
 
-    # بناء الاستعلام
-    query = ProductMovement.query
-
-    # تطبيق الفلاتر
-    if product_id:
-        query = query.filter_by(product_id=product_id)
-    if type_:
-        query = query.filter_by(type=type_)
-    if date_from:
-        query = query.filter(ProductMovement.timestamp >= date_from)
-    if date_to:
-        query = query.filter(ProductMovement.timestamp <= date_to + ' 23:59:59')
-    if branch_id:
-        query = query.filter(((ProductMovement.source_type == 'branch') & (ProductMovement.source_id == branch_id)) |
-                             ((ProductMovement.destination_type == 'branch') & (ProductMovement.destination_id == branch_id)))
-    if dealer_id:
-        query = query.filter(((ProductMovement.source_type == 'dealer') & (ProductMovement.source_id == dealer_id)) |
-                             ((ProductMovement.destination_type == 'dealer') & (ProductMovement.destination_id == dealer_id)))
-    if user_id:
-        query = query.filter_by(user_id=user_id)
-    if shift:
-        query = query.filter_by(shift=shift)
-    if quantity_less:
-        query = query.filter(ProductMovement.quantity < quantity_less)
-
-    # ترتيب النتائج
-    movements = query.order_by(ProductMovement.timestamp.desc()).all()
+    # معاملات الفلترة بدون مؤشر الصفحة لبناء رابط الصفحة التالية
+    filter_args = {key: value for key, value in request.args.items() if key not in ('before', 'format')}
 
     return render_template('movements/list.html',
                          title='حركة المنتجات',
                          movements=movements,
-                         get_entity_name=get_entity_name,
+                         next_cursor=next_cursor,
+                         filter_args=filter_args,
+                         get_entity_name=EntityNames(movements),
                          ENTITY_LABELS=ENTITY_LABELS,
                          products=products,
                          branches=branches,
@@ -132,79 +258,68 @@ def add_movement():
         for subform in form.products:
             subform.product.choices = product_choices
     if form.validate_on_submit():
-        for subform in form.products.entries:
-            product = Product.query.get(subform.product.data)
-            qty = subform.quantity.data
-            if not product or qty is None or qty < 1:
-                flash('يرجى اختيار منتج صحيح وكمية صحيحة لكل صف', 'danger')
+        # المنتجات محملة مسبقاً لخيارات النموذج، فلا حاجة لاستعلام لكل سطر
+        product_map = {p.id: p for p in products}
+        lines = [(product_map.get(subform.product.data), subform.quantity.data) for subform in form.products.entries]
+        if any(not product or qty is None or qty < 1 for product, qty in lines):
+            flash('يرجى اختيار منتج صحيح وكمية صحيحة لكل صف', 'danger')
+            return render_template('movements/add.html', title='إضافة حركة منتجات', form=form)
+
+        # أرصدة الفرع المصدر لكل منتجات التحويل في استعلام واحد
+        source_branch = None
+        available = {}
+        if form.type.data == 'transfer' and form.source_type.data == 'branch' and form.source_id.data:
+            source_branch = next((b for b in branches if b.id == form.source_id.data), None)
+            if source_branch:
+                available = StockBalance.get_quantities('branch', source_branch.id, [product.id for product, qty in lines])
+
+        # التحقق من كل الأسطر قبل أي تعديل (مع احتساب تكرار نفس المنتج)
+        requested = {}
+        for product, qty in lines:
+            requested[product.id] = requested.get(product.id, 0) + qty
+            if form.type.data == 'out' and product.quantity < requested[product.id]:
+                flash(f'الكمية غير كافية {OUT_SOURCE_LABELS.get(form.source_type.data, "")} للمنتج {product.name}!', 'danger')
                 return render_template('movements/add.html', title='إضافة حركة منتجات', form=form)
-            # Update product quantity logic
+            if source_branch and available[product.id] < requested[product.id]:
+                flash(f'الكمية غير كافية في الفرع "{source_branch.name}" للمنتج {product.name}. المتوفر: {available[product.id]}', 'danger')
+                return render_template('movements/add.html', title='إضافة حركة منتجات', form=form)
+
+        # Determine source_id/destination_id
+        source_id = None
+        destination_id = None
+        if form.source_type.data == 'branch':
+            source_id = form.source_id.data
+        elif form.source_type.data == 'dealer':
+            source_id = form.dealer_source_id.data
+        if form.destination_type.data == 'branch':
+            destination_id = form.destination_id.data
+        elif form.destination_type.data == 'dealer':
+            destination_id = form.dealer_destination_id.data
+
+        # تحديث الكميات العامة ثم إدراج كل الحركات دفعة واحدة
+        # التحويل لا يؤثر على المخزن العام، الكميات في الفروع تُحسب من حركات التحويل
+        now = datetime.utcnow()
+        rows = []
+        for product, qty in lines:
             if form.type.data == 'in':
-                if form.destination_type.data == 'warehouse':
-                    product.quantity += qty
-                elif form.destination_type.data == 'branch':
-                    product.quantity += qty
-                elif form.destination_type.data == 'dealer':
-                    product.quantity += qty
+                product.quantity += qty
             elif form.type.data == 'out':
-                if form.source_type.data == 'warehouse':
-                    if product.quantity < qty:
-                        flash(f'الكمية غير كافية في المخزن الرئيسي للمنتج {product.name}!', 'danger')
-                        return render_template('movements/add.html', title='إضافة حركة منتجات', form=form)
-                    product.quantity -= qty
-                    notify_low_stock(None, product, product.quantity)
-                elif form.source_type.data == 'branch':
-                    if product.quantity < qty:
-                        flash(f'الكمية غير كافية في الفرع للمنتج {product.name}!', 'danger')
-                        return render_template('movements/add.html', title='إضافة حركة منتجات', form=form)
-                    product.quantity -= qty
-                    notify_low_stock(None, product, product.quantity)
-                elif form.source_type.data == 'dealer':
-                    if product.quantity < qty:
-                        flash(f'الكمية غير كافية لدى التاجر للمنتج {product.name}!', 'danger')
-                        return render_template('movements/add.html', title='إضافة حركة منتجات', form=form)
-                    product.quantity -= qty
-                    notify_low_stock(None, product, product.quantity)
-            elif form.type.data == 'transfer':
-                # تحويل: لا يؤثر على المخزن العام، فقط تسجيل الحركة
-                # التحويل بين الفروع لا يغير الكمية الإجمالية في المخزن
-                # الكميات في الفروع تُحسب من حركات التحويل
-
-                # التحقق من الكمية المتوفرة في الفرع المصدر
-                if form.source_type.data == 'branch' and form.source_id.data:
-                    source_branch = Branch.query.get(form.source_id.data)
-                    if source_branch:
-                        available_qty = source_branch.get_product_quantity(product.id)
-                        if available_qty < qty:
-                            flash(f'الكمية غير كافية في الفرع "{source_branch.name}" للمنتج {product.name}. المتوفر: {available_qty}', 'danger')
-                            return render_template('movements/add.html', title='إضافة حركة منتجات', form=form)
-                        notify_low_stock(source_branch, product, available_qty)
-                pass
-            # Determine source_id/destination_id
-            source_id = None
-            destination_id = None
-            if form.source_type.data == 'branch':
-                source_id = form.source_id.data
-            elif form.source_type.data == 'dealer':
-                source_id = form.dealer_source_id.data
-            if form.destination_type.data == 'branch':
-                destination_id = form.destination_id.data
-            elif form.destination_type.data == 'dealer':
-                destination_id = form.dealer_destination_id.data
-            movement = ProductMovement(
-                product_id=product.id,
-                user_id=current_user.id,
-                shift=form.shift.data,
-                type=form.type.data,
-                quantity=qty,
-                notes=form.notes.data,
-                timestamp=datetime.utcnow(),
-                source_type=form.source_type.data,
-                source_id=source_id,
-                destination_type=form.destination_type.data,
-                destination_id=destination_id,
-            )
-            db.session.add(movement)
+                product.quantity -= qty
+            rows.append({
+                'product_id': product.id,
+                'user_id': current_user.id,
+                'shift': form.shift.data,
+                'type': form.type.data,
+                'quantity': qty,
+                'notes': form.notes.data,
+                'timestamp': now,
+                'source_type': form.source_type.data,
+                'source_id': source_id,
+                'destination_type': form.destination_type.data,
+                'destination_id': destination_id,
+            })
+        # تنبيهات المخزون المنخفض تصدر من حدث stock_changed الذي يضيفه bulk_insert
+        ProductMovement.bulk_insert(rows)
         db.session.commit()
         flash('تمت إضافة الحركات وتحديث الكميات بنجاح', 'success')
         return redirect(url_for('movements.list_movements'))
@@ -226,13 +341,26 @@ def api_add_movement():
     errors = []
     if not products_data or not type_ or not shift or not source_type or not destination_type:
         return {"success": False, "message": "جميع الحقول مطلوبة"}, 400
-    for prod in products_data:
-        product_id = prod.get('product_id')
-        qty = prod.get('quantity')
-        product = Product.query.get(product_id)
+    # تحميل كل المنتجات المطلوبة وأرصدة الفرع المصدر مرة واحدة
+    lines = [(to_int(prod.get('product_id')), prod.get('quantity')) for prod in products_data]
+    product_ids = {product_id for product_id, qty in lines if product_id}
+    product_map = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids))} if product_ids else {}
+    source_branch = None
+    available = {}
+    if type_ == 'transfer' and source_type == 'branch' and source_id:
+        source_branch = db.session.get(Branch, source_id)
+        if source_branch:
+            available = StockBalance.get_quantities('branch', source_branch.id, list(product_map))
+
+    requested = {}
+    rows = []
+    now = datetime.utcnow()
+    for product_id, qty in lines:
+        product = product_map.get(product_id)
         if not product or qty is None or qty < 1:
             errors.append(f"منتج غير صحيح أو كمية غير صحيحة (ID: {product_id})")
             continue
+        requested[product.id] = requested.get(product.id, 0) + qty
         # منطق تحديث الكميات
         if type_ == 'in':
             # دخول: إضافة للمخزن العام
@@ -245,40 +373,224 @@ def api_add_movement():
             product.quantity -= qty
         elif type_ == 'transfer':
             # تحويل: لا يؤثر على المخزن العام، فقط تسجيل الحركة
-            # التحويل بين الفروع لا يغير الكمية الإجمالية في المخزن
-            # الكميات في الفروع تُحسب من حركات التحويل
-
-            # التحقق من الكمية المتوفرة في الفرع المصدر
-            if source_type == 'branch' and source_id:
-                from models.branch import Branch
-                source_branch = Branch.query.get(source_id)
-                if source_branch:
-                    available_qty = source_branch.get_product_quantity(product_id)
-                    if available_qty < qty:
-                        errors.append(f"الكمية غير كافية في الفرع '{source_branch.name}' للمنتج {product.name}. المتوفر: {available_qty}")
-                        continue
-            pass
-        # إضافة الحركة
-        movement = ProductMovement(
-            product_id=product.id,
-            user_id=current_user.id,
-            shift=shift,
-            type=type_,
-            quantity=qty,
-            notes=notes,
-            timestamp=datetime.utcnow(),
-            source_type=source_type,
-            source_id=source_id,
-            destination_type=destination_type,
-            destination_id=destination_id,
-        )
-        db.session.add(movement)
+            # التحقق من الكمية المتوفرة في الفرع المصدر (مع تكرار نفس المنتج)
+            if source_branch and available[product.id] < requested[product.id]:
+                errors.append(f"الكمية غير كافية في الفرع '{source_branch.name}' للمنتج {product.name}. المتوفر: {available[product.id]}")
+                continue
+        rows.append({
+            'product_id': product.id,
+            'user_id': current_user.id,
+            'shift': shift,
+            'type': type_,
+            'quantity': qty,
+            'notes': notes,
+            'timestamp': now,
+            'source_type': source_type,
+            'source_id': source_id,
+            'destination_type': destination_type,
+            'destination_id': destination_id,
+        })
     if errors:
         db.session.rollback()
         return {"success": False, "message": " ".join(errors)}, 400
+    # إدراج كل الحركات في INSERT مجمّع واحد
+    ProductMovement.bulk_insert(rows)
     db.session.commit()
     return {"success": True, "message": "تمت إضافة الحركات وتحديث الكميات بنجاح"}, 201
 
+# أعمدة ملف استيراد الحركات، والأعمدة غير الموجودة تؤخذ من حقول الطلب بنفس الاسم
+IMPORT_COLUMNS = ['product_id', 'barcode', 'quantity', 'type', 'shift',
+                  'source_type', 'source_id', 'destination_type', 'destination_id', 'notes']
+MAX_IMPORT_ROWS = 20000
+
+def read_import_file(file):
+    """قراءة ملف CSV أو Excel كنصوص مع توحيد أسماء الأعمدة"""
+    filename = (file.filename or '').lower()
+    if filename.endswith('.csv'):
+        df = pd.read_csv(file, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    elif filename.endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(file, dtype=str, keep_default_na=False)
+    else:
+        raise ValueError('صيغة الملف غير مدعومة، استخدم CSV أو XLSX')
+    df.columns = [str(column).strip().lower() for column in df.columns]
+    return df
+
+def validate_movement_import(df, defaults):
+    """التحقق من كل صفوف ملف الاستيراد دفعة واحدة (pandas + استعلامات IN)
+
+    يعيد (DataFrame بالصفوف الصحيحة، قائمة الأخطاء [{row, message}]). الكميات المتوفرة تُقارن برصيد
+    ما قبل الاستيراد، وصفوف الخروج لنفس المنتج/المصدر تُقبل بترتيب الملف حتى نفاد الكمية.
+    """
+    df = df.copy()
+    for column in IMPORT_COLUMNS:
+        if column not in df:
+            df[column] = ''
+        df[column] = df[column].astype(str).str.strip()
+        if defaults.get(column):
+            df[column] = df[column].mask(df[column] == '', defaults[column])
+    # رقم السطر في الملف (السطر الأول للعناوين)
+    df['row'] = df.index + 2
+    errors = pd.Series('', index=df.index)
+
+    def fail(mask, message):
+        # أول خطأ فقط لكل صف
+        errors[mask & (errors == '')] = message
+
+    # المنتجات: بالمعرف أو بالباركود في استعلام واحد
+    product_ids = pd.to_numeric(df['product_id'], errors='coerce')
+    barcodes = set(df.loc[product_ids.isna() & (df['barcode'] != ''), 'barcode'])
+    products = db.session.query(Product.id, Product.barcode, Product.quantity).filter(db.or_(
+        Product.id.in_([int(product_id) for product_id in product_ids.dropna().unique()]),
+        Product.barcode.in_(barcodes)
+    )).all()
+    stock = {product_id: quantity for product_id, barcode, quantity in products}
+    by_barcode = {barcode: product_id for product_id, barcode, quantity in products if barcode}
+    df['product_id'] = product_ids.fillna(df['barcode'].map(by_barcode))
+    fail(~df['product_id'].isin(list(stock)), 'منتج غير موجود')
+
+    df['quantity'] = pd.to_numeric(df['quantity'], errors='coerce')
+    fail(df['quantity'].isna() | (df['quantity'] < 1) | (df['quantity'] % 1 != 0), 'كمية غير صحيحة')
+    fail(~df['type'].isin(['in', 'out', 'transfer']), 'نوع الحركة غير صحيح (in/out/transfer)')
+    fail(~df['shift'].isin(['morning', 'evening']), 'الوردية غير صحيحة (morning/evening)')
+
+    # المصدر والوجهة: الفروع والتجار الموجودون فعلاً
+    for side, label in (('source', 'المصدر'), ('destination', 'الوجهة')):
+        location_type = df[f'{side}_type']
+        location_id = pd.to_numeric(df[f'{side}_id'], errors='coerce')
+        fail(~location_type.isin(list(ENTITY_LABELS)), f'نوع {label} غير صحيح (warehouse/branch/dealer)')
+        for entity_type, model in (('branch', Branch), ('dealer', Dealer)):
+            mask = location_type == entity_type
+            ids = [int(entity_id) for entity_id in location_id[mask].dropna().unique()]
+            existing = [entity_id for entity_id, in db.session.query(model.id).filter(model.id.in_(ids))] if ids else []
+            fail(mask & ~location_id.isin(existing), f'{label}: {ENTITY_LABELS[entity_type]} غير موجود')
+        df[f'{side}_id'] = location_id.where(location_type != 'warehouse')
+    fail((df['source_type'] == df['destination_type']) &
+         (df['source_id'].fillna(0) == df['destination_id'].fillna(0)), 'المصدر والوجهة متطابقان')
+
+    # الأرصدة تُتحقق للصفوف السليمة فقط
+    stock_errors = import_stock_errors(df[errors == ''])
+    errors.update(stock_errors[stock_errors != ''])
+
+    report = [{'row': int(row), 'message': message} for row, message in zip(df['row'], errors) if message]
+    return df[errors == ''], report
+
+def import_stock_errors(df):
+    """التحقق من كفاية الأرصدة الحالية لصفوف الخروج والتحويل من فرع في ملف الاستيراد
+
+    صفوف نفس المنتج/المصدر تُقبل بترتيب الملف حتى نفاد الكمية. يعيد Series برسالة الخطأ لكل صف ('' للصف المقبول)
+    """
+    errors = pd.Series('', index=df.index)
+
+    # الخروج من المخزن العام: مجموع الكميات المتراكم لكل منتج لا يتجاوز الكمية الحالية
+    outgoing = df['type'] == 'out'
+    if outgoing.any():
+        stock = dict(db.session.query(Product.id, Product.quantity).filter(
+            Product.id.in_([int(product_id) for product_id in df.loc[outgoing, 'product_id'].unique()])
+        ))
+        demand = df.loc[outgoing].groupby('product_id')['quantity'].cumsum()
+        errors[(demand > df.loc[outgoing, 'product_id'].map(stock)).reindex(df.index, fill_value=False)] = \
+            'الكمية غير كافية في المخزن الرئيسي'
+
+    # التحويل من فرع: مجموع الكميات المتراكم لكل فرع/منتج لا يتجاوز رصيد الفرع
+    transfers = (df['type'] == 'transfer') & (df['source_type'] == 'branch')
+    if transfers.any():
+        pairs = df.loc[transfers, ['source_id', 'product_id']]
+        balances = {
+            (branch_id, product_id): quantity
+            for branch_id, product_id, quantity in db.session.query(
+                StockBalance.location_id, StockBalance.product_id, StockBalance.quantity
+            ).filter(
+                StockBalance.location_type == 'branch',
+                StockBalance.location_id.in_([int(branch_id) for branch_id in pairs['source_id'].unique()]),
+                StockBalance.product_id.in_([int(product_id) for product_id in pairs['product_id'].unique()])
+            )
+        }
+        available = pd.Series(
+            [balances.get((int(branch_id), int(product_id)), 0) for branch_id, product_id in pairs.itertuples(index=False)],
+            index=pairs.index
+        )
+        demand = df.loc[transfers].groupby(['source_id', 'product_id'])['quantity'].cumsum()
+        errors[(demand > available).reindex(df.index, fill_value=False)] = 'الكمية غير كافية في الفرع المصدر'
+    return errors
+
+def write_movement_import(valid, user_id):
+    """كتابة صفوف الاستيراد الصحيحة بعد حجز الكتابة، يعيد (عدد الحركات المكتوبة، أخطاء الأرصدة)
+
+    الأرصدة يُعاد التحقق منها بعد BEGIN IMMEDIATE لأنها قد تتغير منذ التحقق الأول (بدون حجز)،
+    والصفوف التي لم تعد أرصدتها كافية تُستبعد وتُضاف للتقرير
+    """
+    begin_write_transaction()
+    stock_errors = import_stock_errors(valid)
+    report = [{'row': int(row), 'message': message} for row, message in zip(valid['row'], stock_errors) if message]
+    valid = valid[stock_errors == '']
+    if valid.empty:
+        return 0, report
+
+    now = datetime.utcnow()
+    ProductMovement.bulk_insert([{
+        'product_id': int(row.product_id),
+        'user_id': user_id,
+        'shift': row.shift,
+        'type': row.type,
+        'quantity': int(row.quantity),
+        'notes': row.notes or None,
+        'timestamp': now,
+        'source_type': row.source_type,
+        'source_id': None if pd.isna(row.source_id) else int(row.source_id),
+        'destination_type': row.destination_type,
+        'destination_id': None if pd.isna(row.destination_id) else int(row.destination_id),
+    } for row in valid.itertuples(index=False)])
+    # الدخول والخروج يغيران الكمية العامة للمنتج (نفس منطق الإضافة اليدوية)
+    signed = valid['quantity'].where(valid['type'] == 'in', -valid['quantity']).where(valid['type'] != 'transfer', 0)
+    deltas = signed.groupby(valid['product_id']).sum()
+    deltas = deltas[deltas != 0]
+    if not deltas.empty:
+        products = Product.__table__
+        db.session.execute(
+            db.update(products).where(products.c.id == db.bindparam('product')).values(quantity=products.c.quantity + db.bindparam('delta')),
+            [{'product': int(product_id), 'delta': int(delta)} for product_id, delta in deltas.items()]
+        )
+    return len(valid), report
+
+@movements_bp.route('/api/import', methods=['POST'])
+@login_required
+def api_import_movements():
+    """استيراد حركات من ملف CSV/XLSX مع تقرير أخطاء لكل صف
+
+    الصفوف الصحيحة تُكتب بإدراج مجمّع في معاملة واحدة. dry_run=1 للتحقق فقط بدون حفظ.
+    """
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'success': False, 'message': 'يرجى اختيار ملف'}), 400
+    try:
+        df = read_import_file(file)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'تعذر قراءة الملف: {str(e)}'}), 400
+    if df.empty:
+        return jsonify({'success': False, 'message': 'الملف لا يحتوي على أي صفوف'}), 400
+    if len(df) > MAX_IMPORT_ROWS:
+        return jsonify({'success': False, 'message': f'الحد الأقصى {MAX_IMPORT_ROWS} صف في الملف الواحد'}), 400
+
+    # التحقق بدون حجز الكتابة حتى لا تنتظر عمليات البيع أثناء فحص الملف
+    valid, errors = validate_movement_import(df, request.form)
+    db.session.rollback()
+    dry_run = request.form.get('dry_run') in ('1', 'true', 'on')
+    if valid.empty or dry_run:
+        status = 400 if valid.empty else 200
+        return jsonify({'success': not valid.empty, 'dry_run': dry_run, 'total_rows': len(df),
+                        'valid_rows': len(valid), 'imported': 0, 'errors': errors}), status
+
+    user_id = current_user.id
+    try:
+        imported, stock_errors = commit_with_retry(lambda: write_movement_import(valid, user_id))
+    except OperationalError as e:
+        if not is_busy_error(e):
+            raise
+        return jsonify({'success': False, 'message': 'النظام مشغول حالياً، يرجى إعادة المحاولة'}), 503
+    errors = sorted(errors + stock_errors, key=lambda error: error['row'])
+    return jsonify({'success': imported > 0, 'dry_run': False, 'total_rows': len(df), 'valid_rows': imported,
+                    'imported': imported, 'errors': errors}), 201 if imported else 409
+
 @movements_bp.route('/delete/<int:movement_id>', methods=['POST'])
 @login_required
 @admin_required
@@ -381,122 +693,79 @@ def api_delete_movement(movement_id):
             "message": f"حدث خطأ أثناء حذف الحركة: {str(e)}"
         }), 500
 
-@movements_bp.route('/export/excel')
-@login_required
-def export_movements_excel():
-    """تصدير حركات المنتجات إلى ملف Excel"""
-    try:
-        # جلب نفس الفلاتر المستخدمة في قائمة الحركات
-        product_id = request.args.get('product_id', type=int)
-        movement_type = request.args.get('type')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
-        branch_id = request.args.get('branch_id', type=int)
-        dealer_id = request.args.get('dealer_id', type=int)
-        user_id = request.args.get('user_id', type=int)
-        shift = request.args.get('shift')
-        quantity_less = request.args.get('quantity_less', type=int)
-
-        # بناء الاستعلام
-        query = ProductMovement.query
-
-        if product_id:
-            query = query.filter(ProductMovement.product_id == product_id)
-        if movement_type:
-            query = query.filter(ProductMovement.type == movement_type)
-        if date_from:
-            query = query.filter(ProductMovement.timestamp >= datetime.strptime(date_from, '%Y-%m-%d'))
-        if date_to:
-            query = query.filter(ProductMovement.timestamp <= datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
-        if branch_id:
-            query = query.filter(
-                ((ProductMovement.source_id == branch_id) & (ProductMovement.source_type == 'branch')) |
-                ((ProductMovement.destination_id == branch_id) & (ProductMovement.destination_type == 'branch'))
-            )
-        if dealer_id:
-            query = query.filter(
-                ((ProductMovement.source_id == dealer_id) & (ProductMovement.source_type == 'dealer')) |
-                ((ProductMovement.destination_id == dealer_id) & (ProductMovement.destination_type == 'dealer'))
-            )
-        if user_id:
-            query = query.filter(ProductMovement.user_id == user_id)
-        if shift:
-            query = query.filter(ProductMovement.shift == shift)
-        if quantity_less:
-            query = query.filter(ProductMovement.quantity < quantity_less)
-
-        # ترتيب النتائج
-        movements = query.order_by(ProductMovement.timestamp.desc()).all()
-
-        # تحضير البيانات للتصدير
-        data = []
-        for movement in movements:
-            # تحديد نوع الحركة بالعربية
-            type_arabic = {
-                'in': 'دخول',
-                'out': 'خروج',
-                'transfer': 'تحويل'
-            }.get(movement.type, movement.type)
-
-            # تحديد الوردية بالعربية
-            shift_arabic = {
-                'morning': 'صباحية',
-                'evening': 'مسائية'
-            }.get(movement.shift, movement.shift)
-
-            # الحصول على أسماء الكيانات
+# أعمدة ملف التصدير مع عرض كل عمود في Excel
+EXPORT_COLUMNS = [
+    ('رقم الحركة', 12), ('المنتج', 30), ('الصنف', 18), ('النوع', 10), ('الكمية', 10), ('من', 28), ('إلى', 28),
+    ('المستخدم', 16), ('الوردية', 10), ('التاريخ', 12), ('الوقت', 10), ('ملاحظات', 40)
+]
+# عدد الحركات التي تُقرأ من قاعدة البيانات في كل دفعة أثناء التصدير
+EXPORT_CHUNK_SIZE = 1000
+
+def iter_export_rows(query):
+    """صفوف ملف التصدير للحركات المفلترة، تُقرأ على دفعات (yield_per) بدون تحميل كل السجل في الذاكرة"""
+    type_labels = {'in': 'دخول', 'out': 'خروج', 'transfer': 'تحويل'}
+    shift_labels = {'morning': 'صباحية', 'evening': 'مسائية'}
+    Movement = query.column_descriptions[0]['entity']
+    movements = iter(query.options(*Movement.eager_options()).order_by(
+        Movement.timestamp.desc(), Movement.id.desc()
+    ).yield_per(EXPORT_CHUNK_SIZE))
+    while True:
+        chunk = list(islice(movements, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            return
+        # أسماء الفروع والتجار لهذه الدفعة فقط
+        get_entity_name = EntityNames(chunk)
+        for movement in chunk:
             source_name = get_entity_name(movement.source_type, movement.source_id) if movement.source_id else '-'
             destination_name = get_entity_name(movement.destination_type, movement.destination_id) if movement.destination_id else '-'
+            yield [
+                movement.id,
+                movement.product.name,
+                movement.product.category.name if movement.product.category else 'غير محدد',
+                type_labels.get(movement.type, movement.type),
+                movement.quantity,
+                f"{get_entity_type_label(movement.source_type)} - {source_name}",
+                f"{get_entity_type_label(movement.destination_type)} - {destination_name}",
+                movement.user.username,
+                shift_labels.get(movement.shift, movement.shift),
+                movement.timestamp.strftime('%Y-%m-%d'),
+                movement.timestamp.strftime('%H:%M:%S'),
+                movement.notes or '-'
+            ]
 
-            data.append({
-                'رقم الحركة': movement.id,
-                'المنتج': movement.product.name,
-                'الصنف': movement.product.category.name if movement.product.category else 'غير محدد',
-                'النوع': type_arabic,
-                'الكمية': movement.quantity,
-                'من': f"{get_entity_type_label(movement.source_type)} - {source_name}",
-                'إلى': f"{get_entity_type_label(movement.destination_type)} - {destination_name}",
-                'المستخدم': movement.user.username,
-                'الوردية': shift_arabic,
-                'التاريخ': movement.timestamp.strftime('%Y-%m-%d'),
-                'الوقت': movement.timestamp.strftime('%H:%M:%S'),
-                'ملاحظات': movement.notes or '-'
-            })
-
-        # إنشاء DataFrame
-        df = pd.DataFrame(data)
-
-        # إنشاء ملف Excel في الذاكرة
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='حركات المنتجات', index=False)
-
-            # الحصول على ورقة العمل
-            worksheet = writer.sheets['حركات المنتجات']
-            workbook = writer.book
-
-            # تنسيق العناوين
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'top',
-                'fg_color': '#D7E4BC',
-                'border': 1,
-                'align': 'center'
-            })
+@movements_bp.route('/export/excel')
+@login_required
+def export_movements_excel():
+    """تصدير حركات المنتجات إلى ملف Excel
 
-            # تطبيق التنسيق على العناوين
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
+    xlsxwriter في وضع constant_memory يكتب كل صف إلى ملف مؤقت فور إضافته، فلا تزيد الذاكرة مع عدد الحركات
+    """
+    output = tempfile.TemporaryFile()
+    try:
+        # نفس الفلاتر المستخدمة في قائمة الحركات
+        query = build_movements_query(request.args)
+
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('حركات المنتجات')
+
+        # تنسيق العناوين
+        header_format = workbook.add_format({
+            'bold': True,
+            'text_wrap': True,
+            'valign': 'top',
+            'fg_color': '#D7E4BC',
+            'border': 1,
+            'align': 'center'
+        })
 
-            # ضبط عرض الأعمدة
-            for i, col in enumerate(df.columns):
-                max_length = max(
-                    df[col].astype(str).map(len).max(),
-                    len(col)
-                )
-                worksheet.set_column(i, i, max_length + 2)
+        # ضبط عرض الأعمدة وكتابة العناوين (يجب قبل أي صف في وضع constant_memory)
+        for col_num, (title, width) in enumerate(EXPORT_COLUMNS):
+            worksheet.set_column(col_num, col_num, width)
+            worksheet.write(0, col_num, title, header_format)
 
+        for row_num, row in enumerate(iter_export_rows(query), start=1):
+            worksheet.write_row(row_num, 0, row)
+        workbook.close()
         output.seek(0)
 
         # إنشاء اسم الملف
@@ -511,9 +780,38 @@ def export_movements_excel():
         )
 
     except Exception as e:
+        output.close()
         flash(f'حدث خطأ أثناء تصدير البيانات: {str(e)}', 'danger')
         return redirect(url_for('movements.list_movements'))
 
+@movements_bp.route('/export/csv')
+@login_required
+def export_movements_csv():
+    """تصدير حركات المنتجات إلى CSV يُرسل للمتصفح أثناء قراءة الحركات (دفعة بعد دفعة)"""
+    query = build_movements_query(request.args)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM ليتعرف Excel على الترميز العربي
+        buffer.write('\ufeff')
+        writer.writerow([title for title, width in EXPORT_COLUMNS])
+        for row_num, row in enumerate(iter_export_rows(query), start=1):
+            writer.writerow(row)
+            if row_num % EXPORT_CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = quote(f'حركات_المنتجات_{timestamp}.csv')
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv; charset=utf-8',
+        headers={'Content-Disposition': f"attachment; filename*=UTF-8''{filename}"}
+    )
+
 def get_entity_type_label(entity_type):
     """الحصول على تسمية نوع الكيان بالعربية"""
     labels = {
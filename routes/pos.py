@@ -1,14 +1,27 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, jsonify, request
+from flask import Blueprint, render_template, redirect, url_for, flash, jsonify, request, make_response
 from flask_login import login_required, current_user
 from models.product import Product
 from models.branch import Branch
 from models.sale import Sale, SaleItem
-from models import db
+from models import db, is_busy_error
 from models.movement import ProductMovement
+from models.customer import Customer
+from models.daily_sales_summary import DailySalesSummary
+from models.stock_balance import StockBalance, InsufficientStockError
+from models.catalog_version import CatalogVersion
+from cache import scan_cache
+from sqlalchemy.exc import OperationalError, IntegrityError
 from datetime import datetime
+import random
+import time
 
 pos_bp = Blueprint('pos', __name__, url_prefix='/pos')
 
+# عدد مرات إعادة محاولة البيع عند تعارض الكتابة على قاعدة البيانات
+CHECKOUT_RETRIES = 5
+# أقصى عدد مبيعات مؤجلة في طلب واحد
+MAX_BATCH_SALES = 200
+
 @pos_bp.route('/')
 @login_required
 def pos_home():
@@ -16,108 +29,287 @@ def pos_home():
     if not current_user.is_branch_user():
         flash('غير مصرح لك باستخدام نقطة البيع إلا لموظفي الفروع.', 'danger')
         return redirect(url_for('dashboard'))
-    # حساب ملخص مبيعات اليوم
-    from datetime import datetime, timedelta
-    today = datetime.utcnow().date()
-    tomorrow = today + timedelta(days=1)
-    branch = current_user.branch
-    sales_today = Sale.query.filter(
-        Sale.branch_id == branch.id,
-        Sale.created_at >= today,
-        Sale.created_at < tomorrow
-    ).all()
-    total_sales = sum(s.total_amount for s in sales_today)
-    total_paid = sum(s.paid_amount for s in sales_today)
-    total_discount = sum(s.discount for s in sales_today)
-    sales_count = len(sales_today)
-    return render_template('pos/pos.html', title='نقطة البيع (POS)',
-                          total_sales=total_sales, total_paid=total_paid, total_discount=total_discount, sales_count=sales_count)
+    # ملخص مبيعات اليوم من جدول الملخص اليومي بدلاً من تحميل فواتير اليوم
+    summary = DailySalesSummary.for_day(current_user.branch_id, datetime.utcnow().date())
+    return render_template('pos/pos.html', title='نقطة البيع (POS)', **summary)
+
+def catalog_item(product, quantity):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'barcode': product.barcode or '',
+        'price': product.price,
+        'quantity': quantity
+    }
 
 @pos_bp.route('/api/products')
 @login_required
 def api_branch_products():
+    """كتالوج منتجات الفرع لنقطة البيع
+
+    بدون since تعاد قائمة كل المنتجات المتوفرة. مع ?since=<version> تعاد فقط المنتجات التي تغير
+    سعرها أو رصيدها بعد هذا الإصدار، والمنتجات التي نفدت في removed.
+    رقم الإصدار يُرسل في X-Catalog-Version و ETag، ومع If-None-Match المطابق يعاد 304 بدون أي استعلام إضافي
+    """
     if not current_user.is_branch_user():
         return jsonify({'success': False, 'message': 'غير مصرح'}), 403
     branch = current_user.branch
-    products = Product.query.all()
-    result = []
-    for p in products:
-        qty = branch.get_product_quantity(p.id)
-        if qty > 0:
-            result.append({
-                'id': p.id,
-                'name': p.name,
-                'barcode': getattr(p, 'barcode', ''),
-                'price': p.price,
-                'quantity': qty
-            })
-    return jsonify(result)
+    since = request.args.get('since', type=int)
+    # قراءة الإصدار قبل المنتجات: أي تغيير بإصدار أحدث سيظهر في الطلب التالي
+    version = CatalogVersion.current(branch.id)
+    etag = f'catalog-{branch.id}-{version}' if since is None else f'catalog-{branch.id}-{since}-{version}'
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        query = db.session.query(Product, StockBalance.quantity).join(
+            StockBalance,
+            db.and_(
+                StockBalance.product_id == Product.id,
+                StockBalance.location_type == 'branch',
+                StockBalance.location_id == branch.id
+            )
+        ).order_by(Product.id)
+        if since is None:
+            payload = [catalog_item(product, quantity) for product, quantity in query.filter(StockBalance.quantity > 0)]
+        elif since > version:
+            # إصدار غير معروف للخادم: يجب أن تستبدل نقطة البيع نسختها بالكامل
+            payload = {
+                'version': version,
+                'full': True,
+                'products': [catalog_item(product, quantity) for product, quantity in query.filter(StockBalance.quantity > 0)],
+                'removed': []
+            }
+        else:
+            changed = query.filter(StockBalance.version > since).all()
+            payload = {
+                'version': version,
+                'full': False,
+                'products': [catalog_item(product, quantity) for product, quantity in changed if quantity > 0],
+                'removed': [product.id for product, quantity in changed if quantity <= 0]
+            }
+        response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    response.headers['X-Catalog-Version'] = str(version)
+    response.cache_control.no_cache = True
+    return response
 
-@pos_bp.route('/api/checkout', methods=['POST'])
+@pos_bp.route('/api/scan/<barcode>')
 @login_required
-def api_checkout():
+def api_scan(barcode):
+    """قراءة باركود: المنتج وسعره وكميته الحالية في الفرع باستعلام واحد على فهرس الباركود
+
+    النتائج تُحفظ في scan_cache وتُفرغ بعد commit أي تغيير في المنتج أو في رصيده بالفرع
+    """
     if not current_user.is_branch_user():
         return jsonify({'success': False, 'message': 'غير مصرح'}), 403
-    branch = current_user.branch
-    data = request.json or {}
+    key = (current_user.branch_id, barcode)
+    item = scan_cache.get(key)
+    if item is None:
+        generation = scan_cache.generation
+        row = db.session.query(Product, db.func.coalesce(StockBalance.quantity, 0)).outerjoin(
+            StockBalance,
+            db.and_(
+                StockBalance.product_id == Product.id,
+                StockBalance.location_type == 'branch',
+                StockBalance.location_id == current_user.branch_id
+            )
+        ).filter(Product.barcode == barcode).first()
+        if row is None:
+            return jsonify({'success': False, 'message': 'لا يوجد منتج بهذا الباركود'}), 404
+        item = catalog_item(*row)
+        scan_cache.set(key, item, generation)
+    return jsonify(item)
+
+def record_sale(branch, user, data):
+    """تسجيل عملية بيع كاملة داخل المعاملة الحالية بدون commit
+
+    يرفع ValueError لبيانات غير صحيحة و InsufficientStockError إذا لم تكفِ الكمية لأي بند
+    """
     items = data.get('items', [])
     discount = float(data.get('discount', 0))
     paid = float(data.get('paid', 0))
     if not items:
-        return jsonify({'success': False, 'message': 'السلة فارغة'}), 400
-    # تحقق من الكميات
+        raise ValueError('السلة فارغة')
+    requested = {}
     for item in items:
-        product_id = item.get('id')
+        product_id = int(item.get('id'))
         qty = int(item.get('quantity', 0))
         if qty < 1:
-            return jsonify({'success': False, 'message': 'كمية غير صحيحة'}), 400
-        available = branch.get_product_quantity(product_id)
-        if qty > available:
-            return jsonify({'success': False, 'message': f'الكمية غير متوفرة للمنتج (ID: {product_id})'}), 400
-    # تسجيل البيع وخصم الكميات
+            raise ValueError('كمية غير صحيحة')
+        requested[product_id] = requested.get(product_id, 0) + qty
+    # حجز الكميات وخصمها ذرياً من رصيد الفرع
+    failed = StockBalance.reserve('branch', branch.id, requested)
+    if failed:
+        raise InsufficientStockError(failed)
+    # تسجيل البيع
     total = sum(float(item['price']) * int(item['quantity']) for item in items)
     customer_name = data.get('customer_name', '').strip()
     customer_phone = data.get('customer_phone', '').strip()
     customer_obj = None
     if customer_phone:
-        from models.customer import Customer
         customer_obj = Customer.query.filter(Customer.phone == customer_phone).first()
     elif customer_name:
-        from models.customer import Customer
         customer_obj = Customer.query.filter(Customer.name == customer_name).first()
     if not customer_obj and (customer_name or customer_phone):
         customer_obj = Customer(name=customer_name or None, phone=customer_phone or None)
         db.session.add(customer_obj)
-        db.session.flush()
-    sale = Sale(branch_id=branch.id, user_id=current_user.id, total_amount=total, paid_amount=paid, discount=discount, customer_id=customer_obj.id if customer_obj else None)
+    sale = Sale(branch_id=branch.id, user_id=user.id, total_amount=total, paid_amount=paid, discount=discount, customer=customer_obj,
+                idempotency_key=data.get('idempotency_key') or None)
     db.session.add(sale)
-    for item in items:
-        sale_item = SaleItem(
-            sale=sale,
-            product_id=item['id'],
-            quantity=int(item['quantity']),
-            unit_price=float(item['price']),
-            total_price=float(item['price']) * int(item['quantity'])
-        )
-        db.session.add(sale_item)
-        # تسجيل حركة خروج من الفرع
-        movement = ProductMovement(
-            product_id=item['id'],
-            user_id=current_user.id,
-            shift='morning',
-            type='out',
-            quantity=int(item['quantity']),
-            notes='بيع عبر نقطة البيع',
-            timestamp=datetime.utcnow(),
-            source_type='branch',
-            source_id=branch.id,
-            destination_type='customer',
-            destination_id=None
-        )
-        db.session.add(movement)
-    db.session.commit()
+    db.session.flush()
+    # إدراج بنود البيع وحركات الخروج دفعة واحدة لكل جدول
+    db.session.execute(db.insert(SaleItem), [{
+        'sale_id': sale.id,
+        'product_id': int(item['id']),
+        'quantity': int(item['quantity']),
+        'unit_price': float(item['price']),
+        'total_price': float(item['price']) * int(item['quantity'])
+    } for item in items])
+    now = datetime.utcnow()
+    # تسجيل حركات خروج من الفرع (الخصم من رصيد الفرع تم في الحجز)
+    ProductMovement.bulk_insert([{
+        'product_id': int(item['id']),
+        'user_id': user.id,
+        'shift': 'morning',
+        'type': 'out',
+        'quantity': int(item['quantity']),
+        'notes': 'بيع عبر نقطة البيع',
+        'timestamp': now,
+        'source_type': 'branch',
+        'source_id': branch.id,
+        'destination_type': 'customer',
+        'destination_id': None
+    } for item in items], source_reserved=True)
+    return sale
+
+def commit_with_retry(operation, retries=CHECKOUT_RETRIES):
+    """تنفيذ عملية كتابة ثم commit مع إعادة المحاولة عند انشغال قاعدة البيانات (database is locked)"""
+    for attempt in range(retries):
+        try:
+            result = operation()
+            db.session.commit()
+            return result
+        except OperationalError as e:
+            db.session.rollback()
+            if not is_busy_error(e) or attempt == retries - 1:
+                raise
+            time.sleep(0.05 * (2 ** attempt) * (1 + random.random()))
+
+def failed_items(error, branch):
+    """البنود التي فشل حجزها مع الكمية المتوفرة لكل منها"""
+    available = StockBalance.get_quantities('branch', branch.id, error.product_ids)
+    return [{'id': product_id, 'available': available[product_id]} for product_id in error.product_ids]
+
+def stock_error_response(error, branch):
+    return jsonify({
+        'success': False,
+        'message': f'الكمية غير متوفرة للمنتج (ID: {", ".join(map(str, error.product_ids))})',
+        'failed_items': failed_items(error, branch)
+    }), 400
+
+def find_sale_by_key(idempotency_key):
+    return db.session.query(Sale.id).filter(Sale.idempotency_key == idempotency_key).scalar()
+
+@pos_bp.route('/api/checkout', methods=['POST'])
+@login_required
+def api_checkout():
+    if not current_user.is_branch_user():
+        return jsonify({'success': False, 'message': 'غير مصرح'}), 403
+    branch = current_user.branch
+    data = request.json or {}
+    idempotency_key = data.get('idempotency_key')
+    # إعادة إرسال نفس البيع (مثلاً بعد انقطاع الاتصال) لا تسجله مرة ثانية
+    if idempotency_key and find_sale_by_key(idempotency_key):
+        return jsonify({'success': True, 'duplicate': True, 'message': 'تم تسجيل هذه العملية مسبقاً'})
+    try:
+        commit_with_retry(lambda: record_sale(branch, current_user, data))
+    except InsufficientStockError as e:
+        db.session.rollback()
+        return stock_error_response(e, branch)
+    except IntegrityError:
+        db.session.rollback()
+        if idempotency_key and find_sale_by_key(idempotency_key):
+            return jsonify({'success': True, 'duplicate': True, 'message': 'تم تسجيل هذه العملية مسبقاً'})
+        raise
+    except (ValueError, TypeError, KeyError) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e) or 'بيانات غير صحيحة'}), 400
+    except OperationalError as e:
+        # أخطاء قاعدة البيانات الأخرى (المخطط، القرص) لا تنجح بإعادة المحاولة
+        if not is_busy_error(e):
+            raise
+        return jsonify({'success': False, 'message': 'النظام مشغول حالياً، يرجى إعادة المحاولة'}), 503
     return jsonify({'success': True, 'message': 'تمت عملية البيع بنجاح'})
 
+def begin_write_transaction():
+    """بدء معاملة كتابة صريحة قبل استخدام نقاط الحفظ (SAVEPOINT)
+
+    مشغل pysqlite لا يبدأ المعاملة إلا مع أول أمر كتابة، فتصبح أول نقطة حفظ معاملة مستقلة
+    تُحفظ فور إغلاقها. BEGIN IMMEDIATE يحجز الكتابة من البداية فتبقى الدفعة كلها معاملة واحدة.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+def record_sales_batch(branch, user, sales):
+    """تسجيل مجموعة مبيعات في معاملة واحدة مع نقطة حفظ لكل بيع ونتيجة لكل منها"""
+    begin_write_transaction()
+    keys = [str(data['idempotency_key']) for data in sales]
+    recorded = dict(db.session.query(Sale.idempotency_key, Sale.id).filter(Sale.idempotency_key.in_(keys)))
+    results = []
+    for data, key in zip(sales, keys):
+        if key in recorded:
+            results.append({'idempotency_key': key, 'status': 'duplicate', 'sale_id': recorded[key]})
+            continue
+        savepoint = db.session.begin_nested()
+        try:
+            sale = record_sale(branch, user, dict(data, idempotency_key=key))
+            savepoint.commit()
+        except InsufficientStockError as e:
+            savepoint.rollback()
+            results.append({'idempotency_key': key, 'status': 'failed', 'message': str(e),
+                            'failed_items': failed_items(e, branch)})
+            continue
+        except (ValueError, TypeError, KeyError) as e:
+            savepoint.rollback()
+            results.append({'idempotency_key': key, 'status': 'failed', 'message': str(e) or 'بيانات غير صحيحة'})
+            continue
+        except IntegrityError:
+            # نفس المفتاح سُجل من طلب آخر في نفس اللحظة
+            savepoint.rollback()
+            results.append({'idempotency_key': key, 'status': 'duplicate', 'sale_id': find_sale_by_key(key)})
+            continue
+        recorded[key] = sale.id
+        results.append({'idempotency_key': key, 'status': 'recorded', 'sale_id': sale.id})
+    return results
+
+@pos_bp.route('/api/checkout/batch', methods=['POST'])
+@login_required
+def api_checkout_batch():
+    """استقبال المبيعات المؤجلة من نقطة البيع (وضع عدم الاتصال) دفعة واحدة
+
+    كل بيع يجب أن يحمل idempotency_key من الجهاز. البيع الفاشل لا يلغي باقي الدفعة،
+    والبيع المسجل مسبقاً بنفس المفتاح يعاد كـ duplicate بدون تكرار.
+    """
+    if not current_user.is_branch_user():
+        return jsonify({'success': False, 'message': 'غير مصرح'}), 403
+    branch = current_user.branch
+    sales = (request.json or {}).get('sales')
+    if not isinstance(sales, list) or not sales:
+        return jsonify({'success': False, 'message': 'لا توجد مبيعات للإرسال'}), 400
+    if len(sales) > MAX_BATCH_SALES:
+        return jsonify({'success': False, 'message': f'الحد الأقصى {MAX_BATCH_SALES} عملية بيع في الطلب الواحد'}), 400
+    if any(not isinstance(data, dict) or not data.get('idempotency_key') for data in sales):
+        return jsonify({'success': False, 'message': 'كل عملية بيع يجب أن تحمل idempotency_key'}), 400
+    try:
+        results = commit_with_retry(lambda: record_sales_batch(branch, current_user, sales))
+    except OperationalError as e:
+        # أخطاء قاعدة البيانات الأخرى (المخطط، القرص) لا تنجح بإعادة المحاولة
+        if not is_busy_error(e):
+            raise
+        return jsonify({'success': False, 'message': 'النظام مشغول حالياً، يرجى إعادة المحاولة'}), 503
+    return jsonify({'success': True, 'results': results})
+
 @pos_bp.route('/sales')
 @login_required
 def sales_list():
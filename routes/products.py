@@ -80,9 +80,13 @@ def edit_product(product_id):
 def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
 
-    # التحقق من وجود حركات مرتبطة بالمنتج
-    from models.movement import ProductMovement
-    has_movements = ProductMovement.query.filter_by(product_id=product_id).count() > 0
+    # التحقق من وجود حركات مرتبطة بالمنتج (في الجدول الحالي أو جداول الأرشيف أو لقطات الأرصدة)
+    from datetime import datetime
+    from models.movement_archive import MovementArchive
+    from models.stock_snapshot import StockSnapshot
+    ProductMovement = MovementArchive.source(datetime.min, None)
+    has_movements = db.session.query(ProductMovement.id).filter(ProductMovement.product_id == product_id).first() is not None \
+        or StockSnapshot.query.filter_by(product_id=product_id).first() is not None
     # التحقق من وجود فواتير بيع مرتبطة بالمنتج
     from models.sale import SaleItem
     has_sales = SaleItem.query.filter_by(product_id=product_id).count() > 0
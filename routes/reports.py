@@ -3,6 +3,7 @@ from flask_login import login_required
 from models import Sale
 from datetime import datetime, timedelta
 from flask import jsonify, request
+from cache import cached
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
 
@@ -15,6 +16,10 @@ def advanced_reports():
 @login_required
 def api_sales_last_30_days():
     today = datetime.utcnow().date()
+    return jsonify(cached(f'reports:sales_last_30_days:{today}', ('sales',), lambda: sales_last_30_days(today)))
+
+def sales_last_30_days(today):
+    """إجمالي المبيعات لكل يوم في آخر 30 يوماً حتى today {labels, data}"""
     start_date = today - timedelta(days=29)
     sales = (
         Sale.query
@@ -32,4 +37,4 @@ def api_sales_last_30_days():
         sales_by_day[day] += sale.total_amount
     labels = list(sales_by_day.keys())
     data = list(sales_by_day.values())
-    return jsonify({'labels': labels, 'data': data})
\ No newline at end of file
+    return {'labels': labels, 'data': data}
\ No newline at end of file
@@ -0,0 +1,65 @@
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from models import db
+from models.customer import Customer
+from models.movement import ProductMovement
+from models.product import Product
+from models.search_index import ENTITY_CODES, SEARCH_LIMIT, SearchIndex
+
+search_bp = Blueprint('search', __name__, url_prefix='/search')
+
+# لكل نوع: النموذج، أعمدة LIKE عند عدم توفر الفهرس، وتحويل النتيجة إلى JSON
+SEARCH_ENTITIES = {
+    'product': (Product, (Product.name, Product.barcode), lambda product: {
+        'id': product.id, 'name': product.name, 'barcode': product.barcode, 'price': product.price
+    }),
+    'customer': (Customer, (Customer.name, Customer.phone), lambda customer: {
+        'id': customer.id, 'name': customer.name, 'phone': customer.phone
+    }),
+    'movement': (ProductMovement, (ProductMovement.notes,), lambda movement: {
+        'id': movement.id, 'notes': movement.notes, 'type': movement.type, 'quantity': movement.quantity,
+        'product_id': movement.product_id, 'timestamp': movement.timestamp.isoformat() if movement.timestamp else None
+    }),
+}
+
+def search_ids(q, entities, limit):
+    """[(entity, entity_id)] مرتبة حسب الصلة من الفهرس، أو بـ LIKE (الأحدث أولاً) إذا لم يتوفر"""
+    if SearchIndex.available():
+        return SearchIndex.search(q, entities, limit)
+    results = []
+    for entity in entities:
+        model, columns, serialize = SEARCH_ENTITIES[entity]
+        ids = db.session.execute(
+            db.select(model.id).where(db.or_(*[column.ilike(f'%{q}%') for column in columns]))
+            .order_by(model.id.desc()).limit(limit)
+        ).scalars()
+        results.extend((entity, entity_id) for entity_id in ids)
+    return results[:limit]
+
+@search_bp.route('/api')
+@login_required
+def api_search():
+    """بحث موحد في المنتجات والعملاء وملاحظات الحركات
+
+    ?q=نص البحث&type=product,customer,movement&limit=20
+    """
+    q = request.args.get('q', '').strip()
+    entities = [entity for entity in request.args.get('type', '').split(',') if entity in ENTITY_CODES] or list(SEARCH_ENTITIES)
+    if not (current_user.is_admin() or current_user.is_branch_user()):
+        entities = [entity for entity in entities if entity != 'customer']
+    limit = min(max(request.args.get('limit', 20, type=int), 1), SEARCH_LIMIT)
+    if not q or not entities:
+        return jsonify({'query': q, 'results': []})
+
+    matches = search_ids(q, entities, limit)
+    # تحميل كل نوع باستعلام IN واحد ثم إعادة الترتيب حسب الصلة
+    loaded = {}
+    for entity in {entity for entity, entity_id in matches}:
+        model = SEARCH_ENTITIES[entity][0]
+        ids = [entity_id for match_entity, entity_id in matches if match_entity == entity]
+        loaded.update(((entity, obj.id), obj) for obj in model.query.filter(model.id.in_(ids)))
+    results = [
+        {'type': entity, **SEARCH_ENTITIES[entity][2](loaded[(entity, entity_id)])}
+        for entity, entity_id in matches if (entity, entity_id) in loaded
+    ]
+    return jsonify({'query': q, 'results': results})
@@ -6,8 +6,12 @@ from models.category import Category
 from models.branch import Branch
 from models.dealer import Dealer
 from models.movement import ProductMovement
+from models.daily_movement_rollup import DailyMovementRollup
+from models.stock_balance import StockBalance
 from models.user import User
 from routes.auth import admin_required
+from cache import cached
+from models.cache_tags import branch_tag
 from datetime import datetime, timedelta
 import pandas as pd
 import io
@@ -15,125 +19,144 @@ from sqlalchemy import func, and_
 
 stats_bp = Blueprint('stats', __name__, url_prefix='/stats')
 
-@stats_bp.route('/')
-@login_required
-def stats_dashboard():
+# الجداول التي تعتمد عليها إحصائيات اللوحة (وسوم كاش البيانات المجمعة)
+DASHBOARD_TAGS = ('products', 'categories', 'branches', 'dealers', 'users', 'product_movements', 'stock_balances')
+
+def dashboard_stats():
+    """إحصائيات لوحة الإحصائيات (قيم JSON لتُحفظ في كاش البيانات المجمعة)"""
     # الإحصائيات العامة
     total_products = Product.query.count()
-    total_stock_value = sum([p.price * p.quantity for p in Product.query.all()])
+    total_stock_value = db.session.query(func.coalesce(func.sum(Product.price * Product.quantity), 0)).scalar()
     total_branches = Branch.query.count()
     total_dealers = Dealer.query.count()
     total_categories = Category.query.count()
     total_users = User.query.count()
 
-    # إحصائيات الحركة
-    total_movements = ProductMovement.query.count()
-    today_movements = ProductMovement.query.filter(
-        func.date(ProductMovement.timestamp) == datetime.now().date()
-    ).count()
+    # إحصائيات الحركة (من الملخص اليومي، ويشمل الحركات المؤرشفة)
+    movements_count = func.coalesce(func.sum(DailyMovementRollup.movements_count), 0)
+    total_movements = db.session.query(movements_count).filter(DailyMovementRollup.scope()).scalar()
+    today = datetime.now().date()
+    today_movements = db.session.query(movements_count).filter(
+        DailyMovementRollup.scope(), DailyMovementRollup.movement_date == today
+    ).scalar()
 
     # إحصائيات الفروع
     branches_data = []
     branches = Branch.query.all()
+    # عدد حركات كل الفروع في استعلام واحد
+    branches_movements = dict(db.session.query(
+        DailyMovementRollup.branch_id, movements_count
+    ).filter(DailyMovementRollup.branch_id != DailyMovementRollup.ALL_BRANCHES).group_by(DailyMovementRollup.branch_id))
+    # عدد المنتجات المتوفرة وقيمة المخزون لكل الفروع من جدول الأرصدة في استعلام واحد
+    stock_totals = Branch.get_stock_totals()
     for branch in branches:
-        # عدد المنتجات في الفرع
-        branch_products = sum([1 for p in Product.query.all() if branch.get_product_quantity(p.id) > 0])
-        # قيمة المخزون في الفرع
-        branch_stock_value = sum([
-            p.price * branch.get_product_quantity(p.id)
-            for p in Product.query.all()
-            if branch.get_product_quantity(p.id) > 0
-        ])
-        # عدد الحركات للفرع
-        branch_movements = ProductMovement.query.filter(
-            ((ProductMovement.source_type == 'branch') & (ProductMovement.source_id == branch.id)) |
-            ((ProductMovement.destination_type == 'branch') & (ProductMovement.destination_id == branch.id))
-        ).count()
-
+        totals = stock_totals.get(branch.id, {'products_count': 0, 'stock_value': 0})
         branches_data.append({
             'id': branch.id,
             'name': branch.name,
-            'products_count': branch_products,
-            'stock_value': branch_stock_value,
-            'movements_count': branch_movements
+            'products_count': totals['products_count'],
+            'stock_value': totals['stock_value'],
+            'movements_count': branches_movements.get(branch.id, 0)
         })
 
     # إحصائيات الحركة حسب النوع
     movements_by_type = db.session.query(
-        ProductMovement.type,
-        func.count(ProductMovement.id).label('count')
-    ).group_by(ProductMovement.type).all()
+        DailyMovementRollup.type,
+        movements_count.label('count')
+    ).filter(DailyMovementRollup.scope()).group_by(DailyMovementRollup.type)
 
     # إحصائيات الحركة في آخر 7 أيام
-    last_week = datetime.now() - timedelta(days=7)
     weekly_movements = db.session.query(
-        func.date(ProductMovement.timestamp).label('date'),
-        func.count(ProductMovement.id).label('count')
-    ).filter(ProductMovement.timestamp >= last_week).group_by(
-        func.date(ProductMovement.timestamp)
-    ).order_by(func.date(ProductMovement.timestamp)).all()
+        DailyMovementRollup.movement_date.label('date'),
+        movements_count.label('count')
+    ).filter(
+        DailyMovementRollup.scope(), DailyMovementRollup.movement_date >= today - timedelta(days=7)
+    ).group_by(DailyMovementRollup.movement_date).order_by(DailyMovementRollup.movement_date)
 
     # المنتجات الأكثر حركة
     top_products = db.session.query(
         Product.name,
-        func.count(ProductMovement.id).label('movements_count')
-    ).join(ProductMovement).group_by(Product.id, Product.name).order_by(
-        func.count(ProductMovement.id).desc()
-    ).limit(10).all()
+        movements_count.label('movements_count')
+    ).join(DailyMovementRollup, DailyMovementRollup.product_id == Product.id).filter(
+        DailyMovementRollup.scope()
+    ).group_by(Product.id, Product.name).order_by(movements_count.desc()).limit(10)
 
     # المنتجات منخفضة المخزون (أقل من 10)
-    low_stock_products = Product.query.filter(Product.quantity < 10).all()
+    low_stock_products = db.session.query(Product.name, Product.quantity).filter(Product.quantity < 10)
 
     # إحصائيات الورديات
     shift_stats = db.session.query(
-        ProductMovement.shift,
-        func.count(ProductMovement.id).label('count')
-    ).group_by(ProductMovement.shift).all()
-
-    return render_template('stats/dashboard.html',
-                         title='الإحصائيات',
-                         total_products=total_products,
-                         total_stock_value=total_stock_value,
-                         total_branches=total_branches,
-                         total_dealers=total_dealers,
-                         total_categories=total_categories,
-                         total_users=total_users,
-                         total_movements=total_movements,
-                         today_movements=today_movements,
-                         branches_data=branches_data,
-                         movements_by_type=movements_by_type,
-                         weekly_movements=weekly_movements,
-                         top_products=top_products,
-                         low_stock_products=low_stock_products,
-                         shift_stats=shift_stats)
+        DailyMovementRollup.shift,
+        movements_count.label('count')
+    ).filter(DailyMovementRollup.scope()).group_by(DailyMovementRollup.shift)
+
+    return {
+        'total_products': total_products,
+        'total_stock_value': total_stock_value,
+        'total_branches': total_branches,
+        'total_dealers': total_dealers,
+        'total_categories': total_categories,
+        'total_users': total_users,
+        'total_movements': total_movements,
+        'today_movements': today_movements,
+        'branches_data': branches_data,
+        'movements_by_type': [row._asdict() for row in movements_by_type],
+        'weekly_movements': [row._asdict() for row in weekly_movements],
+        'top_products': [row._asdict() for row in top_products],
+        'low_stock_products': [row._asdict() for row in low_stock_products],
+        'shift_stats': [row._asdict() for row in shift_stats],
+    }
+
+@stats_bp.route('/')
+@login_required
+def stats_dashboard():
+    # الإحصائيات تتغير فقط مع الكتابة في جداولها، لذلك تُقرأ من كاش البيانات المجمعة
+    stats = cached(f'stats:dashboard:{datetime.now().date()}', DASHBOARD_TAGS, dashboard_stats)
+    return render_template('stats/dashboard.html', title='الإحصائيات', **stats)
 
 @stats_bp.route('/api/branch/<int:branch_id>')
 @login_required
 def branch_stats(branch_id):
     branch = Branch.query.get_or_404(branch_id)
-
-    # إحصائيات الفرع
-    branch_products = []
-    for product in Product.query.all():
-        quantity = branch.get_product_quantity(product.id)
-        if quantity > 0:
-            branch_products.append({
-                'name': product.name,
-                'quantity': quantity,
-                'value': product.price * quantity
-            })
-
-    # حركات الفرع في آخر 30 يوم
+    return jsonify(cached(
+        f'stats:branch:{branch.id}:{datetime.now().date()}', (branch_tag(branch.id), 'products', 'branches'),
+        lambda: branch_stats_data(branch)
+    ))
+
+def branch_stats_data(branch):
+    """إحصائيات فرع للنافذة التفصيلية في لوحة الإحصائيات"""
+    # المنتجات المتوفرة في الفرع من جدول الأرصدة في استعلام واحد
+    branch_products = [{
+        'name': name,
+        'quantity': quantity,
+        'value': price * quantity
+    } for name, price, quantity in db.session.query(Product.name, Product.price, StockBalance.quantity).join(
+        StockBalance, StockBalance.product_id == Product.id
+    ).filter(
+        StockBalance.location_type == 'branch',
+        StockBalance.location_id == branch.id,
+        StockBalance.quantity > 0
+    ).order_by(Product.id)]
+
+    # ملخص حركات الفرع في آخر 30 يوم حسب النوع (من الملخص اليومي)
     last_month = datetime.now() - timedelta(days=30)
-    branch_movements = ProductMovement.query.filter(
+    movements_summary = db.session.query(
+        DailyMovementRollup.type,
+        func.sum(DailyMovementRollup.movements_count),
+        func.sum(DailyMovementRollup.total_quantity)
+    ).filter(
+        DailyMovementRollup.scope(branch.id), DailyMovementRollup.movement_date >= last_month.date()
+    ).group_by(DailyMovementRollup.type).all()
+
+    # آخر حركات الفرع في نفس الفترة
+    branch_movements = ProductMovement.query.options(*ProductMovement.eager_options()).filter(
         and_(
-            ((ProductMovement.source_type == 'branch') & (ProductMovement.source_id == branch_id)) |
-            ((ProductMovement.destination_type == 'branch') & (ProductMovement.destination_id == branch_id)),
+            ProductMovement.involving('branch', branch.id),
             ProductMovement.timestamp >= last_month
         )
     ).order_by(ProductMovement.timestamp.desc()).limit(20).all()
 
-    return jsonify({
+    return {
         'branch': {
             'id': branch.id,
             'name': branch.name,
@@ -141,6 +164,10 @@ def branch_stats(branch_id):
             'total_value': sum(p['value'] for p in branch_products)
         },
         'products': branch_products,
+        'movements_summary': [
+            {'type': movement_type, 'count': count, 'quantity': quantity}
+            for movement_type, count, quantity in movements_summary
+        ],
         'movements': [{
             'id': m.id,
             'product': m.product.name,
@@ -148,7 +175,7 @@ def branch_stats(branch_id):
             'quantity': m.quantity,
             'timestamp': m.timestamp.strftime('%Y-%m-%d %H:%M')
         } for m in branch_movements]
-    })
+    }
 
 @stats_bp.route('/export/excel')
 @login_required
@@ -192,7 +219,9 @@ def export_stats_excel():
                 ['إجمالي الفروع', Branch.query.count()],
                 ['إجمالي التجار', Dealer.query.count()],
                 ['إجمالي المستخدمين', User.query.count()],
-                ['إجمالي الحركات', ProductMovement.query.count()]
+                ['إجمالي الحركات', db.session.query(
+                    func.coalesce(func.sum(DailyMovementRollup.movements_count), 0)
+                ).filter(DailyMovementRollup.scope()).scalar()]
             ]
 
             df_general = pd.DataFrame(general_stats[1:], columns=general_stats[0])
@@ -206,14 +235,15 @@ def export_stats_excel():
             worksheet.set_column(1, 1, 15)
 
             # 2. المنتجات الأكثر حركة
+            total_moved = func.sum(DailyMovementRollup.total_quantity)
             top_products = db.session.query(
                 Product.name,
-                func.sum(ProductMovement.quantity).label('total_moved')
-            ).join(ProductMovement).group_by(Product.id, Product.name).order_by(
-                func.sum(ProductMovement.quantity).desc()
-            ).limit(10).all()
+                total_moved.label('total_moved')
+            ).join(DailyMovementRollup, DailyMovementRollup.product_id == Product.id).filter(
+                DailyMovementRollup.scope()
+            ).group_by(Product.id, Product.name).order_by(total_moved.desc()).limit(10).all()
 
-            products_data = [[product.name, total_moved] for product, total_moved in top_products]
+            products_data = [[name, total_moved] for name, total_moved in top_products]
             df_products = pd.DataFrame(products_data, columns=['المنتج', 'إجمالي الحركة'])
             df_products.to_excel(writer, sheet_name='المنتجات الأكثر حركة', index=False)
 
@@ -226,13 +256,14 @@ def export_stats_excel():
 
             # 3. إحصائيات الفروع
             branches_data = []
+            stock_totals = Branch.get_stock_totals()
             for branch in Branch.query.all():
-                total_value = branch.get_total_stock_value()
+                totals = stock_totals.get(branch.id, {'products_count': 0, 'stock_value': 0})
                 movements_stats = branch.get_movements_stats()
                 branches_data.append([
                     branch.name,
-                    len(branch.get_all_products_with_quantities()),
-                    total_value,
+                    totals['products_count'],
+                    totals['stock_value'],
                     movements_stats['today'],
                     movements_stats['week'],
                     movements_stats['month']
@@ -254,7 +285,7 @@ def export_stats_excel():
 
             # 4. حركات الشهر الحالي
             current_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            monthly_movements = ProductMovement.query.filter(
+            monthly_movements = ProductMovement.query.options(*ProductMovement.eager_options()).filter(
                 ProductMovement.timestamp >= current_month
             ).order_by(ProductMovement.timestamp.desc()).all()
 
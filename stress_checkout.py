@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+اختبار ضغط لعمليات البيع المتزامنة في نقطة البيع
+
+ينشئ قاعدة بيانات SQLite مؤقتة بفرع واحد ومخزون محدود، ثم يرسل مئات عمليات البيع
+المتزامنة إلى /pos/api/checkout من عدة "كاشير" في نفس الوقت، ويتحقق من أن:
+- رصيد الفرع لم يصبح سالباً أبداً
+- عدد القطع المباعة = المخزون الابتدائي - الرصيد النهائي
+- جدول الأرصدة مطابق لسجل الحركات
+
+الاستخدام: python stress_checkout.py [عدد العمليات] [عدد الخيوط] [المخزون الابتدائي]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+def stress_checkout(sales=300, workers=24, initial_stock=200):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+
+    from app import create_app
+    from models import db
+    from models.user import User
+    from models.branch import Branch
+    from models.category import Category
+    from models.product import Product
+    from models.movement import ProductMovement
+    from models.stock_balance import StockBalance
+
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        category = Category(name='ضغط')
+        branch = Branch(name='فرع الضغط')
+        db.session.add_all([category, branch])
+        db.session.flush()
+        cashiers = []
+        for i in range(workers):
+            user = User(username=f'cashier{i}', role='branch_employee', shift='morning', branch_id=branch.id)
+            user.set_password('x')
+            cashiers.append(user)
+        db.session.add_all(cashiers)
+        products = [Product(name=f'منتج {i}', category_id=category.id, price=5, quantity=0) for i in range(3)]
+        db.session.add_all(products)
+        db.session.flush()
+        for product in products:
+            db.session.add(ProductMovement(
+                product_id=product.id, user_id=cashiers[0].id, shift='morning', type='in',
+                quantity=initial_stock, timestamp=datetime.utcnow(), source_type='warehouse',
+                source_id=None, destination_type='branch', destination_id=branch.id
+            ))
+        db.session.commit()
+        branch_id = branch.id
+        cashier_ids = [user.id for user in cashiers]
+        product_ids = [product.id for product in products]
+
+    lowest = {product_id: initial_stock for product_id in product_ids}
+    lock = threading.Lock()
+    statuses = {}
+
+    def sell(n):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(cashier_ids[n % len(cashier_ids)])
+        # كل عملية تشتري من كل المنتجات بكميات مختلفة
+        items = [{'id': product_id, 'price': 5, 'quantity': 1 + (n + i) % 3} for i, product_id in enumerate(product_ids)]
+        response = client.post('/pos/api/checkout', json={'items': items, 'paid': 0})
+        with app.app_context():
+            quantities = StockBalance.get_quantities('branch', branch_id, product_ids)
+            db.session.remove()
+        with lock:
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            for product_id, quantity in quantities.items():
+                lowest[product_id] = min(lowest[product_id], quantity)
+        return response.status_code, items
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(sell, range(sales)))
+
+    ok = True
+    with app.app_context():
+        final = StockBalance.get_quantities('branch', branch_id, product_ids)
+        for product_id in product_ids:
+            sold = sum(item['quantity'] for status, items in results if status == 200
+                       for item in items if item['id'] == product_id)
+            print(f'المنتج {product_id}: مباع {sold}، الرصيد النهائي {final[product_id]}، أقل رصيد {lowest[product_id]}')
+            if final[product_id] < 0 or lowest[product_id] < 0 or sold != initial_stock - final[product_id]:
+                ok = False
+        before = {(b.location_type, b.location_id, b.product_id): b.quantity for b in StockBalance.query if b.quantity}
+        StockBalance.rebuild()
+        after = {(b.location_type, b.location_id, b.product_id): b.quantity for b in StockBalance.query if b.quantity}
+        if before != after:
+            print('❌ جدول الأرصدة لا يطابق سجل الحركات')
+            ok = False
+        db.session.remove()
+        db.engine.dispose()
+
+    os.remove(path)
+    print(f'حالات الاستجابة: {statuses}')
+    print('✅ لم يحدث بيع بأكثر من المخزون' if ok else '❌ فشل اختبار التزامن')
+    return ok
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:4]]
+    sys.exit(0 if stress_checkout(*args) else 1)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Script لأخذ لقطات أرصدة المخزون اليومية (stock_snapshots)
+يُشغّل يومياً (مثلاً عبر cron) ويكمل أي أيام ناقصة منذ آخر لقطة حتى أمس.
+يمكن تمرير تاريخ محدد: python take_stock_snapshots.py 2024-01-31
+"""
+
+import sys
+from datetime import datetime, timedelta
+from app import create_app
+from models import db
+from models.stock_snapshot import StockSnapshot
+
+def take_stock_snapshots(until=None):
+    """أخذ لقطة لكل يوم بعد آخر لقطة وحتى التاريخ المحدد (افتراضياً أمس)"""
+    db.create_all()
+    until = until or (datetime.utcnow().date() - timedelta(days=1))
+    latest = StockSnapshot.latest_date(until)
+    day = latest + timedelta(days=1) if latest else until
+    while day <= until:
+        rows = StockSnapshot.take(day)
+        print(f"✅ لقطة {day}: {rows} رصيد")
+        day += timedelta(days=1)
+
+if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        until = datetime.strptime(sys.argv[1], '%Y-%m-%d').date() if len(sys.argv) > 1 else None
+        take_stock_snapshots(until)
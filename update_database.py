@@ -16,6 +16,10 @@ from models.movement import ProductMovement
 from models.request import ProductRequest
 from models.notification import BranchNotification
 from models.branch_inventory import BranchInventory
+from rebuild_stock_balances import rebuild_stock_balances
+from backfill_daily_sales_summary import backfill_daily_sales_summary
+from backfill_movement_rollups import backfill_movement_rollups
+from rebuild_search_index import rebuild_search_index
 from sqlalchemy import text
 
 def update_database():
@@ -154,10 +158,71 @@ def add_customers_table_and_column():
         except Exception as e:
             print('customer_id:', e)
 
+def add_stock_balance_version_column():
+    """إضافة عمود إصدار الكتالوج إلى جدول الأرصدة في قواعد البيانات الموجودة مسبقاً"""
+    with db.engine.begin() as conn:
+        try:
+            conn.execute(text("ALTER TABLE stock_balances ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        except Exception as e:
+            print('stock_balances.version:', e)
+
+def add_sale_idempotency_key():
+    """إضافة مفتاح منع التكرار لجدول المبيعات مع فهرس فريد"""
+    from models.sale import Sale
+    with db.engine.begin() as conn:
+        try:
+            conn.execute(text("ALTER TABLE sales ADD COLUMN idempotency_key VARCHAR(64)"))
+        except Exception as e:
+            print('idempotency_key:', e)
+    for index in Sale.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+def add_movement_indexes():
+    """إنشاء فهارس جدول الحركات في قواعد البيانات الموجودة مسبقاً"""
+    for index in ProductMovement.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+        print(f'✅ الفهرس {index.name} جاهز')
+
+def add_notification_indexes():
+    """إنشاء فهارس جدول الإشعارات في قواعد البيانات الموجودة مسبقاً"""
+    from models.notification import BranchNotification
+    for index in BranchNotification.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+        print(f'✅ الفهرس {index.name} جاهز')
+
+def add_outbox_topic_column():
+    """إضافة عمود topic (لبث SSE) إلى صندوق الأحداث مع فهارسه"""
+    from models.outbox import OutboxEvent
+    OutboxEvent.__table__.create(db.engine, checkfirst=True)
+    with db.engine.begin() as conn:
+        try:
+            conn.execute(text("ALTER TABLE outbox_events ADD COLUMN topic VARCHAR(32)"))
+        except Exception as e:
+            print('outbox_events.topic:', e)
+    for index in OutboxEvent.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+def rebuild_notification_counters():
+    """إنشاء جدول عدادات الإشعارات غير المقروءة وحسابها من الإشعارات الموجودة"""
+    from models.notification_counter import NotificationCounter
+    NotificationCounter.__table__.create(db.engine, checkfirst=True)
+    NotificationCounter.rebuild()
+    print('✅ تم حساب عدادات الإشعارات غير المقروءة')
+
 if __name__ == "__main__":
     app = create_app()
     with app.app_context():
         update_database()
         add_new_sale_columns()
         add_customers_table_and_column()
+        add_movement_indexes()
+        add_stock_balance_version_column()
+        add_sale_idempotency_key()
+        add_notification_indexes()
+        add_outbox_topic_column()
+        rebuild_notification_counters()
+        rebuild_stock_balances()
+        backfill_daily_sales_summary()
+        backfill_movement_rollups()
+        rebuild_search_index()
         print('تم تحديث جدول المبيعات وجدول العملاء بنجاح.')
\ No newline at end of file